@@ -0,0 +1,257 @@
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, QTimer, QRect, QStandardPaths
+
+from layers import TILE_SIZE, tileKeysIn
+from savetask import SaveSignals
+
+import glob
+import os
+import struct
+import tempfile
+import uuid
+import zlib
+
+# Crash recovery files, kept in one directory:
+#   autosave-<token>.pev  a full project, rewritten whenever the journal is compacted
+#   autosave.pevj         JOURNAL_HEADER naming that project, then batches of changed tiles
+# Every batch ends with a commit record. A batch cut short by a crash has none and is ignored,
+# as is anything after a record whose checksum doesn't match.
+JOURNAL_NAME = "autosave.pevj"
+JOURNAL_MAGIC = b"PEVJRNL1"
+JOURNAL_HEADER = struct.Struct("<8s32s4s")
+# layer, x, y, width, height, data length, crc32 of data
+RECORD = struct.Struct("<IIIIIII")
+COMMIT = 0xFFFFFFFF
+
+def defaultDirectory():
+    return os.path.join(QStandardPaths.writableLocation(QStandardPaths.AppDataLocation), "autosave")
+
+def basePath(directory, token):
+    return os.path.join(directory, f"autosave-{token}.pev")
+
+# Creates an empty journal on top of the base project token, replacing the old one in one step
+def writeJournalHeader(path, token, compression):
+    fd, tempPath = tempfile.mkstemp(prefix=".pasteven-", suffix=".tmp", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, token.encode("ascii"), compression.encode("ascii")))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tempPath, path)
+    except BaseException:
+        if os.path.exists(tempPath):
+            os.remove(tempPath)
+        raise
+
+# Returns the base token, compression and the (layer, rect, data) records of every committed batch
+def readJournal(path):
+    with open(path, "rb") as file:
+        data = file.read()
+    if len(data) < JOURNAL_HEADER.size:
+        raise ValueError(f"{path} is truncated")
+    magic, token, compression = JOURNAL_HEADER.unpack_from(data)
+    if magic != JOURNAL_MAGIC:
+        raise ValueError(f"{path} is not a PastEven autosave journal")
+    records, batch = [], []
+    offset = JOURNAL_HEADER.size
+    while offset + RECORD.size <= len(data):
+        layer, x, y, width, height, length, checksum = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        if layer == COMMIT:
+            records += batch
+            batch = []
+            continue
+        chunk = data[offset:offset + length]
+        if len(chunk) < length or zlib.crc32(chunk) != checksum:
+            break
+        batch.append((layer, QRect(x, y, width, height), chunk))
+        offset += length
+    return token.decode("ascii"), compression.decode("ascii"), records
+
+# Returns the journal in directory if it and its base project survived, i.e. the last session crashed
+def findRecovery(directory):
+    path = os.path.join(directory, JOURNAL_NAME)
+    try:
+        token, _, _ = readJournal(path)
+    except (OSError, ValueError, struct.error):
+        return None
+    return path if os.path.exists(basePath(directory, token)) else None
+
+# Rebuilds the autosaved document: the base project with the journal's tiles on top.
+# The journal is checked against its base and decoded first, a damaged one leaves the document as it was.
+def recoverJournal(directory, layerStack, history, strokeLog=None):
+    from project import ProjectReader, openProject, decompress, writePixels
+    token, compression, records = readJournal(os.path.join(directory, JOURNAL_NAME))
+    path = basePath(directory, token)
+    reader = ProjectReader(path)
+    manifest = reader.manifest
+    reader.close()
+    bounds = QRect(0, 0, manifest["width"], manifest["height"])
+    # Only the newest copy of each tile counts
+    latest = {(layer, rect.x(), rect.y(), rect.width(), rect.height()): (layer, rect, data) for layer, rect, data in records}
+    tiles = []
+    for layer, rect, data in latest.values():
+        pixels = decompress(data, compression)
+        if layer >= len(manifest["layers"]) or not bounds.contains(rect) or len(pixels) != rect.width() * rect.height() * 4:
+            raise ValueError("autosave journal doesn't match its base project")
+        tiles.append((layer, rect, pixels))
+
+    openProject(path, layerStack, history, strokeLog)
+    for layer, rect, pixels in tiles:
+        # Decoding the base tile first keeps it from landing on top of this record later.
+        # Tiles the journal doesn't touch stay on disk, like in any opened project.
+        layerStack.ensureLoaded(rect)
+        writePixels(layerStack.layers[layer].image, rect, pixels)
+        layerStack.markUsed(rect)
+    layerStack.invalidateCache()
+
+# Appends one batch of tile copies to the journal
+class JournalTask(QRunnable):
+    def __init__(self, path, tiles, compression):
+        super().__init__()
+        self.path = path
+        self.tiles = tiles
+        self.compression = compression
+        self.signals = SaveSignals()
+
+    def run(self):
+        from project import compress, readPixels
+        try:
+            parts = []
+            for layer, rect, tile in self.tiles:
+                data = compress(readPixels(tile, tile.rect()), self.compression)
+                parts.append(RECORD.pack(layer, rect.x(), rect.y(), rect.width(), rect.height(), len(data), zlib.crc32(data)))
+                parts.append(data)
+            parts.append(RECORD.pack(COMMIT, 0, 0, 0, 0, 0, 0))
+            with open(self.path, "ab") as file:
+                file.write(b"".join(parts))
+                file.flush()
+                os.fsync(file.fileno())
+            self.signals.finished.emit(self.path)
+        except Exception as error:
+            self.signals.failed.emit(self.path, str(error))
+
+# Writes a new base project through save (a ProjectSaveTask), starts an empty journal on it
+# and removes older bases
+class CompactTask(QRunnable):
+    def __init__(self, save, directory, token):
+        super().__init__()
+        self.save = save
+        self.signals = save.signals
+        self.directory = directory
+        self.token = token
+
+    def run(self):
+        path = self.save.path
+        try:
+            self.save.writeAtomically()
+            writeJournalHeader(os.path.join(self.directory, JOURNAL_NAME), self.token, self.save.compression)
+            for oldPath in glob.glob(os.path.join(self.directory, "autosave-*.pev")):
+                if oldPath != path:
+                    os.remove(oldPath)
+            self.signals.finished.emit(path)
+        except Exception as error:
+            self.signals.failed.emit(path, str(error))
+
+# Periodically writes the tiles changed since the last autosave to the journal on a worker thread.
+# Only cheap tile copies are taken on the GUI thread, and nothing is taken mid-stroke.
+# Layer changes and a journal grown past compactBytes rewrite the base project instead.
+class Autosave(QObject):
+    def __init__(self, canvas, interval=10000, compactBytes=64 * 1024 * 1024):
+        super().__init__(canvas)
+        self.canvas = canvas
+        self.directory = None
+        self.compactBytes = compactBytes
+        # Compression of the current base, the journal uses the same
+        self.compression = None
+        self.dirtyTiles = set()
+        self.needsBase = True
+        self.hasBase = False
+        self.journalBytes = 0
+        self.busy = False
+        self.tasks = set()
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.timer = QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.save)
+
+    def start(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.timer.start()
+
+    # Records that pixels under rect changed
+    def markDirty(self, rect):
+        if self.directory:
+            self.dirtyTiles.update(tileKeysIn(QRect(rect).intersected(self.canvas.layers.rect())))
+
+    # Layers were added, removed, reordered or replaced, tile records can't describe that
+    def documentChanged(self):
+        self.needsBase = True
+        self.dirtyTiles.clear()
+
+    def save(self):
+        if self.busy or not self.directory or self.canvas.history.pending is not None:
+            return
+        if self.needsBase or not self.hasBase or self.journalBytes > self.compactBytes:
+            self.compact()
+        elif self.dirtyTiles:
+            self.appendJournal()
+
+    # The snapshot doesn't decode tiles a lazily opened project still has on disk, their
+    # compressed chunks are copied into the new base as they are
+    def compact(self):
+        from project import ProjectSaveTask, snapshotProject
+        # History isn't kept, vector strokes are saved as they are at the current version.
+        # The stroke log only makes sense together with history, so it isn't kept either.
+        snapshot = snapshotProject(self.canvas.layers, version=self.canvas.history.version())
+        self.needsBase = False
+        self.dirtyTiles.clear()
+        token = uuid.uuid4().hex
+        save = ProjectSaveTask(snapshot, basePath(self.directory, token))
+        self.compression = save.compression
+        self.startTask(CompactTask(save, self.directory, token), compacting=True)
+
+    def appendJournal(self):
+        layers = self.canvas.layers
+        tiles = []
+        for x, y in self.dirtyTiles:
+            rect = QRect(x * TILE_SIZE, y * TILE_SIZE, TILE_SIZE, TILE_SIZE).intersected(layers.rect())
+            layers.ensureLoaded(rect)
+            tiles += [(i, rect, layer.image.copy(rect)) for i, layer in enumerate(layers.layers)]
+        self.dirtyTiles.clear()
+        self.startTask(JournalTask(os.path.join(self.directory, JOURNAL_NAME), tiles, self.compression))
+
+    def startTask(self, task, compacting=False):
+        self.busy = True
+        task.signals.finished.connect(lambda path: self.taskFinished(task, compacting))
+        task.signals.failed.connect(lambda path, error: self.taskFailed(task, path, error))
+        self.tasks.add(task)
+        self.pool.start(task)
+
+    def taskFinished(self, task, compacting):
+        self.tasks.discard(task)
+        self.busy = False
+        if compacting:
+            self.hasBase = True
+        try:
+            self.journalBytes = os.path.getsize(os.path.join(self.directory, JOURNAL_NAME))
+        except OSError:
+            # Unreadable right now, counted as empty until the next append measures it again
+            self.journalBytes = 0
+
+    def taskFailed(self, task, path, error):
+        self.tasks.discard(task)
+        self.busy = False
+        # Whatever didn't make it to disk is covered by a fresh base next time
+        self.needsBase = True
+        self.canvas.saveFailed.emit(path, error)
+
+    # Removes the recovery files, called when the app closes normally
+    def discard(self):
+        self.timer.stop()
+        self.pool.waitForDone()
+        if self.directory:
+            for path in glob.glob(os.path.join(self.directory, "autosave-*.pev")) + [os.path.join(self.directory, JOURNAL_NAME)]:
+                if os.path.exists(path):
+                    os.remove(path)
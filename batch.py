@@ -0,0 +1,185 @@
+# Headless batch processing, no window needed
+# e.g. python batch.py saves/ -o out/ --border 50:150:3 --clear 0,0,100,100 --resize 50% --format webp
+
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import argparse
+import os
+import sys
+import tempfile
+import cv2
+import numpy as np
+
+from border import detectBorderMask
+from savetask import replaceFile
+
+IMAGE_EXTENSIONS = ('.png', '.jpeg', '.jpg', '.bmp', '.webp', '.tif', '.tiff')
+# Formats that can't store transparency get their alpha channel dropped
+OPAQUE_EXTENSIONS = ('.jpeg', '.jpg', '.bmp')
+
+# Finds the outlines in the image and draws them in black, like the Border button
+def applyBorder(pixels, low, high, thickness):
+    mask = detectBorderMask(pixels, low, high, thickness)
+    pixels[mask == 255] = (0, 0, 0, 255)
+    return pixels
+
+# Makes a region transparent, like deleting a selection
+def applyClear(pixels, x, y, width, height):
+    pixels[max(y, 0):y + height, max(x, 0):x + width] = 0
+    return pixels
+
+def applyCrop(pixels, x, y, width, height):
+    return np.ascontiguousarray(pixels[max(y, 0):y + height, max(x, 0):x + width])
+
+# Resizes to an exact size, or by a percentage when height is None
+def applyResize(pixels, width, height):
+    if height is None:
+        scale = width / 100
+        width = max(round(pixels.shape[1] * scale), 1)
+        height = max(round(pixels.shape[0] * scale), 1)
+    shrinking = width * height < pixels.shape[0] * pixels.shape[1]
+    return cv2.resize(pixels, (width, height), interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_CUBIC)
+
+OPERATIONS = {
+    "border": applyBorder,
+    "clear": applyClear,
+    "crop": applyCrop,
+    "resize": applyResize,
+}
+
+# Loads any image as a BGRA array
+def readImage(path):
+    pixels = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if pixels is None:
+        raise OSError(f"Could not read {path}")
+    if pixels.ndim == 2:
+        return cv2.cvtColor(pixels, cv2.COLOR_GRAY2BGRA)
+    if pixels.dtype != np.uint8:
+        pixels = cv2.convertScaleAbs(pixels, alpha=255 / np.iinfo(pixels.dtype).max)
+    if pixels.shape[2] == 3:
+        return cv2.cvtColor(pixels, cv2.COLOR_BGR2BGRA)
+    return pixels
+
+# Writes through a temp file and a rename so an interrupted run never leaves half-written files
+def writeImage(path, pixels):
+    extension = os.path.splitext(path)[1].lower()
+    if extension in OPAQUE_EXTENSIONS:
+        pixels = cv2.cvtColor(pixels, cv2.COLOR_BGRA2BGR)
+    fd, tempPath = tempfile.mkstemp(prefix=".pasteven-", suffix=extension, dir=os.path.dirname(os.path.abspath(path)))
+    os.close(fd)
+    try:
+        if not cv2.imwrite(tempPath, pixels):
+            raise OSError(f"Could not encode {path}")
+        replaceFile(tempPath, path)
+    except BaseException:
+        if os.path.exists(tempPath):
+            os.remove(tempPath)
+        raise
+
+# Runs the whole pipeline on one file, in a worker process
+def processFile(job):
+    inputPath, outputPath, operations = job
+    try:
+        pixels = readImage(inputPath)
+        for name, args in operations:
+            pixels = OPERATIONS[name](pixels, *args)
+        writeImage(outputPath, pixels)
+        return inputPath, outputPath, None
+    except Exception as error:
+        return inputPath, outputPath, str(error)
+
+# Expands directories into the images they contain
+def collectInputs(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+# Yields results as they finish, keeping at most maxPending files in flight so memory stays bounded
+def runJobs(jobs, workers):
+    maxPending = workers * 2
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        for job in jobs:
+            pending.add(pool.submit(processFile, job))
+            if len(pending) >= maxPending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in pending:
+            yield future.result()
+
+def parseRect(text):
+    x, y, width, height = (int(value) for value in text.split(","))
+    return x, y, width, height
+
+def parseBorder(text):
+    low, high, thickness = (int(value) for value in text.split(":"))
+    return low, high, thickness
+
+def parseSize(text):
+    if text.endswith("%"):
+        return float(text[:-1]), None
+    width, height = (int(value) for value in text.lower().split("x"))
+    return width, height
+
+# Keeps every operation in one list, in the order given on the command line
+class OperationAction(argparse.Action):
+    def __call__(self, parser, namespace, values, option_string=None):
+        operations = getattr(namespace, self.dest) or []
+        operations.append((self.const, values))
+        setattr(namespace, self.dest, operations)
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(description="Apply PastEven operations to many images without opening a window.")
+    parser.add_argument("inputs", nargs="+", help="image files or folders of images")
+    parser.add_argument("-o", "--output", required=True, help="folder to write results to")
+    parser.add_argument("--border", dest="operations", action=OperationAction, const="border", type=parseBorder,
+                        metavar="LOW:HIGH:THICKNESS", help="draw detected borders")
+    parser.add_argument("--clear", dest="operations", action=OperationAction, const="clear", type=parseRect,
+                        metavar="X,Y,W,H", help="make a region transparent")
+    parser.add_argument("--crop", dest="operations", action=OperationAction, const="crop", type=parseRect,
+                        metavar="X,Y,W,H", help="crop to a region")
+    parser.add_argument("--resize", dest="operations", action=OperationAction, const="resize", type=parseSize,
+                        metavar="WxH|N%", help="resize to a size or by a percentage")
+    parser.add_argument("--format", help="re-encode as this format (png, jpg, webp...)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="worker processes")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parseArgs(argv)
+    operations = args.operations or []
+    os.makedirs(args.output, exist_ok=True)
+
+    # Inputs that would overwrite an earlier input's result (a.png and a.jpg with --format,
+    # or the same name in two folders) fail instead
+    outputs = {}
+    collisions = []
+    def jobs():
+        for inputPath in collectInputs(args.inputs):
+            stem, extension = os.path.splitext(os.path.basename(inputPath))
+            if args.format:
+                extension = "." + args.format.lower().lstrip(".")
+            outputPath = os.path.join(args.output, stem + extension)
+            key = os.path.normcase(os.path.abspath(outputPath))
+            if key in outputs:
+                collisions.append(inputPath)
+                print(f"FAILED {inputPath}: {outputPath} is already the output of {outputs[key]}", file=sys.stderr)
+                continue
+            outputs[key] = inputPath
+            yield inputPath, outputPath, operations
+
+    failures = 0
+    for inputPath, outputPath, error in runJobs(jobs(), max(args.jobs, 1)):
+        if error:
+            failures += 1
+            print(f"FAILED {inputPath}: {error}", file=sys.stderr)
+        else:
+            print(f"{inputPath} -> {outputPath}")
+    return 1 if failures or collisions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
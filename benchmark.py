@@ -0,0 +1,273 @@
+# Reproducible performance benchmarks for the hot paths, runs without a display
+# e.g. python benchmark.py --sizes 1500x900,4000x3000 --rates 125,1000 -o bench.json
+
+import os
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtWidgets import QApplication
+from PySide6.QtCore import QPointF, QEvent, Qt, QRect
+from PySide6.QtGui import QMouseEvent
+import PySide6
+
+import argparse
+import json
+import math
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the peak memory figure is left out there
+    resource = None
+
+from canvas import Canvas, Tools
+from border import detectBorderMask
+from imagebuffer import imageView
+from savetask import ImageSaveTask
+from project import ProjectSaveTask, snapshotProject
+from strokes import replayLog
+from vectorlayer import VectorLayer, VectorStroke
+
+FRAME_TIME = 1 / 60
+
+# Latency summary in milliseconds
+def summarize(samples):
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    def percentile(p):
+        return ordered[min(int(p / 100 * len(ordered)), len(ordered) - 1)] * 1000
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered) * 1000,
+        "p50": percentile(50),
+        "p90": percentile(90),
+        "p99": percentile(99),
+        "max": ordered[-1] * 1000,
+    }
+
+# Peak resident memory of this process in bytes, None where it can't be read
+def peakRss():
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == "darwin" else usage * 1024
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+# A smooth pseudo-random stroke sampled at rate Hz, as (timestamp, point) pairs
+def strokeTrace(rng, width, height, rate, duration):
+    phases = [rng.uniform(0, 2 * math.pi) for _ in range(4)]
+    speeds = [rng.uniform(0.5, 2.0) for _ in range(4)]
+    points = []
+    for i in range(int(rate * duration)):
+        t = i / rate
+        x = width * (0.5 + 0.2 * math.sin(speeds[0] * t * 2 * math.pi + phases[0]) + 0.2 * math.sin(speeds[1] * t * 5 + phases[1]))
+        y = height * (0.5 + 0.2 * math.cos(speeds[2] * t * 2 * math.pi + phases[2]) + 0.2 * math.sin(speeds[3] * t * 3 + phases[3]))
+        points.append((t, QPointF(x, y)))
+    return points
+
+def mouseEvent(kind, point, buttons=Qt.LeftButton):
+    return QMouseEvent(kind, point, point, Qt.LeftButton, buttons, Qt.NoModifier)
+
+# Replays a trace through the real input pipeline: events, per-frame flush and repaint
+def replayStroke(app, canvas, trace):
+    moves, frames = [], []
+    canvas.mousePressEvent(mouseEvent(QEvent.MouseButtonPress, trace[0][1]))
+    nextFrame = FRAME_TIME
+    start = time.perf_counter()
+    for t, point in trace[1:]:
+        elapsed, _ = timed(canvas.mouseMoveEvent, mouseEvent(QEvent.MouseMove, point))
+        moves.append(elapsed)
+        if t >= nextFrame:
+            frameStart = time.perf_counter()
+            canvas.strokeInput.flush()
+            app.processEvents()
+            frames.append(time.perf_counter() - frameStart)
+            nextFrame += FRAME_TIME
+    canvas.mouseReleaseEvent(mouseEvent(QEvent.MouseButtonRelease, trace[-1][1], Qt.NoButton))
+    app.processEvents()
+    total = time.perf_counter() - start
+    return moves, frames, len(trace) / total if total else 0
+
+# Times single segments straight through StrokeTool.drawLineTo, no coalescing
+def replaySegments(canvas, trace):
+    samples = []
+    tool = canvas.currentTool
+    canvas.mousePressEvent(mouseEvent(QEvent.MouseButtonPress, trace[0][1]))
+    for _, point in trace[1:]:
+        elapsed, _ = timed(tool.drawLineTo, canvas.mapToScene(point.toPoint()))
+        samples.append(elapsed)
+    canvas.mouseReleaseEvent(mouseEvent(QEvent.MouseButtonRelease, trace[-1][1], Qt.NoButton))
+    return samples
+
+def benchTools(app, canvas, rng, rates, strokes, duration):
+    width, height = canvas.canvasSize
+    results = {}
+    for tool, name in ((Tools.PENCIL, "pen"), (Tools.ERASER, "eraser")):
+        canvas.setTool(tool)
+        for rate in rates:
+            moves, frames, throughput = [], [], []
+            for _ in range(strokes):
+                strokeMoves, strokeFrames, strokeThroughput = replayStroke(app, canvas, strokeTrace(rng, width, height, rate, duration))
+                moves += strokeMoves
+                frames += strokeFrames
+                throughput.append(strokeThroughput)
+            results[f"{name}.pipeline@{rate}Hz"] = {
+                "moveEvent": summarize(moves),
+                "frame": summarize(frames),
+                "eventsPerSecond": sum(throughput) / len(throughput),
+            }
+        results[f"{name}.drawLineTo"] = summarize(replaySegments(canvas, strokeTrace(rng, width, height, rates[-1], duration)))
+    canvas.setTool(Tools.PENCIL)
+    return results
+
+# Rebuilds the recorded session on fresh canvases, at its own size and upscaled
+def benchReplay(app, canvas, scales):
+    log = canvas.strokeLog
+    results = {"strokes": len(log.strokes), "logBytes": log.bytes()}
+    for scale in scales:
+        target = Canvas(canvasSize=(round(log.width * scale), round(log.height * scale)))
+        elapsed, _ = timed(replayLog, target, log, scale)
+        results[f"replay@{scale}x"] = elapsed * 1000
+        target.deleteLater()
+        app.processEvents()
+    return results
+
+def benchHistory(canvas):
+    history = canvas.history
+    undos = [timed(canvas.undo)[0] for _ in range(history.index)]
+    redos = [timed(canvas.redo)[0] for _ in range(len(history.entries) - history.index)]
+    jumps = [timed(canvas.goToVersion, version)[0] for version in (history.firstVersion(), history.lastVersion())]
+    return {
+        "undo": summarize(undos),
+        "redo": summarize(redos),
+        "goToVersion": summarize(jumps),
+        "versions": len(history.entries),
+        "memoryBytes": history.memoryUsed,
+        "spilledBytes": history.spilledBytes(),
+        "spilledEntries": history.spilledEntries(),
+    }
+
+# Hit-testing and tile re-rasterization on a vector layer holding count short random strokes
+def benchVectors(rng, canvas, count, queries):
+    width, height = canvas.canvasSize
+    vector = VectorLayer()
+    for _ in range(count):
+        x, y = rng.uniform(0, width), rng.uniform(0, height)
+        points = [QPointF(x + rng.uniform(-40, 40), y + rng.uniform(-40, 40)) for _ in range(rng.randint(2, 40))]
+        vector.insert(VectorStroke(points, 0xff000000, rng.uniform(1, 12)))
+    version = 0
+    points = [QPointF(rng.uniform(0, width), rng.uniform(0, height)) for _ in range(queries)]
+    hits = [timed(vector.strokeAt, point, version)[0] for point in points]
+    image = canvas.image.copy()
+    tiles = [timed(vector.rasterize, image, QRect(int(point.x()), int(point.y()), 1, 1), version)[0] for point in points[:50]]
+    return {"strokes": count, "strokeAt": summarize(hits), "rasterizeTile": summarize(tiles)}
+
+def benchIO(canvas, directory):
+    imagePath = os.path.join(directory, "bench.png")
+    projectPath = os.path.join(directory, "bench.pev")
+    saveImage, _ = timed(lambda: ImageSaveTask(canvas.layers.flatten(), imagePath).run())
+    saveProject, _ = timed(lambda: ProjectSaveTask(snapshotProject(canvas.layers, canvas.history, canvas.strokeLog), projectPath).run())
+    # Images decode on a worker, the second load is served from the decoded image cache
+    loadImage, _ = timed(lambda: (canvas.loadImage(imagePath), canvas.waitForLoads()))
+    loadCachedImage, _ = timed(lambda: (canvas.loadImage(imagePath), canvas.waitForLoads()))
+    # Opening is lazy, so time the open and the full decode separately
+    openProject, _ = timed(canvas.loadProject, projectPath)
+    decodeProject, _ = timed(canvas.layers.ensureLoaded, canvas.layers.rect())
+    return {
+        "saveImage": saveImage * 1000,
+        "saveProject": saveProject * 1000,
+        "loadImage": loadImage * 1000,
+        "loadCachedImage": loadCachedImage * 1000,
+        "openProject": openProject * 1000,
+        "decodeProject": decodeProject * 1000,
+        "imageBytes": os.path.getsize(imagePath),
+        "projectBytes": os.path.getsize(projectPath),
+    }
+
+def benchBorder(canvas, repeats):
+    rect = QRect(canvas.image.rect())
+    samples = [timed(detectBorderMask, imageView(canvas.image, rect))[0] for _ in range(repeats)]
+    return summarize(samples)
+
+def gitCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def runBenchmarks(app, args):
+    results = []
+    for size in args.sizes:
+        rng = random.Random(args.seed)
+        canvas = Canvas(canvasSize=size)
+        canvas.resize(1280, 800)
+        canvas.show()
+        app.processEvents()
+        entry = {"canvas": f"{size[0]}x{size[1]}"}
+        entry["tools"] = benchTools(app, canvas, rng, args.rates, args.strokes, args.duration)
+        entry["replay"] = benchReplay(app, canvas, (1, 2))
+        entry["history"] = benchHistory(canvas)
+        entry["border"] = benchBorder(canvas, args.repeats)
+        entry["vectors"] = benchVectors(rng, canvas, args.vectorStrokes, 1000)
+        with tempfile.TemporaryDirectory() as directory:
+            entry["io"] = benchIO(canvas, directory)
+        entry["peakRssBytes"] = peakRss()
+        results.append(entry)
+        canvas.waitForSaves()
+        canvas.close()
+        canvas.deleteLater()
+        app.processEvents()
+    return {
+        "meta": {
+            "commit": gitCommit(),
+            "python": platform.python_version(),
+            "pyside": PySide6.__version__,
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "rates": args.rates,
+            "strokes": args.strokes,
+            "strokeSeconds": args.duration,
+            "vectorStrokes": args.vectorStrokes,
+        },
+        "results": results,
+    }
+
+def parseSizes(text):
+    return [tuple(int(value) for value in size.lower().split("x")) for size in text.split(",")]
+
+def parseRates(text):
+    return [int(rate) for rate in text.split(",")]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark PastEven's drawing, history, border and file paths.")
+    parser.add_argument("--sizes", type=parseSizes, default=parseSizes("1500x900,4000x3000"), help="canvas sizes, e.g. 1500x900,4000x3000")
+    parser.add_argument("--rates", type=parseRates, default=parseRates("125,500,1000"), help="input rates in Hz")
+    parser.add_argument("--strokes", type=int, default=5, help="strokes per tool and rate")
+    parser.add_argument("--duration", type=float, default=1.0, help="seconds of input per stroke")
+    parser.add_argument("--repeats", type=int, default=5, help="runs of the border benchmark")
+    parser.add_argument("--vector-strokes", dest="vectorStrokes", type=int, default=20000, help="strokes on the vector layer benchmark")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("-o", "--output", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    report = json.dumps(runBenchmarks(app, args), indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(report + "\n")
+    else:
+        print(report)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+from PySide6.QtWidgets import QDialog, QFormLayout, QSlider, QDialogButtonBox
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal, Qt
+from PySide6.QtGui import QImage, QPixmap
+
+from collections import OrderedDict
+import hashlib
+
+DEFAULT_LOW = 50
+DEFAULT_HIGH = 150
+DEFAULT_THICKNESS = 3
+
+# Finds the outlines in a (height, width, 4) BGRA array and returns them as a 0/255 mask.
+# Returns None if cancelled() turns true between steps. Needs no Qt, so batch jobs can use it too.
+def detectBorderMask(pixels, low=DEFAULT_LOW, high=DEFAULT_HIGH, thickness=DEFAULT_THICKNESS, cancelled=lambda: False):
+    import cv2
+    import numpy as np
+    gray = cv2.cvtColor(pixels, cv2.COLOR_BGRA2GRAY)
+    if cancelled():
+        return None
+    edges = cv2.Canny(gray, low, high)
+    if cancelled():
+        return None
+    # RETR_EXTERNAL only if we want outside edge
+    contours, _ = cv2.findContours(edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    mask = np.zeros(gray.shape, dtype=np.uint8)
+    cv2.drawContours(mask, contours, -1, (255), thickness)
+    
+    # This was an idea to increase the size of the border whenever the pen size is large enough
+    # cv2.drawContours(cv_image, contours, -1, (0, 0, 0), thickness = (self.ppSize // 30) + 1)
+    
+    # last number is for offset (MAMA!) 
+    # L youre wrong it was the thickness get better - Ethan
+    return mask
+
+# Hashes pixel content so unchanged regions can reuse earlier results. The shape and dtype
+# are part of it, a blank 100x200 region has the same bytes as a blank 200x100 one.
+def contentHash(pixels):
+    import numpy as np
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((pixels.shape, pixels.dtype.str)).encode("ascii"))
+    digest.update(np.ascontiguousarray(pixels).data)
+    return digest.digest()
+
+# Wraps a mask as an image that draws black wherever the mask is set
+def maskToPixmap(mask):
+    image = QImage(mask.data, mask.shape[1], mask.shape[0], mask.strides[0], QImage.Format.Format_Alpha8)
+    return QPixmap.fromImage(image)
+
+class BorderSignals(QObject):
+    finished = Signal(object, object)
+
+class BorderTask(QRunnable):
+    def __init__(self, key, pixels):
+        super().__init__()
+        self.key = key
+        self.pixels = pixels
+        self.cancelled = False
+        self.signals = BorderSignals()
+
+    def run(self):
+        _, low, high, thickness = self.key
+        mask = detectBorderMask(self.pixels, low, high, thickness, lambda: self.cancelled)
+        if mask is not None and not self.cancelled:
+            self.signals.finished.emit(self.key, mask)
+
+# Runs border detection on a worker thread. Results are memoized by
+# (content hash, low, high, thickness) and a new request cancels the one in flight.
+class BorderEngine(QObject):
+    maskReady = Signal(object, object)
+
+    def __init__(self, parent=None, cacheBytes=64 * 1024 * 1024):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.cache = OrderedDict()
+        self.cacheBytes = cacheBytes
+        self.cacheUsed = 0
+        self.current = None
+
+    # Asks for the mask of pixels, answered through maskReady(key, mask). Returns the key.
+    def request(self, pixels, pixelsHash, low, high, thickness):
+        key = (pixelsHash, low, high, thickness)
+        self.cancel()
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.maskReady.emit(key, self.cache[key])
+            return key
+        task = BorderTask(key, pixels)
+        task.signals.finished.connect(self.taskFinished)
+        self.current = task
+        self.pool.start(task)
+        return key
+
+    # Stops the running request, or drops it if it hasn't started yet
+    def cancel(self):
+        if self.current:
+            self.current.cancelled = True
+            self.pool.tryTake(self.current)
+            self.current = None
+
+    def taskFinished(self, key, mask):
+        if self.current and self.current.key == key:
+            self.current = None
+        self.cache[key] = mask
+        self.cacheUsed += mask.nbytes
+        while self.cacheUsed > self.cacheBytes and len(self.cache) > 1:
+            _, old = self.cache.popitem(last=False)
+            self.cacheUsed -= old.nbytes
+        self.maskReady.emit(key, mask)
+
+# Lets the user tune the border thresholds and thickness while an overlay previews the result
+class BorderDialog(QDialog):
+    def __init__(self, canvas, rect):
+        super().__init__(canvas)
+        self.setWindowTitle("Border")
+        self.setModal(True)
+        self.canvas = canvas
+        self.rect = rect
+        self.engine = canvas.borderEngine
+        self.mask = None
+        self.key = None
+        import numpy as np
+        # The selection can't change while the dialog is modal, so copy and hash it once
+        self.pixels = np.array(canvas.selectionPixels(rect))
+        self.pixelsHash = contentHash(self.pixels)
+
+        layout = QFormLayout(self)
+        self.lowSlider = self.addSlider(layout, "Low threshold", 0, 500, DEFAULT_LOW)
+        self.highSlider = self.addSlider(layout, "High threshold", 0, 500, DEFAULT_HIGH)
+        self.thicknessSlider = self.addSlider(layout, "Thickness", 1, 20, DEFAULT_THICKNESS)
+
+        self.buttons = QDialogButtonBox(QDialogButtonBox.Apply | QDialogButtonBox.Cancel)
+        self.buttons.button(QDialogButtonBox.Apply).clicked.connect(self.accept)
+        self.buttons.rejected.connect(self.reject)
+        layout.addRow(self.buttons)
+
+        self.overlay = canvas.scene.addPixmap(QPixmap())
+        self.overlay.setPos(rect.topLeft())
+        self.overlay.setZValue(1)
+        self.engine.maskReady.connect(self.showMask)
+        self.finished.connect(self.cleanUp)
+        self.requestPreview()
+
+    def addSlider(self, layout, label, minimum, maximum, value):
+        slider = QSlider(Qt.Horizontal)
+        slider.setRange(minimum, maximum)
+        slider.setValue(value)
+        slider.valueChanged.connect(self.requestPreview)
+        layout.addRow(label, slider)
+        return slider
+
+    def requestPreview(self):
+        self.buttons.button(QDialogButtonBox.Apply).setEnabled(False)
+        # Cached masks are emitted from inside request(), so the key has to be set first
+        self.key = (self.pixelsHash, self.lowSlider.value(), self.highSlider.value(), self.thicknessSlider.value())
+        self.engine.request(self.pixels, *self.key)
+
+    def showMask(self, key, mask):
+        if key == self.key:
+            self.mask = mask
+            self.overlay.setPixmap(maskToPixmap(mask))
+            self.buttons.button(QDialogButtonBox.Apply).setEnabled(True)
+
+    def accept(self):
+        if self.mask is not None:
+            self.canvas.applyBorder(self.rect, self.mask)
+        super().accept()
+
+    def cleanUp(self):
+        self.engine.maskReady.disconnect(self.showMask)
+        self.engine.cancel()
+        self.canvas.scene.removeItem(self.overlay)
@@ -0,0 +1,112 @@
+from PySide6.QtCore import QPointF, QRectF, Qt
+from PySide6.QtGui import QImage, QPainter, QRadialGradient, QColor
+
+from collections import OrderedDict
+import math
+
+from layers import IMAGE_FORMAT
+
+# Distance between dabs as a fraction of their diameter
+DAB_SPACING = 0.15
+# Smallest dab drawn at the lightest pressure, as a fraction of the brush size
+MIN_PRESSURE_SIZE = 0.1
+
+# Pre-rasterized round dabs, keyed by quantized diameter, hardness and color.
+# A stroke with steady pressure reuses one stamp for every dab it draws.
+class DabCache:
+    def __init__(self, maxEntries=256):
+        self.maxEntries = maxEntries
+        self.stamps = OrderedDict()
+
+    def stamp(self, diameter, hardness, color):
+        # Half pixel steps are finer than a dab's antialiased edge can show
+        diameter = max(round(diameter * 2) / 2, 1.0)
+        key = (diameter, round(hardness * 20), color.rgba())
+        stamp = self.stamps.get(key)
+        if stamp is None:
+            stamp = self.stamps[key] = createStamp(diameter, key[1] / 20, color)
+            if len(self.stamps) > self.maxEntries:
+                self.stamps.popitem(last=False)
+        else:
+            self.stamps.move_to_end(key)
+        return stamp
+
+    def clear(self):
+        self.stamps.clear()
+
+# Renders one dab: solid color out to hardness of the radius, fading to transparent at the edge
+def createStamp(diameter, hardness, color):
+    size = math.ceil(diameter) + 2
+    stamp = QImage(size, size, IMAGE_FORMAT)
+    stamp.fill(Qt.GlobalColor.transparent)
+    center = QPointF(size / 2, size / 2)
+    gradient = QRadialGradient(center, diameter / 2)
+    edge = QColor(color)
+    edge.setAlpha(0)
+    gradient.setColorAt(0, color)
+    gradient.setColorAt(min(max(hardness, 0.0), 0.99), color)
+    gradient.setColorAt(1, edge)
+    painter = QPainter(stamp)
+    painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+    painter.setPen(Qt.NoPen)
+    painter.setBrush(gradient)
+    painter.drawEllipse(center, diameter / 2, diameter / 2)
+    painter.end()
+    return stamp
+
+def dabDiameter(size, pressure):
+    return max(size * max(pressure, MIN_PRESSURE_SIZE), 1.0)
+
+# Places dabs every DAB_SPACING diameters along path, starting carry pixels in.
+# Pressure and tilt are interpolated between the raw input points the path goes through,
+# start being the point (and sample) the path starts at.
+# Returns the dabs as (position, sample) and the distance left over for the next frame.
+def placeDabs(path, start, startSample, points, samples, size, carry):
+    length = path.length()
+    # Distance of each raw point along the polyline, to interpolate samples by
+    anchors = [(0.0, startSample)]
+    previous = start
+    for point, sample in zip(points, samples):
+        anchors.append((anchors[-1][0] + math.hypot(point.x() - previous.x(), point.y() - previous.y()), sample))
+        previous = point
+    total = anchors[-1][0]
+
+    dabs = []
+    distance = carry
+    anchor = 0
+    while distance <= length:
+        # Path and polyline lengths differ a little when smoothed, compare them as fractions
+        target = distance / length * total if length else 0.0
+        while anchor < len(anchors) - 2 and anchors[anchor + 1][0] < target:
+            anchor += 1
+        (d0, s0), (d1, s1) = anchors[anchor], anchors[min(anchor + 1, len(anchors) - 1)]
+        t = (target - d0) / (d1 - d0) if d1 > d0 else 1.0
+        sample = tuple(a + (b - a) * t for a, b in zip(s0, s1))
+        point = path.pointAtPercent(path.percentAtLength(distance)) if length else QPointF(start)
+        dabs.append((point, sample))
+        distance += max(dabDiameter(size, sample[0]) * DAB_SPACING, 0.5)
+        if not length:
+            break
+    return dabs, distance - length
+
+# The canvas rect a dab of diameter at point can touch
+def dabRect(point, diameter):
+    radius = diameter / 2 + 2
+    return QRectF(point.x() - radius, point.y() - radius, 2 * radius, 2 * radius).toAlignedRect()
+
+# Composites dabs with an open painter. Tilt narrows the dab across the tilt direction
+# like the side of a pencil tip, untilted dabs are plain image blits.
+def drawDabs(painter, cache, dabs, size, hardness, color):
+    for point, (pressure, xTilt, yTilt) in dabs:
+        stamp = cache.stamp(dabDiameter(size, pressure), hardness, color)
+        half = stamp.width() / 2
+        tilt = math.hypot(xTilt, yTilt)
+        if tilt < 1:
+            painter.drawImage(QPointF(point.x() - half, point.y() - half), stamp)
+            continue
+        painter.save()
+        painter.translate(point)
+        painter.rotate(math.degrees(math.atan2(yTilt, xTilt)))
+        painter.scale(1.0, max(math.cos(math.radians(min(tilt, 70))), 0.35))
+        painter.drawImage(QPointF(-half, -half), stamp)
+        painter.restore()
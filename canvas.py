@@ -1,38 +1,60 @@
 from PySide6.QtWidgets import QGraphicsView, QGraphicsScene, QFileDialog, QGraphicsRectItem
-from PySide6.QtGui import QPixmap, QColor, QPainter, QPen, QPainterPath, QBrush, QImage
-from PySide6.QtCore import Qt, Signal, QPointF, QRectF
+from PySide6.QtGui import QPixmap, QColor, QPainter, QPen, QPainterPath, QBrush, QImage, QTransform
+from PySide6.QtCore import Qt, Signal, QPoint, QPointF, QRect, QRectF, QThreadPool, QTimer, QEvent
 from PySide6 import QtCore
 
 from enum import Enum
-from PIL import ImageQt, Image
-from tools import RectangleSelectTool, PenTool, EraserTool
-import cv2
-import numpy as np
+from functools import cached_property
+from tools import RectangleSelectTool, PenTool, EraserTool, FillTool, BrushTool, VectorPenTool, StrokeEraserTool
+from history import TileHistory
+from canvasitem import CanvasItem
+from layers import LayerStack, IMAGE_FORMAT
+from savetask import ImageSaveTask
+from strokeinput import StrokeInput
+from imagebuffer import imageView, pixelValue
+from profiler import Profiler, profiled
+from strokes import StrokeLog
+from autosave import Autosave, recoverJournal
 import os
 
 class Tools(Enum):
     PENCIL = 1
     ERASER = 2
     RECTANGLE_SELECT = 3
+    FILL = 4
+    BRUSH = 5
+    VECTOR_PEN = 6
+    STROKE_ERASER = 7
 
 class Canvas(QGraphicsView):
     
     clicked = Signal()
+    historyChanged = Signal()
+    documentChanged = Signal()
+    # Emitted once, right after the canvas was first painted
+    firstFrame = Signal()
+    toolChanged = Signal(object)
+    saveProgress = Signal(int)
+    saveFinished = Signal(str)
+    saveFailed = Signal(str, str)
     
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, canvasSize=(1500, 900)):
         super().__init__(parent)
         self.scene = QGraphicsScene(self)
         self.setScene(self.scene)
         self.setRenderHint(QPainter.RenderHint.Antialiasing)
+        self.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+        self.setTransformationAnchor(QGraphicsView.AnchorUnderMouse)
         self.canvasColor = Qt.GlobalColor.transparent
         self.setMouseTracking(True)
+        self.profiler = Profiler()
         # Set canvas settings
-        self.canvasSize = (1500, 900)
-        self.pixmap = QPixmap(*self.canvasSize)
-        self.pixmap.fill(Qt.transparent)
-        self.pixmapItem = self.scene.addPixmap(self.pixmap)
+        self.canvasSize = canvasSize
+        self.layers = LayerStack(*self.canvasSize)
+        self.canvasItem = CanvasItem(self)
+        self.scene.addItem(self.canvasItem)
         
-        self.border = self.scene.addRect(self.pixmap.rect(), QPen(Qt.gray, 2))
+        self.border = self.scene.addRect(QRectF(self.image.rect()), QPen(Qt.gray, 2))
         
         self.color = QColor(255, 0, 0)
         self.ppSize = 4
@@ -40,27 +62,141 @@ class Canvas(QGraphicsView):
         self.penTool = PenTool(self)
         self.eraserTool = EraserTool(self)
         self.rectangleSelectTool = RectangleSelectTool(self)
+        # How much of a brush dab's radius is solid before it fades out
+        self.brushHardness = 0.5
+        # None fills with fill.DEFAULT_TOLERANCE
+        self.fillTolerance = None
+        self.fillAntialias = True
         self.currentTool = self.penTool
         
-        self.undoStack = []
-        self.redoStack = []
+        self.history = TileHistory(self.layers)
+        self.strokeInput = StrokeInput(self)
+        self.strokeLog = StrokeLog(*self.canvasSize)
+        self.layers.strokeLog = self.strokeLog
         self.saveLoc = None
+        # A single thread keeps saves to the same path in order
+        self.savePool = QThreadPool(self)
+        self.savePool.setMaxThreadCount(1)
+        self.saveTasks = set()
+        self.autosave = Autosave(self)
+        self.previewItem = None
+        # On-canvas readout of the profiler, refreshed a few times a second while shown
+        self.hudVisible = False
+        self.hudRect = QRect(8, 8, 420, 66)
+        self.hudTimer = QTimer(self)
+        self.hudTimer.setInterval(250)
+        self.hudTimer.timeout.connect(lambda: self.viewport().update(self.hudRect))
+        self.framesShown = False
     
+    # The image of the active layer, which is what tools paint into
+    @property
+    def image(self):
+        return self.layers.active().image
+
+    # Rarely used tools and the border engine are only created once they are first needed
+    @cached_property
+    def fillTool(self):
+        return FillTool(self)
+
+    @cached_property
+    def brushTool(self):
+        return BrushTool(self)
+
+    @cached_property
+    def vectorPenTool(self):
+        return VectorPenTool(self)
+
+    @cached_property
+    def strokeEraserTool(self):
+        return StrokeEraserTool(self)
+
+    # Images decode on a worker, a quick preview stands in until the full image arrives
+    @cached_property
+    def imageLoader(self):
+        from imageloader import ImageLoader
+        loader = ImageLoader(self)
+        loader.preview.connect(self.showLoadPreview)
+        loader.loaded.connect(self.imageLoaded)
+        loader.failed.connect(self.imageLoadFailed)
+        return loader
+
+    @cached_property
+    def imageCache(self):
+        from imageloader import DocumentCache
+        return DocumentCache()
+
+    # Nothing can be loading before the first load created the loader
+    def isLoading(self):
+        return "imageLoader" in self.__dict__ and self.imageLoader.isLoading()
+
+    def cancelLoad(self):
+        if "imageLoader" in self.__dict__:
+            self.imageLoader.cancel()
+
+    @cached_property
+    def borderEngine(self):
+        from border import BorderEngine
+        return BorderEngine(self)
+
+    @cached_property
+    def filterEngine(self):
+        from filters import FilterEngine
+        return FilterEngine(self)
+
+    # Tools whose strokes are recorded, by the name stored in the stroke log
+    @property
+    def strokeTools(self):
+        return {tool.name: tool for tool in (self.penTool, self.eraserTool, self.brushTool)}
+
     # Initializes drawing on mouse press
+    @profiled("Canvas.mousePress")
     def mousePressEvent(self, event):
+        # Whatever is drawn now would be replaced by the image being loaded
+        if self.isLoading() or not self.toolFitsLayer():
+            return
         self.currentTool.handleMousePress(event)
         self.clicked.emit()
             
     # Handles mouse movement drawing
+    @profiled("Canvas.mouseMove")
     def mouseMoveEvent(self, event):
         self.currentTool.handleMouseMove(event)
     
     # Finalizes drawing on mouse release
+    @profiled("Canvas.mouseRelease")
     def mouseReleaseEvent(self, event):
         if event.button() == Qt.LeftButton:
             self.currentTool.handleMouseRelease(event)
+            self.historyChanged.emit()
+        
+    # Pen tablets, tools that don't use pressure get the mouse events Qt makes from ignored tablet events
+    @profiled("Canvas.tablet")
+    def tabletEvent(self, event):
+        if self.isLoading() or not self.toolFitsLayer() or not self.currentTool.handleTabletEvent(event):
+            event.ignore()
+            return
+        event.accept()
+        if event.type() == QEvent.TabletRelease:
+            self.historyChanged.emit()
+
+    # Pixel tools leave vector layers alone, the next re-rasterization would wipe what they painted
+    def toolFitsLayer(self):
+        return self.currentTool.vector or not self.layers.active().vector
+
+    # Zooms with Ctrl + mouse wheel, otherwise scrolls as usual
+    @profiled("Canvas.wheel")
+    def wheelEvent(self, event):
+        if event.modifiers() & QtCore.Qt.ControlModifier:
+            factor = 1.25 if event.angleDelta().y() > 0 else 0.8
+            zoom = self.transform().m11() * factor
+            if 0.02 <= zoom <= 32:
+                self.scale(factor, factor)
+            event.accept()
+        else:
+            super().wheelEvent(event)
         
     # Handles key presses
+    @profiled("Canvas.keyPress")
     def keyPressEvent(self, event):
         if event.key() == QtCore.Qt.Key.Key_Q:
             self.clearCanvas()
@@ -68,42 +204,209 @@ class Canvas(QGraphicsView):
             self.deleteSelectedArea()
         elif event.key() == QtCore.Qt.Key.Key_C and event.modifiers() & QtCore.Qt.ControlModifier:
             self.copySelectedArea()
+        elif event.key() == QtCore.Qt.Key.Key_V and event.modifiers() & QtCore.Qt.ControlModifier:
+            self.pasteClipboard()
         event.accept()
 
+    # Times every repaint of the view, the HUD's frame time comes from here
+    def paintEvent(self, event):
+        with self.profiler.section("frame"):
+            super().paintEvent(event)
+        if not self.framesShown:
+            self.framesShown = True
+            QTimer.singleShot(0, self.firstFrame.emit)
+
+    def drawForeground(self, painter, rect):
+        if self.hudVisible:
+            self.drawHud(painter)
+
+    # Draws frame time, input rate and undo memory in the top left corner of the view
+    def drawHud(self, painter):
+        profiler = self.profiler
+        mean, worst = profiler.durations("frame")
+        lines = [
+            f"Frame  {mean:.1f} ms avg  {worst:.1f} ms max  {len(profiler.recent('frame'))}/s",
+            f"Input  {profiler.rate('Canvas.mouse') + profiler.rate('Canvas.tablet'):.0f} events/s",
+            f"Undo   {self.history.memoryUsed / (1024 * 1024):.1f} MB in {len(self.history.entries)} steps, "
+            f"{self.history.spilledBytes() / (1024 * 1024):.1f} MB spilled",
+        ]
+        painter.save()
+        painter.resetTransform()
+        painter.fillRect(self.hudRect, QColor(0, 0, 0, 170))
+        painter.setPen(Qt.white)
+        painter.drawText(self.hudRect.adjusted(8, 4, -8, -4), Qt.AlignLeft | Qt.AlignVCenter, "\n".join(lines))
+        painter.restore()
+
+    def toggleHud(self):
+        self.hudVisible = not self.hudVisible
+        if self.hudVisible:
+            self.hudTimer.start()
+        else:
+            self.hudTimer.stop()
+        self.viewport().update(self.hudRect)
+
+    # Saves the profiler's buffered samples as a Chrome trace (open in chrome://tracing or Perfetto)
+    def exportTrace(self):
+        path, _ = QFileDialog.getSaveFileName(self, 'Export Trace', "./trace.json", "Chrome trace (*.json)")
+        if path:
+            try:
+                self.profiler.exportTrace(path)
+            except OSError as error:
+                print(f"Could not write {path}: {error}")
+
     # Clears all drawings from the canvas
     def clearCanvas(self):
+        self.rectangleSelectTool.clearSelection()
+        self.cancelLoad()
+        self.removeLoadPreview()
+        self.currentTool.deactivate()
         self.scene.clear()
-        self.pixmap.fill(Qt.GlobalColor.transparent)
-        self.pixmapItem = self.scene.addPixmap(self.pixmap)
-        self.border = self.scene.addRect(self.pixmap.rect(), QPen(Qt.gray, 2))
+        if self.layers.tileLoader:
+            self.layers.tileLoader.close()
+        for layer in self.layers.layers:
+            layer.image.fill(Qt.GlobalColor.transparent)
+            if layer.vector:
+                layer.vector.clear()
+        self.layers.usedTiles.clear()
+        self.layers.invalidateCache()
+        # Versions from before the clear would restore tiles onto the blank layers, history starts over too
+        self.history.clear()
+        self.strokeLog.reset(*self.canvasSize)
+        self.autosave.documentChanged()
+        self.canvasItem = CanvasItem(self)
+        self.scene.addItem(self.canvasItem)
+        self.border = self.scene.addRect(QRectF(self.image.rect()), QPen(Qt.gray, 2))
         self.update()
+        self.historyChanged.emit()
+
+    # Repaints only the given rect of the canvas image
+    def updateRect(self, rect):
+        self.canvasItem.invalidate(rect)
+        self.autosave.markDirty(rect)
+
+    # Replaces the document with a single layer holding image
+    def setImage(self, image):
+        self.canvasItem.resizeCanvas()
+        self.layers.reset(image)
+        self.strokeLog.reset(image.width(), image.height())
+        self.documentReplaced()
+
+    # Resizes the scene to a newly loaded document and repaints it
+    def documentReplaced(self):
+        self.canvasSize = (self.image.width(), self.image.height())
+        self.border.setRect(QRectF(self.image.rect()))
+        self.setSceneRect(QRectF(self.image.rect()))
+        self.canvasItem.invalidate()
+        self.autosave.documentChanged()
+        self.documentChanged.emit()
 
     def deleteSelectedArea(self):
-        if self.rectangleSelectTool.deleteSelectedArea(self.pixmap):
-            self.undoStack.append(self.pixmap.copy())
-            self.redoStack.clear()
-            self.pixmapItem.setPixmap(self.pixmap)
-            self.update()
+        # Floating pixels were already cut out of the layer, dropping them is the delete
+        if self.rectangleSelectTool.floatingItem:
+            self.rectangleSelectTool.discardFloating()
+            self.historyChanged.emit()
+            return
+        selectedArea = self.rectangleSelectTool.selectedArea
+        if selectedArea:
+            self.history.beginAction(self.layers.active())
+            self.history.markDirty(selectedArea.toRect())
+            self.rectangleSelectTool.deleteSelectedArea(self.image)
+            self.history.commitAction()
+            self.updateRect(selectedArea.toAlignedRect())
+            self.historyChanged.emit()
 
     def copySelectedArea(self):
         self.rectangleSelectTool.copySelectedArea()
+
+    # Pastes the clipboard image as a floating selection on the active layer,
+    # at the spot it was copied from if that is on the canvas, otherwise in the middle of the view
+    def pasteClipboard(self):
+        if self.isLoading():
+            return
+        if self.layers.active().vector:
+            print("Can't paste pixels onto a vector layer.")
+            return
+        from clipboard import clipboardImage
+        image, origin = clipboardImage()
+        if image is None:
+            return
+        image = image.convertToFormat(IMAGE_FORMAT)
+        if origin is None or not self.layers.rect().intersects(QRect(origin, image.size())):
+            center = self.mapToScene(self.viewport().rect().center()).toPoint()
+            origin = center - QPoint(image.width() // 2, image.height() // 2)
+        self.setTool(Tools.RECTANGLE_SELECT)
+        self.rectangleSelectTool.pasteImage(image, origin)
         
     # Undoes the last action
     def undo(self):
-        if self.undoStack:
-            self.redoStack.append(self.pixmap.copy())
-            self.pixmap = self.undoStack.pop()
-            self.pixmapItem.setPixmap(self.pixmap)
+        self.rectangleSelectTool.commitFloating()
+        self.historyRestored(self.history.undo())
 
     # Redoes the last undone action
     def redo(self):
-        if self.redoStack:
-            self.undoStack.append(self.pixmap.copy())
-            self.pixmap = self.redoStack.pop()
-            self.pixmapItem.setPixmap(self.pixmap)
+        self.rectangleSelectTool.commitFloating()
+        self.historyRestored(self.history.redo())
+
+    # Jumps directly to a version of the history
+    def goToVersion(self, version):
+        self.rectangleSelectTool.commitFloating()
+        self.historyRestored(self.history.goTo(version))
+
+    # Repaints what undo/redo changed, which may be on a cached non-active layer
+    def historyRestored(self, changed):
+        if changed is not None:
+            self.layers.refreshCache(changed)
+            self.updateRect(changed)
+
+    # Repaints everything after the layer stack or a layer's properties changed
+    def layersChanged(self):
+        self.canvasItem.invalidate()
+        self.autosave.documentChanged()
+
+    # Adds a new layer above the active one
+    def addLayer(self):
+        self.rectangleSelectTool.commitFloating()
+        self.layers.addLayer()
+        self.layersChanged()
+
+    # Adds an empty vector layer above the active one
+    def addVectorLayer(self):
+        from vectorlayer import VectorLayer
+        self.rectangleSelectTool.commitFloating()
+        layer = self.layers.addLayer(f"Vector {len(self.layers.layers) + 1}")
+        layer.vector = VectorLayer()
+        self.layersChanged()
+
+    def removeLayer(self, index):
+        self.rectangleSelectTool.commitFloating()
+        if self.layers.removeLayer(index):
+            self.layersChanged()
+
+    def moveLayer(self, index, newIndex):
+        self.rectangleSelectTool.commitFloating()
+        if self.layers.moveLayer(index, newIndex):
+            self.layersChanged()
+
+    def setActiveLayer(self, index):
+        self.rectangleSelectTool.commitFloating()
+        self.layers.setActive(index)
+
+    def setLayerOpacity(self, index, opacity):
+        self.layers.setOpacity(index, opacity)
+        self.layersChanged()
+
+    def setLayerBlendMode(self, index, blendMode):
+        self.layers.setBlendMode(index, blendMode)
+        self.layersChanged()
+
+    def setLayerVisible(self, index, visible):
+        self.layers.setVisible(index, visible)
+        self.layersChanged()
     
     # Sets the current drawing tool
     def setTool(self, tool):
+        self.rectangleSelectTool.commitFloating()
+        self.currentTool.deactivate()
         self.tools = tool
         if tool == Tools.PENCIL:
             self.currentTool = self.penTool
@@ -111,7 +414,16 @@ class Canvas(QGraphicsView):
             self.currentTool = self.eraserTool
         elif tool == Tools.RECTANGLE_SELECT:
             self.currentTool = self.rectangleSelectTool
+        elif tool == Tools.FILL:
+            self.currentTool = self.fillTool
+        elif tool == Tools.BRUSH:
+            self.currentTool = self.brushTool
+        elif tool == Tools.VECTOR_PEN:
+            self.currentTool = self.vectorPenTool
+        elif tool == Tools.STROKE_ERASER:
+            self.currentTool = self.strokeEraserTool
         self.setCursor(Qt.CrossCursor if isinstance(self.currentTool, RectangleSelectTool) else Qt.ArrowCursor)
+        self.toolChanged.emit(tool)
     
     # Sets the current drawing color
     def setColor(self, color):
@@ -121,10 +433,26 @@ class Canvas(QGraphicsView):
     def setPencilSize(self, size):
         self.ppSize = size
     
+    # Sets how much of a brush dab's radius is solid, from 0 to 1
+    def setBrushHardness(self, hardness):
+        self.brushHardness = hardness
+    
+    # Sets how far a pixel may differ from the clicked one and still be filled
+    def setFillTolerance(self, tolerance):
+        self.fillTolerance = tolerance
+    
+    # Sets whether the fill edge is antialiased
+    def setFillAntialias(self, antialias):
+        self.fillAntialias = antialias
+    
     # Sets the canvas color
     def setCanvasColor(self, color):
-        self.canvas.fill(color)
-        self.update()
+        # Tiles still on disk would be decoded over the color later
+        self.layers.ensureLoaded(self.image.rect())
+        self.layers.markUsed(self.image.rect())
+        self.image.fill(color)
+        self.layers.refreshCache(self.image.rect())
+        self.updateRect(self.image.rect())
 
     # Saves the current image to a file
     def save(self):
@@ -143,90 +471,257 @@ class Canvas(QGraphicsView):
             self.loadImage(path)
             self.saveLoc = path
     
-    # Helper that saves the current scene to an image file
+    # Helper that saves the flattened layers (or the whole project) to a file in the background
     def saveImage(self, path):
-        image = QImage(self.sceneRect().size().toSize(), QImage.Format.Format_ARGB32)
-        image.fill(Qt.GlobalColor.transparent)
-        painter = QPainter(image)
-        self.scene.render(painter)
-        painter.end()
-        image.save(path)
-
-    # Helper that loads an image from a file and displays it on the canvas
+        from project import ProjectSaveTask, isProjectFile, snapshotProject
+        self.rectangleSelectTool.commitFloating()
+        if isProjectFile(path):
+            self.startSave(ProjectSaveTask(snapshotProject(self.layers, self.history, self.strokeLog), path))
+        else:
+            self.startSave(ImageSaveTask(self.layers.flatten(), path))
+
+    def startSave(self, task):
+        task.signals.progress.connect(self.saveProgress)
+        task.signals.finished.connect(self.saveFinished)
+        task.signals.failed.connect(self.saveFailed)
+        task.signals.finished.connect(lambda _: self.saveTasks.discard(task))
+        task.signals.failed.connect(lambda *_: self.saveTasks.discard(task))
+        self.saveTasks.add(task)
+        self.savePool.start(task)
+
+    # Blocks until every pending save is on disk
+    def waitForSaves(self):
+        self.savePool.waitForDone()
+
+    # Helper that loads an image from a file and displays it on the canvas.
+    # Recently opened images come straight from the cache, others are decoded in the background.
     def loadImage(self, path):
-        image = QImage(path)
-        if not image.isNull():
-            self.scene.clear()
-            self.undoStack.clear()
-            self.redoStack.clear()
-            pixmap = QPixmap.fromImage(image)
-            self.scene.addPixmap(pixmap)
-            self.setSceneRect(pixmap.rect())
-            self.update()
+        from project import isProjectFile
+        if isProjectFile(path):
+            self.loadProject(path)
+            return
+        cached = self.imageCache.get(path)
+        if cached is not None:
+            self.cancelLoad()
+            self.removeLoadPreview()
+            self.openImage(cached)
+            return
+        self.imageLoader.load(path)
+
+    # Replaces the document with a freshly loaded image
+    def openImage(self, image):
+        self.rectangleSelectTool.clearSelection()
+        self.history.clear()
+        self.setImage(image)
+
+    # Shows the low resolution preview stretched over the size the full image will have
+    def showLoadPreview(self, path, image, size):
+        self.removeLoadPreview()
+        self.previewItem = self.scene.addPixmap(QPixmap.fromImage(image))
+        self.previewItem.setTransformationMode(Qt.SmoothTransformation)
+        self.previewItem.setTransform(QTransform.fromScale(size.width() / image.width(), size.height() / image.height()))
+        self.previewItem.setZValue(2)
+        self.setSceneRect(QRectF(0, 0, size.width(), size.height()))
+
+    def imageLoaded(self, path, image):
+        self.imageCache.put(path, image)
+        self.removeLoadPreview()
+        self.openImage(image)
+
+    def imageLoadFailed(self, path, error):
+        self.removeLoadPreview()
+        self.setSceneRect(QRectF(self.image.rect()))
+        print(f"Could not open {path}: {error}")
+
+    def removeLoadPreview(self):
+        if self.previewItem is not None:
+            self.scene.removeItem(self.previewItem)
+            self.previewItem = None
+
+    # Blocks until a background image load has been shown
+    def waitForLoads(self):
+        if "imageLoader" in self.__dict__:
+            self.imageLoader.waitForDone()
     
+    # Helper that opens a PastEven project, its tiles are decoded as they come into view
+    def loadProject(self, path):
+        self.cancelLoad()
+        self.removeLoadPreview()
+        from project import openProject, READ_ERRORS
+        self.rectangleSelectTool.clearSelection()
+        try:
+            self.canvasItem.resizeCanvas()
+            openProject(path, self.layers, self.history, self.strokeLog)
+        except READ_ERRORS as error:
+            print(f"Could not open {path}: {error}")
+            return
+        self.documentReplaced()
+
+    # Brings back the document autosaved in directory by a session that didn't close normally
+    def recoverAutosave(self, directory):
+        from project import READ_ERRORS
+        self.rectangleSelectTool.clearSelection()
+        try:
+            self.canvasItem.resizeCanvas()
+            recoverJournal(directory, self.layers, self.history, self.strokeLog)
+        except READ_ERRORS as error:
+            print(f"Could not recover autosave: {error}")
+            return False
+        self.documentReplaced()
+        return True
+
+    # Exports the strokes of the visible vector layers as an SVG file
+    def exportSvg(self):
+        layers = [(layer.vector, layer.opacity) for layer in self.layers.layers if layer.vector and layer.visible]
+        if not layers:
+            print("No vector layers to export. Add one in the layer panel first.")
+            return
+        path, _ = QFileDialog.getSaveFileName(self, 'Export SVG', "./drawing.svg", "SVG (*.svg)")
+        if path:
+            try:
+                from vectorlayer import writeSvg
+                writeSvg(path, self.layers.width(), self.layers.height(), layers, self.history.version())
+            except OSError as error:
+                print(f"Could not write {path}: {error}")
+
     # Opens a file dialog to select an image to load
     def openFileDialog(self):
-        file_name, _ = QFileDialog.getOpenFileName(self, 'Load Image', "./")
+        from project import PROJECT_EXTENSION
+        file_name, _ = QFileDialog.getOpenFileName(self, 'Load Image', "./", f"Images and projects (*.png *.jpg *.jpeg *{PROJECT_EXTENSION});;All files (*)")
         return file_name
     
     # Opens a file dialog to save the current image
     def saveFileDialog(self):
-        file_name, _ = QFileDialog.getSaveFileName(self, 'Save Image', "./", "Image (*.png)")
-        if not self.hasImgExt(file_name):
-            file_name + ".png"
+        from project import PROJECT_EXTENSION
+        file_name, _ = QFileDialog.getSaveFileName(self, 'Save Image', "./", f"Image (*.png);;PastEven Project (*{PROJECT_EXTENSION})")
+        if file_name and not self.hasImgExt(file_name):
+            file_name += ".png"
         return file_name
     
-    # Checks if the file name has a valid image extension
+    # Checks if the file name has a valid image (or project) extension
     def hasImgExt(self, file_name):
-        image_extensions = ['.png', '.jpeg', '.jpg']
+        from project import PROJECT_EXTENSION
+        image_extensions = ['.png', '.jpeg', '.jpg', PROJECT_EXTENSION]
         file_extension = os.path.splitext(file_name)[1].lower()
         return file_extension in image_extensions
     
-    # Detects and adds borders in the current selected region
+    # Opens the border dialog for the current selected region, which previews borders live
     def findBorder(self):
+        self.rectangleSelectTool.commitFloating()
         if not self.rectangleSelectTool.selectedArea:
             print("No area selected. Please select an area first with rectangle tool.")
             return
 
-        selected_rect = self.rectangleSelectTool.selectedArea.toRect()
-        image = self.pixmap.toImage()
-        selected_image = image.copy(selected_rect)
-        
-        # Convert QImage to numpy array
-        width, height = selected_image.width(), selected_image.height()
-        bytes_per_line = selected_image.bytesPerLine()
-        ptr = selected_image.constBits()
-        arr = np.array(ptr).reshape(height, bytes_per_line // 4, 4)
-        
-        bgr_image = cv2.cvtColor(arr, cv2.COLOR_RGBA2BGR)
-        gray = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY)
-        edges = cv2.Canny(gray, 50, 150)
-        
-        # RETR_EXTERNAL only if we want outside edge
-        contours, _ = cv2.findContours(edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-        mask = np.zeros(bgr_image.shape[:2], dtype=np.uint8)
-        cv2.drawContours(mask, contours, -1, (255), 3)
-        
-        # This was an idea to increase the size of the border whenever the pen size is large enough
-        # cv2.drawContours(cv_image, contours, -1, (0, 0, 0), thickness = (self.ppSize // 30) + 1)
-        
-        # last number is for offset (MAMA!) 
-        # L youre wrong it was the thickness get better - Ethan
-        
-        borderOverlay = np.zeros_like(arr)
-        borderOverlay[:, :, 3] = mask
-        borderOverlay[mask == 255] = [0, 0, 0, 255]
+        selected_rect = self.rectangleSelectTool.selectedArea.toRect().intersected(self.image.rect())
+        if not selected_rect.isEmpty():
+            from border import BorderDialog
+            BorderDialog(self, selected_rect).open()
 
-        borderImage = QImage(borderOverlay.data, borderOverlay.shape[1], borderOverlay.shape[0], borderOverlay.strides[0], QImage.Format_RGBA8888)
-        borderPixmap = QPixmap.fromImage(borderImage)
-        
-        # Draw the mask onto the transparent pixmap
-        painter = QPainter(self.pixmap)
-        painter.drawPixmap(selected_rect.topLeft(), borderPixmap)
-        painter.end()
-        
-        # Update the pixmap item
-        self.pixmapItem.setPixmap(self.pixmap)
-        self.update()
-        self.undoStack.append(self.pixmap.copy())
-        self.redoStack.clear()
\ No newline at end of file
+    # Opens the dialog of a filter from filters.FILTERS for the selection, or the whole layer without one
+    def openFilter(self, name):
+        from filters import FilterDialog, FILTERS
+        self.rectangleSelectTool.commitFloating()
+        if self.layers.active().vector:
+            print("Filters work on pixels, pick a layer that isn't a vector layer.")
+            return
+        selectedArea = self.rectangleSelectTool.selectedArea
+        rect = selectedArea.toRect().intersected(self.image.rect()) if selectedArea else self.image.rect()
+        if not rect.isEmpty():
+            FilterDialog(self, rect, FILTERS[name]).open()
+
+    # A copy of the active layer pixels under rect with up to halo pixels of context around it,
+    # plus where rect sits in the copy as (x, y, width, height)
+    def filterSource(self, rect, halo):
+        import numpy as np
+        outer = rect.adjusted(-halo, -halo, halo, halo).intersected(self.image.rect())
+        return np.array(self.selectionPixels(outer)), (rect.x() - outer.x(), rect.y() - outer.y(), rect.width(), rect.height())
+
+    # Returns a read-only view of the active layer pixels under rect
+    def selectionPixels(self, rect):
+        self.layers.ensureLoaded(rect)
+        return imageView(self.image, rect)
+
+    # Flood fills the area under point on the active layer with the current color.
+    # Only the tiles under the filled region's bounding box go into history.
+    def fillAt(self, point):
+        from fill import floodFillMask, fillMask, DEFAULT_TOLERANCE
+        if not self.layers.rect().contains(point):
+            return
+        tolerance = DEFAULT_TOLERANCE if self.fillTolerance is None else self.fillTolerance
+        self.layers.ensureLoaded(self.layers.rect())
+        mask, box = floodFillMask(imageView(self.image), point.x(), point.y(), tolerance)
+        rect = QRect(*box)
+        if self.fillAntialias:
+            rect = rect.adjusted(-1, -1, 1, 1).intersected(self.layers.rect())
+        self.history.beginAction(self.layers.active())
+        self.history.markDirty(rect)
+        self.layers.markUsed(rect)
+        view = imageView(self.image, rect, writable=True)
+        fillMask(view, mask[rect.top():rect.bottom() + 1, rect.left():rect.right() + 1],
+                 pixelValue(self.image, self.color), self.fillAntialias)
+        self.updateRect(rect)
+        self.history.commitAction()
+        self.historyChanged.emit()
+
+    # Paints a border mask from the border engine into the active layer
+    def applyBorder(self, rect, mask):
+        self.history.beginAction(self.layers.active())
+        self.history.markDirty(rect)
+        view = imageView(self.image, rect, writable=True)
+        view[mask == 255] = pixelValue(self.image, QColor(0, 0, 0))
+        self.updateRect(rect)
+        self.history.commitAction()
+        self.historyChanged.emit()
+
+    # Live stroke of the active vector layer under point, if any
+    def vectorStrokeAt(self, point):
+        vector = self.layers.active().vector
+        return vector.strokeAt(point, self.history.version()) if vector else None
+
+    # Adds a stroke through points to the active vector layer as one undo step
+    def addVectorStroke(self, points):
+        from vectorlayer import VectorStroke
+        layer = self.layers.active()
+        if not layer.vector or not points:
+            return
+        self.history.beginAction(layer)
+        self.redrawVectors(layer, layer.vector.addStroke(VectorStroke(points, self.color.rgba(), self.ppSize)))
+        self.commitVectors(layer)
+
+    # Strokes erased until endStrokeErase are one undo step
+    def beginStrokeErase(self):
+        self.history.beginAction(self.layers.active())
+
+    def eraseStrokeAt(self, point):
+        stroke = self.vectorStrokeAt(point)
+        if stroke:
+            layer = self.layers.active()
+            self.redrawVectors(layer, layer.vector.eraseStroke(stroke))
+
+    def endStrokeErase(self):
+        self.commitVectors(self.layers.active())
+
+    # Re-rasterizes the tiles of a vector layer under rect, inside the open history action
+    def redrawVectors(self, layer, rect):
+        rect = rect.toAlignedRect().intersected(self.layers.rect())
+        if rect.isEmpty():
+            return
+        self.history.markDirty(rect)
+        self.updateRect(layer.vector.rasterize(layer.image, rect, self.history.version()))
+
+    # Ends the history action of a vector edit, its strokes take the new version
+    def commitVectors(self, layer):
+        if self.history.commitAction():
+            layer.vector.commit(self.history.version())
+        else:
+            layer.vector.rollback()
+        self.historyChanged.emit()
+
+    # Replaces the active layer pixels under rect with a filter result
+    def applyFilter(self, rect, pixels):
+        self.history.beginAction(self.layers.active())
+        self.history.markDirty(rect)
+        imageView(self.image, rect, writable=True)[...] = pixels
+        self.updateRect(rect)
+        self.history.commitAction()
+        self.historyChanged.emit()
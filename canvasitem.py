@@ -0,0 +1,141 @@
+from PySide6.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem
+from PySide6.QtCore import QRect, QRectF, Qt
+from PySide6.QtGui import QPainter, QPixmap
+
+from collections import OrderedDict
+import math
+
+from layers import TILE_SIZE, tileKeysIn
+from profiler import profiled
+
+# Cached pixmaps of one tile: level 0 is full resolution, level n is 1/2^n of it
+class TileEntry:
+    def __init__(self):
+        self.levels = {}
+        # Part of level 0 (in canvas coordinates) that must be recomposited
+        self.dirty = None
+
+    def bytes(self):
+        return sum(pixmap.width() * pixmap.height() * 4 for pixmap in self.levels.values())
+
+# Scene item that draws the layer composite as a grid of tiles.
+# Only tiles intersecting the exposed rect are painted, a tile's pixmap is created
+# the first time it is drawn, and tiles nothing was ever painted on are skipped entirely.
+# When zoomed out each tile is drawn from the mip level closest to the screen size,
+# built from the composite only when that tile changed.
+class CanvasItem(QGraphicsItem):
+    MAX_BYTES = 256 * 1024 * 1024
+    MAX_LEVEL = 5
+
+    def __init__(self, canvas):
+        super().__init__()
+        self.canvas = canvas
+        self.tiles = OrderedDict()
+        self.cachedBytes = 0
+        # Needed so option.exposedRect holds the area that actually needs painting
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption)
+
+    def boundingRect(self):
+        return QRectF(self.canvas.layers.rect())
+
+    @property
+    def profiler(self):
+        return self.canvas.profiler
+
+    @profiled("scene.paintTiles")
+    def paint(self, painter, option, widget=None):
+        layers = self.canvas.layers
+        level = self.levelFor(QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform()))
+        exposed = option.exposedRect.toAlignedRect().intersected(layers.rect())
+        for key in tileKeysIn(exposed):
+            if layers.isTileUsed(key):
+                pixmap = self.tilePixmap(key, level)
+                painter.drawPixmap(QRectF(self.tileRect(key)), pixmap, QRectF(pixmap.rect()))
+
+    # Picks the mip level whose resolution is closest to (but not below) the screen's
+    def levelFor(self, levelOfDetail):
+        if levelOfDetail >= 1 or levelOfDetail <= 0:
+            return 0
+        return min(int(math.log2(1 / levelOfDetail)), self.MAX_LEVEL)
+
+    def tileRect(self, key):
+        return QRect(key[0] * TILE_SIZE, key[1] * TILE_SIZE, TILE_SIZE, TILE_SIZE).intersected(self.canvas.layers.rect())
+
+    # Returns the up to date pixmap of a tile at a mip level, creating it on first use
+    def tilePixmap(self, key, level):
+        entry = self.tiles.pop(key, None) or TileEntry()
+        self.cachedBytes -= entry.bytes()
+        if level == 0:
+            pixmap = self.fullPixmap(key, entry)
+        else:
+            pixmap = entry.levels.get(level)
+            if pixmap is None:
+                pixmap = self.scaledPixmap(key, entry, level)
+                entry.levels[level] = pixmap
+        self.tiles[key] = entry
+        self.cachedBytes += entry.bytes()
+        self.evict()
+        return pixmap
+
+    # Level 0, patched in place when only part of the tile changed
+    def fullPixmap(self, key, entry):
+        layers = self.canvas.layers
+        pixmap = entry.levels.get(0)
+        if pixmap is None:
+            with self.profiler.section("tile.composite"):
+                image = layers.compositeRect(self.tileRect(key))
+            with self.profiler.section("tile.upload"):
+                pixmap = QPixmap.fromImage(image)
+            entry.levels[0] = pixmap
+        elif entry.dirty is not None:
+            with self.profiler.section("tile.composite"):
+                image = layers.compositeRect(entry.dirty)
+            with self.profiler.section("tile.upload"):
+                tilePainter = QPainter(pixmap)
+                tilePainter.setCompositionMode(QPainter.CompositionMode_Source)
+                tilePainter.drawImage(entry.dirty.x() - key[0] * TILE_SIZE, entry.dirty.y() - key[1] * TILE_SIZE, image)
+                tilePainter.end()
+        entry.dirty = None
+        return pixmap
+
+    # Downsamples level 0 (or a fresh composite if level 0 isn't cached) with area averaging
+    def scaledPixmap(self, key, entry, level):
+        rect = self.tileRect(key)
+        if 0 in entry.levels:
+            source = self.fullPixmap(key, entry).toImage()
+        else:
+            source = self.canvas.layers.compositeRect(rect)
+        width = max(rect.width() >> level, 1)
+        height = max(rect.height() >> level, 1)
+        with self.profiler.section("tile.mipmap"):
+            return QPixmap.fromImage(source.scaled(width, height, Qt.IgnoreAspectRatio, Qt.SmoothTransformation))
+
+    def evict(self):
+        while self.cachedBytes > self.MAX_BYTES and len(self.tiles) > 1:
+            _, entry = self.tiles.popitem(last=False)
+            self.cachedBytes -= entry.bytes()
+
+    # Schedules a repaint of just the given canvas rect, or of everything
+    def invalidate(self, rect=None):
+        if rect is None:
+            self.tiles.clear()
+            self.cachedBytes = 0
+            self.update()
+            return
+        rect = QRect(rect).intersected(self.canvas.layers.rect())
+        for key in tileKeysIn(rect):
+            entry = self.tiles.get(key)
+            if entry:
+                # Level 0 is patched, the smaller levels are cheap to rebuild from it
+                self.cachedBytes -= entry.bytes()
+                entry.levels = {0: entry.levels[0]} if 0 in entry.levels else {}
+                self.cachedBytes += entry.bytes()
+                dirty = rect.intersected(self.tileRect(key))
+                entry.dirty = entry.dirty.united(dirty) if entry.dirty is not None else dirty
+        self.update(QRectF(rect))
+
+    # Must be called before the canvas changes size
+    def resizeCanvas(self):
+        self.prepareGeometryChange()
+        self.tiles.clear()
+        self.cachedBytes = 0
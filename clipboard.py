@@ -0,0 +1,69 @@
+from PySide6.QtCore import QMimeData, QBuffer, QByteArray, QIODevice, QRect, QPoint
+from PySide6.QtGui import QGuiApplication, QImage, QPixmap
+
+# Marks clipboard data copied from PastEven, pasting it back skips the PNG round trip
+SELECTION_MIME = "application/x-pasteven-selection"
+IMAGE_MIME = "application/x-qt-image"
+PNG_MIME = "image/png"
+# Selections smaller than this fraction of their layer are cropped right away. Larger ones
+# share the layer's pixels, which Qt only copies if the layer is painted on while they're held.
+SHARE_FRACTION = 0.25
+
+# Copied pixels that are only cropped and encoded when something asks for them. The clipboard
+# lists the formats up front and calls retrieveData once a paste (in any app) picks one.
+class SelectionMimeData(QMimeData):
+    def __init__(self, source, rect, origin):
+        super().__init__()
+        # Implicitly shared copies, the layer or floating pixmap itself can keep changing
+        self.source = QPixmap(source) if isinstance(source, QPixmap) else QImage(source)
+        self.rect = QRect(rect)
+        # Canvas position the pixels were copied from, pasting puts them back there
+        self.origin = QPoint(origin)
+        self.image = None
+        self.png = None
+
+    def formats(self):
+        return [SELECTION_MIME, IMAGE_MIME, PNG_MIME]
+
+    def hasFormat(self, mimeType):
+        return mimeType in self.formats()
+
+    # The copied pixels, cropped out of the source on first use
+    def selectionImage(self):
+        if self.image is None:
+            source = self.source.toImage() if isinstance(self.source, QPixmap) else self.source
+            self.image = source.copy(self.rect)
+            self.source = None
+        return self.image
+
+    def retrieveData(self, mimeType, preferredType):
+        if mimeType == IMAGE_MIME:
+            return self.selectionImage()
+        if mimeType == PNG_MIME:
+            if self.png is None:
+                buffer = QBuffer()
+                buffer.open(QIODevice.WriteOnly)
+                self.selectionImage().save(buffer, "PNG")
+                self.png = buffer.data()
+            return self.png
+        if mimeType == SELECTION_MIME:
+            return QByteArray()
+        return super().retrieveData(mimeType, preferredType)
+
+# Puts rect of source (a QImage or QPixmap) on the system clipboard without reading its pixels
+def copyToClipboard(source, rect, origin):
+    area = source.width() * source.height()
+    if rect.width() * rect.height() < SHARE_FRACTION * area:
+        source = source.copy(rect)
+        rect = source.rect()
+    QGuiApplication.clipboard().setMimeData(SelectionMimeData(source, rect, origin))
+
+# Returns the clipboard image and where on the canvas it was copied from,
+# (None, None) if the clipboard holds no image. The origin is only known for our own copies.
+def clipboardImage():
+    clipboard = QGuiApplication.clipboard()
+    data = clipboard.mimeData()
+    if isinstance(data, SelectionMimeData):
+        return data.selectionImage(), data.origin
+    image = clipboard.image()
+    return (None, None) if image.isNull() else (image, None)
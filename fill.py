@@ -0,0 +1,31 @@
+DEFAULT_TOLERANCE = 32
+
+# Finds the 4-connected region around (x, y) whose pixels differ from the seed pixel
+# by at most tolerance in every channel of a (height, width, 4) array.
+# Returns a 0/255 mask of that region and its bounding box as (x, y, width, height).
+# Both steps run as scanline loops inside OpenCV, no per-pixel Python.
+def floodFillMask(pixels, x, y, tolerance=DEFAULT_TOLERANCE):
+    import cv2
+    import numpy as np
+    seed = pixels[y, x].astype(np.int16)
+    low = np.clip(seed - tolerance, 0, 255).astype(np.uint8)
+    high = np.clip(seed + tolerance, 0, 255).astype(np.uint8)
+    similar = cv2.inRange(pixels, low, high)
+    mask = np.zeros((pixels.shape[0] + 2, pixels.shape[1] + 2), dtype=np.uint8)
+    _, _, _, box = cv2.floodFill(similar, mask, (x, y), 0, 0, 0, 4 | cv2.FLOODFILL_MASK_ONLY | (255 << 8))
+    return mask[1:-1, 1:-1], box
+
+# Paints value (4 stored bytes, see imagebuffer.pixelValue) into pixels wherever mask is set.
+# With antialias the mask edge is feathered by about a pixel, blending with what was there.
+# pixels and mask cover the same area and pixels is changed in place.
+def fillMask(pixels, mask, value, antialias=True):
+    import cv2
+    import numpy as np
+    if not antialias:
+        pixels[mask == 255] = value
+        return
+    coverage = cv2.GaussianBlur(mask, (3, 3), 0)
+    # Inside the region stays solid, only the outside edge gets partial coverage
+    coverage = np.maximum(coverage, mask).astype(np.uint16)[..., None]
+    blended = (value.astype(np.uint16) * coverage + pixels.astype(np.uint16) * (255 - coverage) + 127) // 255
+    np.copyto(pixels, blended.astype(np.uint8), where=coverage > 0)
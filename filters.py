@@ -0,0 +1,329 @@
+from PySide6.QtWidgets import QDialog, QFormLayout, QSlider, QDialogButtonBox, QLabel
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal, Qt
+from PySide6.QtGui import QPixmap, QTransform
+
+from concurrent.futures import ThreadPoolExecutor
+import math
+import os
+
+from layers import TILE_SIZE
+from border import detectBorderMask, DEFAULT_LOW, DEFAULT_HIGH, DEFAULT_THICKNESS
+from imagebuffer import arrayToImage
+
+# Most pixels a preview is computed at, larger views are previewed at a lower resolution
+PREVIEW_PIXELS = 1024 * 1024
+
+# Filters take and return (height, width, 4) premultiplied BGRA arrays, the layer format on
+# little-endian machines (see imagebuffer). scale is below 1 for previews, sizes given in
+# canvas pixels are multiplied by it.
+
+# Straight color of premultiplied pixels, for filters that remap color values
+def unpremultiply(pixels):
+    import numpy as np
+    alpha = pixels[..., 3:].astype(np.uint16)
+    color = (pixels[..., :3].astype(np.uint16) * 255 + alpha // 2) // np.maximum(alpha, 1)
+    return np.minimum(color, 255).astype(np.uint8)
+
+def premultiply(color, alpha):
+    import numpy as np
+    result = np.empty(color.shape[:2] + (4,), dtype=np.uint8)
+    result[..., :3] = (color.astype(np.uint16) * alpha + 127) // 255
+    result[..., 3:] = alpha
+    return result
+
+def blur(pixels, values, scale):
+    import cv2
+    return cv2.GaussianBlur(pixels, (0, 0), max(values["radius"] * scale, 0.1))
+
+# A gaussian reaches about three sigmas out
+def blurHalo(values, scale):
+    return math.ceil(3 * values["radius"] * scale)
+
+# Unsharp mask: pushes pixels away from their blurred surroundings
+def sharpen(pixels, values, scale):
+    import cv2
+    import numpy as np
+    amount = values["amount"] / 100
+    blurred = cv2.GaussianBlur(pixels, (0, 0), max(values["radius"] * scale, 0.1))
+    result = cv2.addWeighted(pixels, 1 + amount, blurred, -amount, 0)
+    result[..., 3] = pixels[..., 3]
+    # Premultiplied color can't be brighter than its alpha
+    np.minimum(result[..., :3], result[..., 3:], out=result[..., :3])
+    return result
+
+def levels(pixels, values, scale):
+    import cv2
+    import numpy as np
+    black = values["black"]
+    white = max(values["white"], black + 1)
+    ramp = np.clip((np.arange(256) - black) / (white - black), 0, 1) ** (100 / values["gamma"])
+    lut = np.round(ramp * 255).astype(np.uint8)
+    return premultiply(cv2.LUT(unpremultiply(pixels), lut), pixels[..., 3:])
+
+def hueSaturation(pixels, values, scale):
+    import cv2
+    import numpy as np
+    hsv = cv2.cvtColor(unpremultiply(pixels), cv2.COLOR_BGR2HSV_FULL)
+    hue = hsv[..., 0].astype(np.int16) + round(values["hue"] * 256 / 360)
+    hsv[..., 0] = (hue % 256).astype(np.uint8)
+    saturation = hsv[..., 1].astype(np.float32) * (1 + values["saturation"] / 100)
+    hsv[..., 1] = np.clip(saturation, 0, 255).astype(np.uint8)
+    value = hsv[..., 2].astype(np.int16) + round(values["lightness"] * 2.55)
+    hsv[..., 2] = np.clip(value, 0, 255).astype(np.uint8)
+    return premultiply(cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR_FULL), pixels[..., 3:])
+
+# Black where the luminance is below level, white elsewhere, alpha is kept
+def threshold(pixels, values, scale):
+    import cv2
+    import numpy as np
+    gray = cv2.cvtColor(unpremultiply(pixels), cv2.COLOR_BGR2GRAY)
+    level = np.where(gray >= values["level"], 255, 0).astype(np.uint8)
+    return premultiply(np.repeat(level[..., None], 3, axis=2), pixels[..., 3:])
+
+# The Canny border of findBorder, painted in opaque black
+def border(pixels, values, scale):
+    mask = detectBorderMask(pixels, values["low"], values["high"], max(round(values["thickness"] * scale), 1))
+    result = pixels.copy()
+    result[mask == 255] = (0, 0, 0, 255)
+    return result
+
+# An image operation plus its settings, each a (key, label, minimum, maximum, default) slider.
+# halo is how many pixels of context around a tile the operation reads. Operations that aren't
+# local (edge tracking follows edges across the whole image) run as a single tile.
+class Filter:
+    def __init__(self, name, params, function, halo=None, tiled=True):
+        self.name = name
+        self.params = params
+        self.function = function
+        self.haloFunction = halo
+        self.tiled = tiled
+
+    def defaults(self):
+        return {key: default for key, _, _, _, default in self.params}
+
+    def halo(self, values, scale=1.0):
+        return self.haloFunction(values, scale) if self.haloFunction else 0
+
+FILTERS = {filter.name: filter for filter in (
+    Filter("Blur", [("radius", "Radius", 1, 50, 4)], blur, blurHalo),
+    Filter("Sharpen", [("amount", "Amount %", 0, 300, 100), ("radius", "Radius", 1, 20, 2)], sharpen, blurHalo),
+    Filter("Levels", [("black", "Black point", 0, 254, 0), ("white", "White point", 1, 255, 255),
+                      ("gamma", "Gamma %", 10, 300, 100)], levels),
+    Filter("Hue/Saturation", [("hue", "Hue", -180, 180, 0), ("saturation", "Saturation", -100, 100, 0),
+                              ("lightness", "Lightness", -100, 100, 0)], hueSaturation),
+    Filter("Threshold", [("level", "Level", 0, 255, 128)], threshold),
+    Filter("Border", [("low", "Low threshold", 0, 500, DEFAULT_LOW), ("high", "High threshold", 0, 500, DEFAULT_HIGH),
+                      ("thickness", "Thickness", 1, 20, DEFAULT_THICKNESS)], border, tiled=False),
+)}
+
+# Shared by every filter run. cv2 and NumPy release the GIL, so the tiles really run in parallel.
+tileExecutor = None
+
+def executor():
+    global tileExecutor
+    if tileExecutor is None:
+        tileExecutor = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="filter")
+    return tileExecutor
+
+# Filters area (x, y, width, height) of source in TILE_SIZE tiles spread over the executor.
+# source holds the pixels around area too, each tile reads up to the filter's halo of them.
+# Returns the filtered area as a new array, or None if cancelled() turned true.
+# An exception raised by any tile is raised here.
+def runFilter(filter, values, source, area, scale=1.0, cancelled=lambda: False):
+    import numpy as np
+    x, y, width, height = area
+    halo = filter.halo(values, scale)
+    result = np.empty((height, width, 4), dtype=np.uint8)
+    step = TILE_SIZE if filter.tiled else max(width, height)
+    tiles = [(tx, ty, min(step, width - tx), min(step, height - ty))
+             for ty in range(0, height, step) for tx in range(0, width, step)]
+
+    def work(tile):
+        if cancelled():
+            return
+        tx, ty, tw, th = tile
+        left, top = max(x + tx - halo, 0), max(y + ty - halo, 0)
+        right, bottom = min(x + tx + tw + halo, source.shape[1]), min(y + ty + th + halo, source.shape[0])
+        filtered = filter.function(np.ascontiguousarray(source[top:bottom, left:right]), values, scale)
+        offsetX, offsetY = x + tx - left, y + ty - top
+        result[ty:ty + th, tx:tx + tw] = filtered[offsetY:offsetY + th, offsetX:offsetX + tw]
+
+    list(executor().map(work, tiles))
+    return None if cancelled() else result
+
+# Shrinks source and the area inside it by scale, for previews
+def scaleSource(source, area, scale):
+    import cv2
+    height, width = source.shape[:2]
+    scaled = cv2.resize(source, (max(round(width * scale), 1), max(round(height * scale), 1)), interpolation=cv2.INTER_AREA)
+    x, y = min(round(area[0] * scale), scaled.shape[1] - 1), min(round(area[1] * scale), scaled.shape[0] - 1)
+    return scaled, (x, y, max(min(round(area[2] * scale), scaled.shape[1] - x), 1),
+                    max(min(round(area[3] * scale), scaled.shape[0] - y), 1))
+
+class FilterSignals(QObject):
+    finished = Signal(object, object)
+    failed = Signal(object, str)
+
+class FilterTask(QRunnable):
+    def __init__(self, key, filter, values, source, area, scale):
+        super().__init__()
+        self.key = key
+        self.filter = filter
+        self.values = values
+        self.source = source
+        self.area = area
+        self.scale = scale
+        self.cancelled = False
+        self.signals = FilterSignals()
+
+    def run(self):
+        try:
+            result = runFilter(self.filter, self.values, self.source, self.area, self.scale, lambda: self.cancelled)
+        except Exception as error:
+            if not self.cancelled:
+                self.signals.failed.emit(self.key, str(error))
+            return
+        if result is not None and not self.cancelled:
+            self.signals.finished.emit(self.key, result)
+
+# Runs one filter request at a time off the GUI thread, its tiles fan out over the executor.
+# A new request cancels the one in flight.
+class FilterEngine(QObject):
+    resultReady = Signal(object, object)
+    failed = Signal(object, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.current = None
+
+    # Answered through resultReady(key, pixels), or failed(key, error) if the filter raised
+    def request(self, key, filter, values, source, area, scale=1.0):
+        self.cancel()
+        task = FilterTask(key, filter, values, source, area, scale)
+        task.signals.finished.connect(self.taskFinished)
+        task.signals.failed.connect(self.taskFailed)
+        self.current = task
+        self.pool.start(task)
+
+    def cancel(self):
+        if self.current:
+            self.current.cancelled = True
+            self.pool.tryTake(self.current)
+            self.current = None
+
+    def taskFinished(self, key, pixels):
+        if self.current and self.current.key == key:
+            self.current = None
+            self.resultReady.emit(key, pixels)
+
+    def taskFailed(self, key, error):
+        if self.current and self.current.key == key:
+            self.current = None
+            self.failed.emit(key, error)
+
+# Tunes a filter while an overlay previews it over the visible part of rect, at no more
+# than PREVIEW_PIXELS. Apply filters the whole rect at full resolution.
+class FilterDialog(QDialog):
+    def __init__(self, canvas, rect, filter):
+        super().__init__(canvas)
+        self.setWindowTitle(filter.name)
+        self.setModal(True)
+        self.canvas = canvas
+        self.rect = rect
+        self.filter = filter
+        self.engine = canvas.filterEngine
+        self.generation = 0
+
+        layout = QFormLayout(self)
+        self.sliders = {key: self.addSlider(layout, label, minimum, maximum, default)
+                        for key, label, minimum, maximum, default in filter.params}
+
+        self.buttons = QDialogButtonBox(QDialogButtonBox.Apply | QDialogButtonBox.Cancel)
+        self.buttons.button(QDialogButtonBox.Apply).clicked.connect(self.accept)
+        self.buttons.rejected.connect(self.reject)
+        self.errorLabel = QLabel()
+        self.errorLabel.setWordWrap(True)
+        self.errorLabel.hide()
+        layout.addRow(self.errorLabel)
+        layout.addRow(self.buttons)
+
+        self.overlay = canvas.scene.addPixmap(QPixmap())
+        self.overlay.setTransformationMode(Qt.SmoothTransformation)
+        self.overlay.setZValue(1)
+        self.engine.resultReady.connect(self.showResult)
+        self.engine.failed.connect(self.showError)
+        self.finished.connect(self.cleanUp)
+        self.requestPreview()
+
+    def addSlider(self, layout, label, minimum, maximum, value):
+        slider = QSlider(Qt.Horizontal)
+        slider.setRange(minimum, maximum)
+        slider.setValue(value)
+        slider.valueChanged.connect(self.requestPreview)
+        layout.addRow(label, slider)
+        return slider
+
+    def values(self):
+        return {key: slider.value() for key, slider in self.sliders.items()}
+
+    # The part of rect in view and the scale to preview it at, never above the view's zoom
+    def previewArea(self):
+        view = self.canvas.mapToScene(self.canvas.viewport().rect()).boundingRect().toAlignedRect()
+        visible = view.intersected(self.rect)
+        pixels = max(visible.width() * visible.height(), 1)
+        return visible, min(1.0, self.canvas.transform().m11(), math.sqrt(PREVIEW_PIXELS / pixels))
+
+    def requestPreview(self):
+        visible, scale = self.previewArea()
+        if visible.isEmpty():
+            return
+        values = self.values()
+        source, area = self.canvas.filterSource(visible, self.filter.halo(values))
+        if scale < 1:
+            source, area = scaleSource(source, area, scale)
+        self.generation += 1
+        self.previewPlace = (visible, area)
+        self.engine.request(("preview", self.generation), self.filter, values, source, area, scale)
+
+    def showResult(self, key, pixels):
+        kind, generation = key
+        if generation != self.generation:
+            return
+        if kind == "commit":
+            self.canvas.applyFilter(self.rect, pixels)
+            super().accept()
+            return
+        self.errorLabel.hide()
+        visible, area = self.previewPlace
+        self.overlay.setPixmap(QPixmap.fromImage(arrayToImage(pixels)))
+        self.overlay.setPos(visible.topLeft())
+        self.overlay.setTransform(QTransform.fromScale(visible.width() / area[2], visible.height() / area[3]))
+
+    # The filter raised, the dialog says so and can be tuned or applied again
+    def showError(self, key, error):
+        if key[1] != self.generation:
+            return
+        self.errorLabel.setText(f"{self.filter.name} failed: {error}")
+        self.errorLabel.show()
+        self.setEditable(True)
+
+    def setEditable(self, editable):
+        for slider in self.sliders.values():
+            slider.setEnabled(editable)
+        self.buttons.button(QDialogButtonBox.Apply).setEnabled(editable)
+
+    # Filters the whole rect at full resolution, the dialog closes once it's painted in
+    def accept(self):
+        self.setEditable(False)
+        values = self.values()
+        source, area = self.canvas.filterSource(self.rect, self.filter.halo(values))
+        self.generation += 1
+        self.engine.request(("commit", self.generation), self.filter, values, source, area)
+
+    def cleanUp(self):
+        self.engine.resultReady.disconnect(self.showResult)
+        self.engine.failed.disconnect(self.showError)
+        self.engine.cancel()
+        self.canvas.scene.removeItem(self.overlay)
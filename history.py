@@ -0,0 +1,295 @@
+from PySide6.QtCore import QRect
+from PySide6.QtGui import QPainter
+
+from layers import TILE_SIZE
+from historyspill import HistorySpill
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+DEFAULT_SPILL_BUDGET = 2 * 1024 * 1024 * 1024
+CHECKPOINT_INTERVAL = 25
+# Entries further than this from the current version are moved out of memory into the spill file
+MEMORY_ENTRIES = 32
+
+# A single undoable action, holding only the tiles it touched (before and after)
+class HistoryEntry:
+    def __init__(self):
+        self.before = {}
+        self.after = {}
+        self.bytes = 0
+        # (offset, length) in the spill file once the tiles left memory, before and after then only keep their keys
+        self.spill = None
+        self.spilling = False
+        self.dropped = False
+
+# Versioned undo history that stores per-tile deltas instead of whole canvas snapshots.
+# Version N is the canvas after N actions; entries[i] turns version baseVersion + i into the next one.
+# A full checkpoint of every layer is kept every checkpointInterval versions so any version
+# is reachable with one checkpoint restore plus at most checkpointInterval deltas.
+# Tiles are keyed by (layer, x, y) so actions on any layer can be undone.
+# Only the entries within memoryEntries of the current version keep their tiles in memory,
+# older (or far redone) ones are compressed into a temp file in the background and read back on demand.
+# memoryBudget bounds what stays in memory, spillBudget the spill file, the oldest entries go past either.
+class TileHistory:
+    def __init__(self, document, tileSize=TILE_SIZE, memoryBudget=DEFAULT_MEMORY_BUDGET, checkpointInterval=CHECKPOINT_INTERVAL,
+                 memoryEntries=MEMORY_ENTRIES, spillBudget=DEFAULT_SPILL_BUDGET, spillDirectory=None):
+        self.document = document
+        self.tileSize = tileSize
+        self.memoryBudget = memoryBudget
+        self.checkpointInterval = checkpointInterval
+        self.memoryEntries = memoryEntries
+        self.spillBudget = spillBudget
+        self.spill = HistorySpill(self.entrySpilled, spillDirectory)
+        self.entries = []
+        self.index = 0
+        self.baseVersion = 0
+        self.checkpoints = {}
+        # Bytes of tiles and checkpoints held in memory, spilled entries don't count
+        self.memoryUsed = 0
+        self.pending = None
+        self.target = None
+
+    # The version currently shown on the canvas
+    def version(self):
+        return self.baseVersion + self.index
+
+    # Oldest version that can still be restored
+    def firstVersion(self):
+        return self.baseVersion
+
+    # Newest version, including undone actions that can be redone
+    def lastVersion(self):
+        return self.baseVersion + len(self.entries)
+
+    def canUndo(self):
+        return self.index > 0
+
+    def canRedo(self):
+        return self.index < len(self.entries)
+
+    # Starts recording an action that will paint into the image of layer target
+    def beginAction(self, target):
+        if self.pending:
+            self.commitAction()
+        self.pending = HistoryEntry()
+        self.target = target
+
+    # Copies the untouched tiles under rect, must be called before painting into it
+    def markDirty(self, rect):
+        if not self.pending:
+            return
+        self.document.ensureLoaded(rect)
+        self.document.markUsed(rect)
+        for key in self.tilesIn(rect):
+            if key not in self.pending.before:
+                self.pending.before[key] = self.target.image.copy(self.tileRect(key))
+
+    # Finishes the current action and makes it the newest version
+    def commitAction(self):
+        entry = self.pending
+        self.cancelAction()
+        if not entry or not entry.before:
+            return False
+        for key in entry.before:
+            tile = key[0].image.copy(self.tileRect(key))
+            entry.after[key] = tile
+            entry.bytes += self.tileBytes(entry.before[key]) + self.tileBytes(tile)
+        self.dropRedo()
+        self.entries.append(entry)
+        self.index += 1
+        self.memoryUsed += entry.bytes
+        # Tiles of a lazily opened project are still on disk, a checkpoint would miss them
+        if self.version() % self.checkpointInterval == 0 and not self.document.hasPendingTiles():
+            checkpoint = {layer: layer.image.copy() for layer in self.document.layers}
+            self.checkpoints[self.version()] = checkpoint
+            self.memoryUsed += self.checkpointBytes(checkpoint)
+        self.evict()
+        self.spillOld()
+        return True
+
+    # Drops the current action without recording it
+    def cancelAction(self):
+        self.pending = None
+        self.target = None
+
+    # Steps one version back, returns the rect that changed
+    def undo(self):
+        if not self.canUndo():
+            return None
+        return self.goTo(self.version() - 1)
+
+    # Steps one version forward, returns the rect that changed
+    def redo(self):
+        if not self.canRedo():
+            return None
+        return self.goTo(self.version() + 1)
+
+    # Jumps straight to any version, returns the rect that changed
+    def goTo(self, version):
+        version = max(self.firstVersion(), min(version, self.lastVersion()))
+        start = self.version()
+        if version == start:
+            return None
+
+        changed = QRect()
+        checkpoint = self.nearestCheckpoint(version)
+        if checkpoint is not None and abs(version - checkpoint) < abs(version - start) and self.canRestore(checkpoint, start):
+            changed = self.restoreCheckpoint(self.checkpoints[checkpoint])
+            start = checkpoint
+
+        # Merge the deltas so every tile is painted once, whatever the number of steps
+        tiles = {}
+        if version > start:
+            for entry in self.entries[start - self.baseVersion:version - self.baseVersion]:
+                tiles.update(self.entryTiles(entry)[1])
+        else:
+            for entry in reversed(self.entries[version - self.baseVersion:start - self.baseVersion]):
+                tiles.update(self.entryTiles(entry)[0])
+        changed = changed.united(self.restore(tiles))
+        self.index = version - self.baseVersion
+        self.spillOld()
+        return changed
+
+    # The before and after tiles of entry, read back from the spill file if it was moved there
+    def entryTiles(self, entry):
+        if entry.spill is None:
+            return entry.before, entry.after
+        return self.spill.load(entry)
+
+    # Starts moving the tiles of entries far from the current version to the spill file
+    def spillOld(self):
+        for i, entry in enumerate(self.entries):
+            if entry.spill is None and not entry.spilling and abs(i - self.index) > self.memoryEntries:
+                entry.spilling = True
+                self.spill.store(entry)
+
+    # An entry's tiles reached the spill file, the in-memory copies can go
+    def entrySpilled(self, entry, ref):
+        entry.spilling = False
+        entry.spill = ref
+        if entry.dropped:
+            self.spill.release(entry)
+            return
+        entry.before = dict.fromkeys(entry.before)
+        entry.after = dict.fromkeys(entry.after)
+        self.memoryUsed -= entry.bytes
+
+    # Forgets an entry that is no longer part of history
+    def dropEntry(self, entry):
+        entry.dropped = True
+        if entry.spill is not None:
+            self.spill.release(entry)
+        else:
+            self.memoryUsed -= entry.bytes
+
+    # Bytes of spilled entries still in history
+    def spilledBytes(self):
+        return self.spill.liveBytes
+
+    def spilledEntries(self):
+        return sum(1 for entry in self.entries if entry.spill is not None)
+
+    # Returns the stored checkpoint version closest to version, if any
+    def nearestCheckpoint(self, version):
+        if not self.checkpoints:
+            return None
+        return min(self.checkpoints, key=lambda checkpoint: abs(checkpoint - version))
+
+    # A checkpoint can stand in for version start only if it holds every layer edited in between,
+    # layers added after it was taken would otherwise keep their newer pixels
+    def canRestore(self, checkpoint, start):
+        layers = self.checkpoints[checkpoint]
+        first, last = sorted((checkpoint, start))
+        return all(key[0] in layers
+                   for entry in self.entries[first - self.baseVersion:last - self.baseVersion]
+                   for key in entry.before)
+
+    # Forgets every recorded action
+    def clear(self):
+        for entry in self.entries:
+            entry.dropped = True
+        self.entries.clear()
+        self.checkpoints.clear()
+        self.index = 0
+        self.baseVersion = 0
+        self.memoryUsed = 0
+        self.spill.reset()
+        self.cancelAction()
+
+    # Drops undone entries and their checkpoints, called whenever a new action is recorded
+    def dropRedo(self):
+        if self.canRedo():
+            self.document.dropRedo(self.version())
+        for entry in self.entries[self.index:]:
+            self.dropEntry(entry)
+        del self.entries[self.index:]
+        for version in [v for v in self.checkpoints if v > self.version()]:
+            self.memoryUsed -= self.checkpointBytes(self.checkpoints.pop(version))
+
+    # Evicts the oldest entries until the history fits in the memory and spill budgets
+    def evict(self):
+        while (self.memoryUsed > self.memoryBudget or self.spilledBytes() > self.spillBudget) and self.index > 1:
+            entry = self.entries.pop(0)
+            self.dropEntry(entry)
+            self.baseVersion += 1
+            self.index -= 1
+            for version in [v for v in self.checkpoints if v < self.baseVersion]:
+                self.memoryUsed -= self.checkpointBytes(self.checkpoints.pop(version))
+
+    # Changes the memory budget and evicts if needed
+    def setMemoryBudget(self, memoryBudget):
+        self.memoryBudget = memoryBudget
+        self.evict()
+
+    # Paints the given tiles back into their layers
+    def restore(self, tiles):
+        changed = QRect()
+        byLayer = {}
+        for key, tile in tiles.items():
+            byLayer.setdefault(key[0], []).append((key, tile))
+            # A tile still on disk would otherwise be decoded over the restored pixels later
+            self.document.ensureLoaded(self.tileRect(key))
+        for layer, layerTiles in byLayer.items():
+            painter = QPainter(layer.image)
+            painter.setCompositionMode(QPainter.CompositionMode_Source)
+            for key, tile in layerTiles:
+                rect = self.tileRect(key)
+                self.document.markUsed(rect)
+                painter.drawImage(rect.topLeft(), tile)
+                changed = changed.united(rect)
+            painter.end()
+        return changed
+
+    # Paints a full checkpoint back into its layers
+    def restoreCheckpoint(self, checkpoint):
+        changed = QRect()
+        self.document.ensureLoaded(self.document.rect())
+        for layer, image in checkpoint.items():
+            painter = QPainter(layer.image)
+            painter.setCompositionMode(QPainter.CompositionMode_Source)
+            painter.drawImage(0, 0, image)
+            painter.end()
+            changed = changed.united(layer.image.rect())
+        self.document.markUsed(changed)
+        return changed
+
+    # Returns the keys of all tiles of the target layer overlapping rect
+    def tilesIn(self, rect):
+        rect = QRect(rect).intersected(self.target.image.rect())
+        if rect.isEmpty():
+            return []
+        size = self.tileSize
+        return [(self.target, x, y)
+                for y in range(rect.top() // size, rect.bottom() // size + 1)
+                for x in range(rect.left() // size, rect.right() // size + 1)]
+
+    # Returns the rect covered by a tile, clipped to its layer
+    def tileRect(self, key):
+        layer, x, y = key
+        rect = QRect(x * self.tileSize, y * self.tileSize, self.tileSize, self.tileSize)
+        return rect.intersected(layer.image.rect())
+
+    def tileBytes(self, tile):
+        return tile.width() * tile.height() * max(tile.depth() // 8, 1)
+
+    def checkpointBytes(self, checkpoint):
+        return sum(self.tileBytes(image) for image in checkpoint.values())
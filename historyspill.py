@@ -0,0 +1,120 @@
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal
+from PySide6.QtGui import QImage
+
+from collections import OrderedDict
+import os
+import struct
+import tempfile
+import threading
+import zlib
+
+from layers import IMAGE_FORMAT
+
+# Spilled entry: zlib compressed, per key of the entry (in order) its before and after tile,
+# each as TILE_HEADER (width, height) followed by the raw pixels
+TILE_HEADER = struct.Struct("<II")
+
+def packTiles(entry):
+    parts = []
+    for key in entry.before:
+        for tile in (entry.before[key], entry.after[key]):
+            parts.append(TILE_HEADER.pack(tile.width(), tile.height()))
+            parts.append(bytes(tile.constBits()))
+    return zlib.compress(b"".join(parts), 1)
+
+# Returns the before and after tiles of a packed entry as dicts keyed like the entry
+def unpackTiles(data, keys):
+    data = zlib.decompress(data)
+    before, after = {}, {}
+    offset = 0
+    for key in keys:
+        for tiles in (before, after):
+            width, height = TILE_HEADER.unpack_from(data, offset)
+            offset += TILE_HEADER.size
+            length = width * height * 4
+            tiles[key] = QImage(data[offset:offset + length], width, height, width * 4, IMAGE_FORMAT).copy()
+            offset += length
+    return before, after
+
+class SpillSignals(QObject):
+    finished = Signal(object, object)
+
+# Compresses an entry's tiles and appends them to the spill file
+class SpillTask(QRunnable):
+    def __init__(self, spill, entry):
+        super().__init__()
+        self.spill = spill
+        self.entry = entry
+        self.signals = SpillSignals()
+
+    def run(self):
+        data = packTiles(self.entry)
+        with self.spill.lock:
+            self.spill.file.seek(0, os.SEEK_END)
+            offset = self.spill.file.tell()
+            self.spill.file.write(data)
+        self.signals.finished.emit(self.entry, (offset, len(data)))
+
+# Anonymous temp file holding history entries that were moved out of memory. Entries are
+# packed on a background thread and handed back to stored(entry, ref) on the GUI thread.
+# Reloaded entries are kept in a small LRU, undoing step by step only decompresses each once.
+class HistorySpill(QObject):
+    def __init__(self, stored, directory=None, cacheEntries=8, parent=None):
+        super().__init__(parent)
+        self.stored = stored
+        self.directory = directory
+        self.cacheEntries = cacheEntries
+        self.cache = OrderedDict()
+        self.file = None
+        self.lock = threading.Lock()
+        # Bytes of the file still used by entries in history, the rest is freed on reset
+        self.liveBytes = 0
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+
+    def store(self, entry):
+        if self.file is None:
+            self.file = tempfile.TemporaryFile(prefix="pasteven-history-", dir=self.directory)
+        task = SpillTask(self, entry)
+        task.signals.finished.connect(self.taskFinished)
+        self.pool.start(task)
+
+    def taskFinished(self, entry, ref):
+        self.liveBytes += ref[1]
+        self.stored(entry, ref)
+
+    # The before and after tiles of a spilled entry
+    def load(self, entry):
+        tiles = self.cache.get(entry)
+        if tiles is not None:
+            self.cache.move_to_end(entry)
+            return tiles
+        offset, length = entry.spill
+        with self.lock:
+            self.file.seek(offset)
+            data = self.file.read(length)
+        tiles = self.cache[entry] = unpackTiles(data, list(entry.before))
+        if len(self.cache) > self.cacheEntries:
+            self.cache.popitem(last=False)
+        return tiles
+
+    # A spilled entry left history, its bytes in the file are dead
+    def release(self, entry):
+        self.liveBytes -= entry.spill[1]
+        self.cache.pop(entry, None)
+
+    # Size of the file on disk, including dead bytes
+    def fileBytes(self):
+        if self.file is None:
+            return 0
+        with self.lock:
+            return self.file.seek(0, os.SEEK_END)
+
+    # Empties the file once no entry uses it any more
+    def reset(self):
+        self.pool.waitForDone()
+        self.cache.clear()
+        self.liveBytes = 0
+        if self.file is not None:
+            self.file.close()
+            self.file = None
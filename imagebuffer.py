@@ -0,0 +1,65 @@
+from PySide6.QtCore import QRect
+from PySide6.QtGui import QImage
+
+import sys
+
+# Byte order of the four channels in memory. The ARGB32 family is stored as native
+# 0xAARRGGBB words, so on little-endian machines the bytes are B, G, R, A.
+_ARGB32_ORDER = "BGRA" if sys.byteorder == "little" else "ARGB"
+CHANNEL_ORDER = {
+    QImage.Format.Format_RGB32: _ARGB32_ORDER,
+    QImage.Format.Format_ARGB32: _ARGB32_ORDER,
+    QImage.Format.Format_ARGB32_Premultiplied: _ARGB32_ORDER,
+    QImage.Format.Format_RGBX8888: "RGBA",
+    QImage.Format.Format_RGBA8888: "RGBA",
+    QImage.Format.Format_RGBA8888_Premultiplied: "RGBA",
+}
+
+# Returns the memory order of image's channels, e.g. "BGRA"
+def channelOrder(image):
+    try:
+        return CHANNEL_ORDER[image.format()]
+    except KeyError:
+        raise ValueError(f"Unsupported image format {image.format()}, convert to a 32-bit format first")
+
+# Returns a (height, width, 4) uint8 view straight onto image's pixels, no copy is made.
+# Rows keep the image's stride, channels are in channelOrder(image).
+# image must stay alive and must not be resized or reassigned while the view is used.
+# A writable view detaches image first if it is implicitly shared.
+def imageView(image, rect=None, writable=False):
+    import numpy as np
+    channelOrder(image)
+    buffer = image.bits() if writable else image.constBits()
+    view = np.ndarray((image.height(), image.width(), 4), dtype=np.uint8, buffer=buffer,
+                      strides=(image.bytesPerLine(), 4, 1))
+    if not writable:
+        view.flags.writeable = False
+    if rect is not None:
+        rect = QRect(rect).intersected(image.rect())
+        view = view[rect.top():rect.bottom() + 1, rect.left():rect.right() + 1]
+    return view
+
+# Returns the index of each channel in a view of image, e.g. {"R": 2, "G": 1, "B": 0, "A": 3}
+def channelIndex(image):
+    return {channel: i for i, channel in enumerate(channelOrder(image))}
+
+# Returns color as the 4 bytes it is stored as in image (premultiplied when image is)
+def pixelValue(image, color):
+    import numpy as np
+    alpha = color.alpha()
+    values = {"R": color.red(), "G": color.green(), "B": color.blue(), "A": alpha}
+    if image.format() in (QImage.Format.Format_ARGB32_Premultiplied, QImage.Format.Format_RGBA8888_Premultiplied):
+        for channel in "RGB":
+            values[channel] = (values[channel] * alpha + 127) // 255
+    return np.array([values[channel] for channel in channelOrder(image)], dtype=np.uint8)
+
+# Wraps a (height, width, 4) uint8 array as a QImage without copying it.
+# The array must outlive the image, call .copy() on the result to keep it longer.
+def arrayToImage(array, imageFormat=QImage.Format.Format_ARGB32_Premultiplied):
+    import numpy as np
+    if array.ndim != 3 or array.shape[2] != 4 or array.dtype != np.uint8:
+        raise ValueError("Expected a (height, width, 4) uint8 array")
+    if array.strides[1:] != (4, 1) or array.strides[0] % 4:
+        raise ValueError("Pixels must be packed with 4-byte aligned rows, use np.ascontiguousarray first")
+    height, width = array.shape[:2]
+    return QImage(array.data, width, height, array.strides[0], imageFormat)
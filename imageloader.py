@@ -0,0 +1,162 @@
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, QCoreApplication, Signal, QSize
+from PySide6.QtGui import QImage, QImageReader
+
+from collections import OrderedDict
+import os
+
+from layers import IMAGE_FORMAT
+
+# Longest side of the quick preview shown while the full image decodes
+PREVIEW_SIZE = 1024
+
+# Decodes a small version of a JPEG by letting the decoder skip DCT detail (PIL draft mode).
+# Other formats can't be decoded at a reduced size cheaply, so they get no preview.
+def decodePreview(path, maxSide=PREVIEW_SIZE):
+    from PIL import Image
+    with Image.open(path) as image:
+        if image.format != "JPEG" or max(image.size) <= maxSide:
+            return None
+        scale = maxSide / max(image.size)
+        image.draft("RGB", (max(int(image.width * scale), 1), max(int(image.height * scale), 1)))
+        image = image.convert("RGBA")
+        return QImage(image.tobytes("raw", "RGBA"), image.width, image.height, image.width * 4,
+                      QImage.Format.Format_RGBA8888).copy()
+
+# Full resolution decode, already converted to the layer format so the GUI thread only swaps it in
+def decodeImage(path):
+    reader = QImageReader(path)
+    reader.setAutoTransform(True)
+    image = reader.read()
+    if image.isNull():
+        raise OSError(reader.errorString())
+    return image.convertToFormat(IMAGE_FORMAT)
+
+class LoadSignals(QObject):
+    preview = Signal(int, str, object, QSize)
+    loaded = Signal(int, str, object)
+    failed = Signal(int, str, str)
+
+class ImageLoadTask(QRunnable):
+    def __init__(self, generation, path):
+        super().__init__()
+        self.generation = generation
+        self.path = path
+        self.cancelled = False
+        self.signals = LoadSignals()
+
+    def run(self):
+        try:
+            size = QImageReader(self.path).size()
+            try:
+                preview = decodePreview(self.path)
+            except Exception:
+                preview = None
+            if preview is not None and not self.cancelled:
+                self.signals.preview.emit(self.generation, self.path, preview, size)
+            if self.cancelled:
+                return
+            image = decodeImage(self.path)
+            if not self.cancelled:
+                self.signals.loaded.emit(self.generation, self.path, image)
+        except Exception as error:
+            self.signals.failed.emit(self.generation, self.path, str(error))
+
+# Recently decoded documents, least recently used dropped first once maxBytes is exceeded.
+# Entries remember the file's size and mtime so a changed file is decoded again.
+class DocumentCache:
+    def __init__(self, maxBytes=512 * 1024 * 1024):
+        self.maxBytes = maxBytes
+        self.entries = OrderedDict()
+        self.usedBytes = 0
+
+    def fileKey(self, path):
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+
+    # Returns a shallow copy of the cached image, painting on it won't touch the cache
+    def get(self, path):
+        path = os.path.abspath(path)
+        entry = self.entries.get(path)
+        if entry is None:
+            return None
+        try:
+            if entry[0] != self.fileKey(path):
+                self.remove(path)
+                return None
+        except OSError:
+            self.remove(path)
+            return None
+        self.entries.move_to_end(path)
+        return QImage(entry[1])
+
+    def put(self, path, image):
+        path = os.path.abspath(path)
+        try:
+            key = self.fileKey(path)
+        except OSError:
+            return
+        self.remove(path)
+        if image.sizeInBytes() > self.maxBytes:
+            return
+        self.entries[path] = (key, QImage(image))
+        self.usedBytes += image.sizeInBytes()
+        while self.usedBytes > self.maxBytes:
+            _, (_, old) = self.entries.popitem(last=False)
+            self.usedBytes -= old.sizeInBytes()
+
+    def remove(self, path):
+        entry = self.entries.pop(path, None)
+        if entry:
+            self.usedBytes -= entry[1].sizeInBytes()
+
+# Decodes images on a worker thread. Only the newest request is delivered,
+# starting a load cancels the one before it.
+class ImageLoader(QObject):
+    preview = Signal(str, object, QSize)
+    loaded = Signal(str, object)
+    failed = Signal(str, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.generation = 0
+        self.current = None
+
+    def load(self, path):
+        self.cancel()
+        task = ImageLoadTask(self.generation, path)
+        task.signals.preview.connect(self.taskPreview)
+        task.signals.loaded.connect(self.taskLoaded)
+        task.signals.failed.connect(self.taskFailed)
+        self.current = task
+        self.pool.start(task)
+
+    def cancel(self):
+        self.generation += 1
+        if self.current:
+            self.current.cancelled = True
+            self.pool.tryTake(self.current)
+            self.current = None
+
+    def isLoading(self):
+        return self.current is not None
+
+    # Blocks until the running load is finished and its results are delivered
+    def waitForDone(self):
+        self.pool.waitForDone()
+        QCoreApplication.sendPostedEvents()
+
+    def taskPreview(self, generation, path, image, size):
+        if generation == self.generation:
+            self.preview.emit(path, image, size)
+
+    def taskLoaded(self, generation, path, image):
+        if generation == self.generation:
+            self.current = None
+            self.loaded.emit(path, image)
+
+    def taskFailed(self, generation, path, error):
+        if generation == self.generation:
+            self.current = None
+            self.failed.emit(path, error)
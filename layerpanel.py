@@ -0,0 +1,99 @@
+from PySide6.QtWidgets import QWidget, QListWidget, QListWidgetItem, QPushButton, QSlider, QComboBox, QVBoxLayout, QHBoxLayout, QLabel
+from PySide6.QtCore import Qt
+
+from layers import BLEND_MODES
+
+# Side panel listing the canvas layers (top layer first) with their opacity, blend mode and visibility
+class LayerPanel(QWidget):
+    def __init__(self, canvas, parent=None):
+        super().__init__(parent)
+        self.canvas = canvas
+        self.refreshing = False
+
+        layout = QVBoxLayout(self)
+
+        self.layerList = QListWidget()
+        self.layerList.currentRowChanged.connect(self.selectLayer)
+        self.layerList.itemChanged.connect(self.toggleVisible)
+        layout.addWidget(self.layerList)
+
+        buttons = QHBoxLayout()
+        for text, slot in (("+", self.addLayer), ("+V", self.addVectorLayer), ("-", self.removeLayer), ("Up", self.moveUp), ("Down", self.moveDown)):
+            button = QPushButton(text)
+            button.clicked.connect(slot)
+            buttons.addWidget(button)
+        layout.addLayout(buttons)
+
+        layout.addWidget(QLabel("Opacity"))
+        self.opacitySlider = QSlider(Qt.Horizontal)
+        self.opacitySlider.setRange(0, 100)
+        self.opacitySlider.valueChanged.connect(self.updateOpacity)
+        layout.addWidget(self.opacitySlider)
+
+        layout.addWidget(QLabel("Blend mode"))
+        self.blendBox = QComboBox()
+        self.blendBox.addItems(list(BLEND_MODES))
+        self.blendBox.currentTextChanged.connect(self.updateBlendMode)
+        layout.addWidget(self.blendBox)
+
+        self.refresh()
+
+    # Maps list rows (top first) to stack indexes (bottom first) and back
+    def rowToIndex(self, row):
+        return len(self.canvas.layers.layers) - 1 - row
+
+    # Rebuilds the list and controls from the canvas layers
+    def refresh(self):
+        self.refreshing = True
+        stack = self.canvas.layers
+        self.layerList.clear()
+        for layer in reversed(stack.layers):
+            item = QListWidgetItem(layer.name)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Checked if layer.visible else Qt.Unchecked)
+            self.layerList.addItem(item)
+        self.layerList.setCurrentRow(self.rowToIndex(stack.activeIndex))
+        active = stack.active()
+        self.opacitySlider.setValue(round(active.opacity * 100))
+        self.blendBox.setCurrentText(active.blendMode)
+        self.refreshing = False
+
+    def selectLayer(self, row):
+        if not self.refreshing and row >= 0:
+            self.canvas.setActiveLayer(self.rowToIndex(row))
+            self.refresh()
+
+    def toggleVisible(self, item):
+        if not self.refreshing:
+            index = self.rowToIndex(self.layerList.row(item))
+            self.canvas.setLayerVisible(index, item.checkState() == Qt.Checked)
+
+    def addLayer(self):
+        self.canvas.addLayer()
+        self.refresh()
+
+    def addVectorLayer(self):
+        self.canvas.addVectorLayer()
+        self.refresh()
+
+    def removeLayer(self):
+        self.canvas.removeLayer(self.canvas.layers.activeIndex)
+        self.refresh()
+
+    def moveUp(self):
+        index = self.canvas.layers.activeIndex
+        self.canvas.moveLayer(index, index + 1)
+        self.refresh()
+
+    def moveDown(self):
+        index = self.canvas.layers.activeIndex
+        self.canvas.moveLayer(index, index - 1)
+        self.refresh()
+
+    def updateOpacity(self, value):
+        if not self.refreshing:
+            self.canvas.setLayerOpacity(self.canvas.layers.activeIndex, value / 100)
+
+    def updateBlendMode(self, blendMode):
+        if not self.refreshing:
+            self.canvas.setLayerBlendMode(self.canvas.layers.activeIndex, blendMode)
@@ -0,0 +1,246 @@
+from PySide6.QtCore import Qt, QRect
+from PySide6.QtGui import QImage, QPainter
+
+IMAGE_FORMAT = QImage.Format.Format_ARGB32_Premultiplied
+TILE_SIZE = 256
+
+BLEND_MODES = {
+    "Normal": QPainter.CompositionMode_SourceOver,
+    "Multiply": QPainter.CompositionMode_Multiply,
+    "Screen": QPainter.CompositionMode_Screen,
+    "Overlay": QPainter.CompositionMode_Overlay,
+    "Darken": QPainter.CompositionMode_Darken,
+    "Lighten": QPainter.CompositionMode_Lighten,
+    "Color Dodge": QPainter.CompositionMode_ColorDodge,
+    "Color Burn": QPainter.CompositionMode_ColorBurn,
+    "Hard Light": QPainter.CompositionMode_HardLight,
+    "Soft Light": QPainter.CompositionMode_SoftLight,
+    "Difference": QPainter.CompositionMode_Difference,
+    "Exclusion": QPainter.CompositionMode_Exclusion,
+    "Add": QPainter.CompositionMode_Plus,
+}
+
+# Returns the (x, y) keys of every tile overlapping rect
+def tileKeysIn(rect, tileSize=TILE_SIZE):
+    if rect.isEmpty():
+        return []
+    return [(x, y)
+            for y in range(rect.top() // tileSize, rect.bottom() // tileSize + 1)
+            for x in range(rect.left() // tileSize, rect.right() // tileSize + 1)]
+
+# Creates a transparent image in the format every layer uses
+def createLayerImage(width, height):
+    image = QImage(width, height, IMAGE_FORMAT)
+    image.fill(Qt.GlobalColor.transparent)
+    return image
+
+class Layer:
+    def __init__(self, image, name):
+        self.image = image
+        self.name = name
+        self.opacity = 1.0
+        self.blendMode = "Normal"
+        self.visible = True
+        # VectorLayer holding the strokes the image is drawn from, None for pixel layers
+        self.vector = None
+
+# Ordered layers (index 0 is the bottom) plus the active one.
+# Visible layers below and above the active layer are kept pre-composited,
+# so drawing only has to blend the active layer between two cached images.
+# The caches are built tile by tile as the composite asks for them, and a side
+# with nothing visible on it has no cache at all.
+class LayerStack:
+    def __init__(self, width, height):
+        self.layers = []
+        self.activeIndex = 0
+        self.belowCache = None
+        self.aboveCache = None
+        # Layers above the active one are blended live when a blend mode can't be pre-composited
+        self.blendAbove = False
+        self.cachedTiles = set()
+        self.cacheValid = False
+        # Decodes tiles of a lazily opened project on first use, see project.py
+        self.tileLoader = None
+        # Tiles any layer has ever had pixels in, everything else is known to be transparent
+        self.usedTiles = set()
+        # StrokeLog kept in step with history, set by the canvas
+        self.strokeLog = None
+        self.reset(createLayerImage(width, height))
+
+    # Replaces every layer with a single layer holding image
+    def reset(self, image):
+        self.setLayers([Layer(image.convertToFormat(IMAGE_FORMAT), "Background")], 0)
+        self.markUsed(self.rect())
+
+    # Replaces the whole stack, the list object is kept since the history holds on to it
+    def setLayers(self, layers, activeIndex):
+        if self.tileLoader:
+            self.tileLoader.close()
+        self.layers[:] = layers
+        self.activeIndex = activeIndex
+        self.usedTiles.clear()
+        self.invalidateCache()
+
+    # Makes sure the pixels under rect are in memory before they are read or painted
+    def ensureLoaded(self, rect):
+        if self.tileLoader:
+            self.tileLoader.load(rect)
+
+    # Records that pixels may be painted under rect, must be called before painting
+    def markUsed(self, rect):
+        self.usedTiles.update(tileKeysIn(QRect(rect).intersected(self.rect())))
+
+    # History dropped the versions after version, the stroke log and vector layers forget their changes from them too
+    def dropRedo(self, version):
+        if self.strokeLog is not None:
+            self.strokeLog.truncate(version)
+        for layer in self.layers:
+            if layer.vector:
+                layer.vector.truncate(version)
+
+    def isTileUsed(self, key):
+        return key in self.usedTiles
+
+    def hasPendingTiles(self):
+        return self.tileLoader is not None and self.tileLoader.hasPendingTiles()
+
+    def width(self):
+        return self.layers[0].image.width()
+
+    def height(self):
+        return self.layers[0].image.height()
+
+    def rect(self):
+        return self.layers[0].image.rect()
+
+    def active(self):
+        return self.layers[self.activeIndex]
+
+    # Adds an empty layer above the active one and makes it active
+    def addLayer(self, name=None):
+        layer = Layer(createLayerImage(self.width(), self.height()), name or f"Layer {len(self.layers) + 1}")
+        self.activeIndex += 1
+        self.layers.insert(self.activeIndex, layer)
+        self.invalidateCache()
+        return layer
+
+    # Removes a layer, the last remaining layer can't be removed
+    def removeLayer(self, index):
+        if len(self.layers) <= 1:
+            return False
+        self.layers.pop(index)
+        if self.activeIndex >= index and self.activeIndex > 0:
+            self.activeIndex -= 1
+        self.invalidateCache()
+        return True
+
+    # Moves a layer to a new position in the stack, keeping the same layer active
+    def moveLayer(self, index, newIndex):
+        newIndex = max(0, min(newIndex, len(self.layers) - 1))
+        if index == newIndex:
+            return False
+        active = self.active()
+        self.layers.insert(newIndex, self.layers.pop(index))
+        self.activeIndex = self.layers.index(active)
+        self.invalidateCache()
+        return True
+
+    def setActive(self, index):
+        if index != self.activeIndex and 0 <= index < len(self.layers):
+            self.activeIndex = index
+            self.invalidateCache()
+
+    def setOpacity(self, index, opacity):
+        self.layers[index].opacity = max(0.0, min(opacity, 1.0))
+        self.layerChanged(index)
+
+    def setBlendMode(self, index, blendMode):
+        if blendMode in BLEND_MODES:
+            self.layers[index].blendMode = blendMode
+            self.layerChanged(index)
+
+    def setVisible(self, index, visible):
+        self.layers[index].visible = visible
+        self.layerChanged(index)
+
+    # Only the caches holding a non-active layer depend on its properties
+    def layerChanged(self, index):
+        if index != self.activeIndex:
+            self.invalidateCache()
+
+    def invalidateCache(self):
+        self.cacheValid = False
+        self.belowCache = None
+        self.aboveCache = None
+        self.cachedTiles.clear()
+
+    # Drops the cached tiles under rect, e.g. after undo touched a non-active layer.
+    # They are rebuilt the next time the composite needs them.
+    def refreshCache(self, rect):
+        if self.cacheValid:
+            self.cachedTiles.difference_update(tileKeysIn(QRect(rect).intersected(self.rect())))
+
+    # Makes sure the caches hold the tiles under rect
+    def ensureCache(self, rect):
+        if not self.cacheValid:
+            below = [layer for layer in self.layers[:self.activeIndex] if self.isShown(layer)]
+            above = [layer for layer in self.layers[self.activeIndex + 1:] if self.isShown(layer)]
+            # Left unfilled, every tile is rendered before it is read
+            self.belowCache = QImage(self.width(), self.height(), IMAGE_FORMAT) if below else None
+            # Pre-compositing is only exact for normal blending, other modes have to see the active layer
+            self.blendAbove = any(layer.blendMode != "Normal" for layer in above)
+            self.aboveCache = QImage(self.width(), self.height(), IMAGE_FORMAT) if above and not self.blendAbove else None
+            self.cacheValid = True
+        for x, y in tileKeysIn(QRect(rect).intersected(self.rect())):
+            if (x, y) in self.cachedTiles:
+                continue
+            tile = QRect(x * TILE_SIZE, y * TILE_SIZE, TILE_SIZE, TILE_SIZE).intersected(self.rect())
+            if self.belowCache is not None:
+                self.renderLayers(self.belowCache, self.layers[:self.activeIndex], tile)
+            if self.aboveCache is not None:
+                self.renderLayers(self.aboveCache, self.layers[self.activeIndex + 1:], tile)
+            self.cachedTiles.add((x, y))
+
+    def isShown(self, layer):
+        return layer.visible and layer.opacity > 0
+
+    # Composites layers into rect of target, replacing what was there
+    def renderLayers(self, target, layers, rect):
+        painter = QPainter(target)
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        painter.fillRect(rect, Qt.GlobalColor.transparent)
+        for layer in layers:
+            self.blendLayer(painter, layer, rect)
+        painter.end()
+
+    def blendLayer(self, painter, layer, rect):
+        if self.isShown(layer):
+            painter.setCompositionMode(BLEND_MODES[layer.blendMode])
+            painter.setOpacity(layer.opacity)
+            painter.drawImage(rect.topLeft(), layer.image, rect)
+
+    # Returns the composite of every visible layer for rect, built from the caches
+    def compositeRect(self, rect):
+        rect = QRect(rect).intersected(self.rect())
+        self.ensureLoaded(rect)
+        self.ensureCache(rect)
+        if self.belowCache is not None:
+            image = self.belowCache.copy(rect)
+        else:
+            image = createLayerImage(rect.width(), rect.height())
+        painter = QPainter(image)
+        painter.translate(-rect.x(), -rect.y())
+        self.blendLayer(painter, self.active(), rect)
+        if self.aboveCache is not None:
+            painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
+            painter.setOpacity(1.0)
+            painter.drawImage(rect.topLeft(), self.aboveCache, rect)
+        elif self.blendAbove:
+            for layer in self.layers[self.activeIndex + 1:]:
+                self.blendLayer(painter, layer, rect)
+        painter.end()
+        return image
+
+    # Returns the whole document as a single image
+    def flatten(self):
+        return self.compositeRect(self.rect())
@@ -1,12 +1,36 @@
 # Run this file boop bop
+# python main.py --profile-startup prints how long each startup phase took and exits after the first frame
 
-from PySide6.QtWidgets import QApplication
+import time
+STARTED = time.perf_counter()
 
 import sys
-from mainwindow import MainWindow
+from PySide6.QtWidgets import QApplication
+
+from profiler import StartupTimer
+
+# Milliseconds from launch to the first painted frame we aim to stay under
+STARTUP_BUDGET = 400
 
 if __name__ == '__main__':
+    profileStartup = "--profile-startup" in sys.argv[1:]
+    startup = StartupTimer(STARTED)
     app = QApplication(sys.argv)
+    app.setApplicationName("PastEven")
+    startup.mark("Qt")
+    from mainwindow import MainWindow
+    startup.mark("imports")
     window = MainWindow()
+    startup.mark("MainWindow")
     window.show()
-    sys.exit(app.exec())
\ No newline at end of file
+    startup.mark("show")
+    if profileStartup:
+        # Skips autosave, a recovery prompt would be counted as startup time
+        def firstFrame():
+            startup.mark("first frame")
+            print(startup.report(STARTUP_BUDGET))
+            app.quit()
+        window.canvas.firstFrame.connect(firstFrame)
+    else:
+        window.startAutosave()
+    sys.exit(app.exec())
@@ -1,16 +1,19 @@
-from PySide6.QtWidgets import QMainWindow, QWidget, QPushButton, QLabel, QToolBar, QSlider, QSizePolicy, QVBoxLayout, QButtonGroup, QLineEdit, QScrollArea, QColorDialog
+from PySide6.QtWidgets import QMainWindow, QMenu, QWidget, QPushButton, QLabel, QToolBar, QSlider, QSizePolicy, QVBoxLayout, QButtonGroup, QLineEdit, QScrollArea, QColorDialog, QDockWidget, QMessageBox, QCheckBox
 from PySide6.QtGui import QIcon
-from PySide6.QtCore import QSize, Qt
+from PySide6.QtCore import QSize, Qt, QTimer
 from PySide6 import QtGui
 
 from canvas import Canvas, Tools
+from layerpanel import LayerPanel
+from autosave import defaultDirectory, findRecovery
+from fill import DEFAULT_TOLERANCE
 
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("PastEven")
-        # TODO: Make Icon
-        self.setWindowIcon(QIcon("resources/pencil.png"))
+        # Icons are read from disk once the first frame is on screen, see loadIcons
+        self.pendingIcons = []
         self.setMinimumSize(QSize(1550, 1000))
         # self.setStyleSheet("background: #050B0D")
         centralWidget = QWidget(self)
@@ -19,7 +22,10 @@ class MainWindow(QMainWindow):
         layout = QVBoxLayout(centralWidget)
         
         self.canvas = Canvas()
+        self.canvas.firstFrame.connect(self.loadIcons, Qt.QueuedConnection)
+        self.canvas.toolChanged.connect(self.showTool)
         self.canvas.clicked.connect(self.updateHistorySlider)
+        self.canvas.historyChanged.connect(self.updateHistorySlider)
         
         scrollArea = QScrollArea()
         scrollArea.setWidgetResizable(True)
@@ -28,6 +34,8 @@ class MainWindow(QMainWindow):
         layout.addWidget(scrollArea)
         
         self.createToolbar()
+        self.createLayerPanel()
+        self.createStatusBar()
     
     # Creates the toolbar with all the tools and stuff
     def createToolbar(self):
@@ -40,22 +48,77 @@ class MainWindow(QMainWindow):
         toolbar.addSeparator()
         self.createHistoryActions(toolbar)
         toolbar.addSeparator()
+        self.createProfilingActions(toolbar)
+        toolbar.addSeparator()
         self.createTools(toolbar)
         self.createSizeControls(toolbar)
+        self.createBrushControls(toolbar)
+        self.createFillControls(toolbar)
         self.createColorPicker(toolbar)
         toolbar.addSeparator()
         self.createHistorySlider(toolbar)
     
-    # Adds the file action buttons (Save, Load, Border) to the toolbar
+    # Docks the layer panel on the right side of the window
+    def createLayerPanel(self):
+        self.layerPanel = LayerPanel(self.canvas)
+        self.canvas.documentChanged.connect(self.layerPanel.refresh)
+        self.canvas.documentChanged.connect(self.updateHistorySlider)
+        dock = QDockWidget("Layers", self)
+        dock.setWidget(self.layerPanel)
+        dock.setFeatures(QDockWidget.DockWidgetMovable)
+        self.addDockWidget(Qt.RightDockWidgetArea, dock)
+    
+    # Shows save progress and results in the status bar
+    def createStatusBar(self):
+        self.canvas.saveProgress.connect(lambda percent: self.statusBar().showMessage(f"Saving... {percent}%"))
+        self.canvas.saveFinished.connect(lambda path: self.statusBar().showMessage(f"Saved {path}", 3000))
+        self.canvas.saveFailed.connect(lambda path, error: self.statusBar().showMessage(f"Could not save {path}: {error}"))
+        # History memory readout, entries reach the spill file in the background so it's polled
+        self.historyLabel = QLabel()
+        self.statusBar().addPermanentWidget(self.historyLabel)
+        self.historyTimer = QTimer(self)
+        self.historyTimer.setInterval(1000)
+        self.historyTimer.timeout.connect(self.updateHistoryLabel)
+        self.historyTimer.start()
+        self.updateHistoryLabel()
+
+    def updateHistoryLabel(self):
+        history = self.canvas.history
+        megabyte = 1024 * 1024
+        self.historyLabel.setText(f"History: {history.memoryUsed / megabyte:.1f} MB in memory, "
+                                  f"{history.spilledBytes() / megabyte:.1f} MB spilled "
+                                  f"({history.spilledEntries()} of {len(history.entries)} steps)")
+    
+    # Adds the file action buttons (Save, Load, Border, SVG, Filters) to the toolbar
     def createFileActions(self, toolbar):
         saveButton = self.createButton("Save", self.canvas.save, 'Ctrl+S', "resources/icons/save.png")
         loadButton = self.createButton("Load", self.canvas.load, 'Ctrl+L', "resources/icons/load.png")
         borderButton = self.createButton("Border", self.canvas.findBorder, 'Ctrl+P', "resources/icons/border.png")
+        svgButton = self.createButton("SVG", self.canvas.exportSvg, 'Ctrl+Shift+E')
+        filterButton = self.createFilterButton()
         
         toolbar.addWidget(saveButton)
         toolbar.addWidget(loadButton)
         toolbar.addWidget(borderButton)
+        toolbar.addWidget(svgButton)
+        toolbar.addWidget(filterButton)
     
+    # Button with a menu of every filter, each opens its dialog on the selection or whole layer.
+    # The menu is filled the first time it opens, so filters.py isn't imported at startup.
+    def createFilterButton(self):
+        button = QPushButton("Filters")
+        menu = QMenu(button)
+        menu.aboutToShow.connect(lambda: self.fillFilterMenu(menu))
+        button.setMenu(menu)
+        return button
+
+    def fillFilterMenu(self, menu):
+        if not menu.isEmpty():
+            return
+        from filters import FILTERS
+        for name in FILTERS:
+            menu.addAction(name, lambda name=name: self.canvas.openFilter(name))
+
     # Adds undo and redo buttons to the toolbar as well as keybinds
     def createHistoryActions(self, toolbar):
         undoButton = self.createButton("Undo", self.undoAction, 'Ctrl+Z')
@@ -64,17 +127,34 @@ class MainWindow(QMainWindow):
         toolbar.addWidget(undoButton)
         toolbar.addWidget(redoButton)
     
+    # Adds the performance HUD toggle and trace export buttons to the toolbar
+    def createProfilingActions(self, toolbar):
+        hudButton = self.createButton("HUD", self.canvas.toggleHud, 'F3')
+        traceButton = self.createButton("Trace", self.canvas.exportTrace, 'Ctrl+Shift+T')
+        
+        toolbar.addWidget(hudButton)
+        toolbar.addWidget(traceButton)
+    
     # Adds tool selection buttons (Pencil, Eraser) to the toolbar
     def createTools(self, toolbar):
         self.toolButtons = QButtonGroup()
+        self.toolButtonFor = {}
         
         penButton = self.createToolButton("Pencil", Tools.PENCIL, "resources/icons/pencil.png", True)
         eraserButton = self.createToolButton("Eraser", Tools.ERASER, "resources/icons/eraser.png")
         selectButton = self.createToolButton("Select", Tools.RECTANGLE_SELECT, "resources/icons/border.png")
+        fillButton = self.createToolButton("Fill", Tools.FILL, None)
+        brushButton = self.createToolButton("Brush", Tools.BRUSH, None)
+        vectorPenButton = self.createToolButton("Vector", Tools.VECTOR_PEN, None)
+        strokeEraserButton = self.createToolButton("Stroke Eraser", Tools.STROKE_ERASER, None)
         
         toolbar.addWidget(penButton)
+        toolbar.addWidget(brushButton)
         toolbar.addWidget(eraserButton)
         toolbar.addWidget(selectButton)
+        toolbar.addWidget(fillButton)
+        toolbar.addWidget(vectorPenButton)
+        toolbar.addWidget(strokeEraserButton)
     
     # Adds size control slider and number box to the toolbar
     def createSizeControls(self, toolbar):
@@ -91,6 +171,33 @@ class MainWindow(QMainWindow):
         toolbar.addWidget(self.sizeSlider)
         toolbar.addWidget(self.sizeBox)
     
+    # Adds the brush hardness slider to the toolbar
+    def createBrushControls(self, toolbar):
+        self.hardnessSlider = QSlider(Qt.Horizontal)
+        self.hardnessSlider.setRange(0, 100)
+        self.hardnessSlider.setValue(round(self.canvas.brushHardness * 100))
+        self.hardnessSlider.setMaximumWidth(100)
+        self.hardnessSlider.valueChanged.connect(lambda value: self.canvas.setBrushHardness(value / 100))
+        
+        toolbar.addWidget(QLabel("Hardness:"))
+        toolbar.addWidget(self.hardnessSlider)
+    
+    # Adds the fill tolerance slider and antialias toggle to the toolbar
+    def createFillControls(self, toolbar):
+        self.toleranceSlider = QSlider(Qt.Horizontal)
+        self.toleranceSlider.setRange(0, 255)
+        self.toleranceSlider.setValue(DEFAULT_TOLERANCE if self.canvas.fillTolerance is None else self.canvas.fillTolerance)
+        self.toleranceSlider.setMaximumWidth(100)
+        self.toleranceSlider.valueChanged.connect(self.canvas.setFillTolerance)
+        
+        self.antialiasBox = QCheckBox("Antialias")
+        self.antialiasBox.setChecked(self.canvas.fillAntialias)
+        self.antialiasBox.toggled.connect(self.canvas.setFillAntialias)
+        
+        toolbar.addWidget(QLabel("Tolerance:"))
+        toolbar.addWidget(self.toleranceSlider)
+        toolbar.addWidget(self.antialiasBox)
+    
     # Adds the color picker button to the toolbar
     def createColorPicker(self, toolbar):
         colorButton = self.createButton("Color", self.openColorPicker)
@@ -121,7 +228,7 @@ class MainWindow(QMainWindow):
         if shortcut:
             button.setShortcut(shortcut)
         if icon:
-            button.setIcon(QtGui.QIcon(icon))
+            self.pendingIcons.append((button, icon, text))
         return button
     
     # Creates a tool button (used for pens rn) for the toolbar 
@@ -130,15 +237,32 @@ class MainWindow(QMainWindow):
         button.setCheckable(True)
         button.setChecked(checked)
         button.clicked.connect(lambda: self.setTool(tool))
-        button.setIcon(QtGui.QIcon(icon))
+        # Tool buttons show only their icon, the name stands in until it is loaded
+        button.setText(name)
+        if icon:
+            self.pendingIcons.append((button, icon, ""))
         self.toolButtons.addButton(button)
+        self.toolButtonFor[tool] = button
         return button
     
+    # Sets the toolbar and window icons, deferred so decoding them doesn't hold up the first frame
+    def loadIcons(self):
+        # TODO: Make Icon
+        self.setWindowIcon(QIcon("resources/pencil.png"))
+        for button, icon, text in self.pendingIcons:
+            button.setIcon(QtGui.QIcon(icon))
+            button.setText(text)
+        self.pendingIcons = []
+
     # Sets the current drawing tool (Pencil or Eraser)
     def setTool(self, tool):
         self.canvas.setTool(tool)
-        for button in self.toolButtons.buttons():
-            button.setChecked(button == self.sender())
+
+    # Checks the button of the canvas tool, which paste can also switch
+    def showTool(self, tool):
+        button = self.toolButtonFor.get(tool)
+        if button:
+            button.setChecked(True)
     
     # Updates the pen size when the slider value changes
     def updatePenSize(self, value):
@@ -159,25 +283,18 @@ class MainWindow(QMainWindow):
         except ValueError:
             print("Invalid size value")
 
-    # Updates the history slider to reflect the undo stack size
+    # Updates the history slider to reflect the available versions
     def updateHistorySlider(self):
-        max = len(self.canvas.undoStack)
-        self.historySlider.setMaximum(max)
-        self.historySlider.setValue(max)
-        self.historySlider.setEnabled(max > 0)
+        history = self.canvas.history
+        self.historySlider.blockSignals(True)
+        self.historySlider.setRange(history.firstVersion(), history.lastVersion())
+        self.historySlider.setValue(history.version())
+        self.historySlider.blockSignals(False)
+        self.historySlider.setEnabled(history.lastVersion() > history.firstVersion())
     
-    # Handles changes in the history slider position
+    # Jumps straight to the version under the history slider
     def handleHistoryDelta(self, value):
-        current = self.historySlider.maximum() - self.historySlider.value()
-        target = self.historySlider.maximum() - value
-        diff = target - current
-        
-        if diff > 0:
-            for _ in range(diff):
-                self.canvas.undo()
-        elif diff < 0:
-            for _ in range(-diff):
-                self.canvas.redo()
+        self.canvas.goToVersion(value)
     
     # Performs an undo action and updates the history slider
     def undoAction(self):
@@ -198,4 +315,19 @@ class MainWindow(QMainWindow):
     # Updates the history slider when the mouse is pressed
     def mousePressEvent(self, event):
         super().mousePressEvent(event)
-        self.updateHistorySlider()
\ No newline at end of file
+        self.updateHistorySlider()
+
+    # Offers to restore the work of a session that crashed, then starts autosaving
+    def startAutosave(self, directory=None):
+        directory = directory or defaultDirectory()
+        if findRecovery(directory):
+            answer = QMessageBox.question(self, "Recover Work", "PastEven didn't close properly last time. Recover the autosaved drawing?")
+            if answer == QMessageBox.Yes:
+                self.canvas.recoverAutosave(directory)
+        self.canvas.autosave.start(directory)
+
+    # Lets pending saves reach the disk before the window closes, a clean exit needs no recovery
+    def closeEvent(self, event):
+        self.canvas.waitForSaves()
+        self.canvas.autosave.discard()
+        super().closeEvent(event)
@@ -0,0 +1,136 @@
+from collections import deque
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+# Times named sections of the hot paths (event handlers, painting, undo snapshots, tile uploads).
+# Each name keeps its last samples in a fixed-size ring buffer, so recording stays cheap
+# and memory stays flat however long the app runs.
+class Profiler:
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.enabled = True
+        # name -> deque of (start ns, duration ns, thread id)
+        self.samples = {}
+        self.threadNames = {}
+        self.origin = time.perf_counter_ns()
+
+    def section(self, name):
+        return ProfilerSection(self, name) if self.enabled else NULL_SECTION
+
+    def record(self, name, start, duration):
+        buffer = self.samples.get(name)
+        if buffer is None:
+            buffer = self.samples[name] = deque(maxlen=self.capacity)
+        thread = threading.current_thread()
+        self.threadNames.setdefault(thread.ident, thread.name)
+        buffer.append((start, duration, thread.ident))
+
+    # Samples of name that started within the last window seconds
+    def recent(self, name, window=1.0):
+        buffer = self.samples.get(name)
+        if not buffer:
+            return []
+        since = time.perf_counter_ns() - int(window * 1e9)
+        return [sample for sample in list(buffer) if sample[0] >= since]
+
+    # How many times sections whose name starts with prefix ran in the last window seconds, per second
+    def rate(self, prefix, window=1.0):
+        return sum(len(self.recent(name, window)) for name in list(self.samples) if name.startswith(prefix)) / window
+
+    # Mean and worst duration of name in the last window seconds, in milliseconds
+    def durations(self, name, window=1.0):
+        samples = self.recent(name, window)
+        if not samples:
+            return 0.0, 0.0
+        durations = [duration for _, duration, _ in samples]
+        return sum(durations) / len(durations) / 1e6, max(durations) / 1e6
+
+    def clear(self):
+        self.samples.clear()
+
+    # Writes every buffered sample in Chrome's trace event format (chrome://tracing, Perfetto)
+    def exportTrace(self, path):
+        pid = os.getpid()
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": ident, "args": {"name": threadName}}
+                  for ident, threadName in list(self.threadNames.items())]
+        for name, buffer in list(self.samples.items()):
+            category = name.split(".", 1)[0]
+            for start, duration, ident in list(buffer):
+                events.append({
+                    "name": name,
+                    "cat": category,
+                    "ph": "X",
+                    "ts": (start - self.origin) / 1000,
+                    "dur": duration / 1000,
+                    "pid": pid,
+                    "tid": ident,
+                })
+        events.sort(key=lambda event: event.get("ts", -1))
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+class ProfilerSection:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, time.perf_counter_ns() - self.start)
+        return False
+
+# Stands in for a section while profiling is off
+class NullSection:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_SECTION = NullSection()
+
+# Libraries that are slow to import and are only loaded once a feature needs them
+HEAVY_MODULES = ("numpy", "cv2", "PIL")
+
+# Wall clock time of each startup phase, measured from start (a time.perf_counter() value)
+class StartupTimer:
+    def __init__(self, start=None):
+        self.start = time.perf_counter() if start is None else start
+        self.last = self.start
+        self.phases = []
+
+    # Ends the phase that started at the previous mark
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, (now - self.last) * 1000))
+        self.last = now
+
+    def total(self):
+        return (self.last - self.start) * 1000
+
+    def report(self, budget):
+        lines = [f"{name:<16}{duration:8.1f} ms" for name, duration in self.phases]
+        verdict = "within" if self.total() <= budget else "OVER"
+        lines.append(f"{'total':<16}{self.total():8.1f} ms ({verdict} the {budget} ms budget)")
+        loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+        lines.append(f"Heavy modules loaded: {', '.join(loaded) if loaded else 'none'}")
+        return "\n".join(lines)
+
+# Times a method under name, using the profiler of the object it's called on
+def profiled(name):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(self, *args, **kwargs):
+            with self.profiler.section(name):
+                return function(self, *args, **kwargs)
+        return wrapper
+    return decorate
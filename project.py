@@ -0,0 +1,349 @@
+from PySide6.QtCore import QRect
+from PySide6.QtGui import QImage
+
+from layers import Layer, IMAGE_FORMAT, tileKeysIn
+from history import HistoryEntry
+from savetask import SaveTask
+from imagebuffer import imageView
+from strokes import StrokeLog
+
+import json
+import mmap
+import struct
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# PastEven project file (.pev):
+#   MAGIC, compressed tile chunks..., manifest JSON, FOOTER
+# The manifest sits at the end so tiles can be streamed out while saving,
+# and the footer tells the reader where it is. Every chunk is one tile of raw
+# premultiplied ARGB32 pixels, fully transparent tiles are not stored at all.
+PROJECT_EXTENSION = ".pev"
+MAGIC = b"PEVPROJ1"
+FOOTER = struct.Struct("<QQ8s")
+FORMAT_VERSION = 1
+TILE_SIZE = 256
+
+# What reading a damaged or foreign project can raise
+READ_ERRORS = (OSError, ValueError, KeyError, IndexError, TypeError, struct.error, zlib.error) + \
+    ((zstandard.ZstdError,) if zstandard else ())
+
+def isProjectFile(path):
+    return path.lower().endswith(PROJECT_EXTENSION)
+
+def compress(data, method):
+    if method == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return zlib.compress(data, 1)
+
+def decompress(data, method):
+    if method == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+# Returns the canvas rect of tile (x, y), clipped to an image of the given size
+def tileRect(x, y, width, height, tileSize=TILE_SIZE):
+    return QRect(x * tileSize, y * tileSize, tileSize, tileSize).intersected(QRect(0, 0, width, height))
+
+# Reads the raw pixels of rect out of image without going through a QImage copy
+def readPixels(image, rect):
+    return imageView(image, rect).tobytes()
+
+# Writes raw pixels into rect of image, works while a painter is open on it
+def writePixels(image, rect, data):
+    import numpy as np
+    view = imageView(image, rect, writable=True)
+    view[...] = np.frombuffer(data, dtype=np.uint8).reshape(view.shape)
+
+def clearPixels(image, rect):
+    imageView(image, rect, writable=True)[...] = 0
+
+def imageFromPixels(data, width, height):
+    return QImage(data, width, height, width * 4, IMAGE_FORMAT).copy()
+
+# Captures what a project save needs. QImage copies are implicitly shared,
+# so this costs nothing until the canvas is painted on again. Tiles of a lazily opened
+# project that were never decoded are taken as their compressed chunks instead.
+# version is the document's history version, needed when there is no history to save.
+def snapshotProject(layerStack, history=None, strokeLog=None, version=None):
+    loader = layerStack.tileLoader
+    if loader and loader.tileSize != TILE_SIZE:
+        layerStack.ensureLoaded(layerStack.rect())
+        loader = None
+    chunks = loader.pendingChunks() if loader else {}
+    if version is None:
+        version = history.version() if history else 0
+    # History is only kept if every layer it touched is still in the document
+    savedHistory = None
+    if history and history.entries:
+        indexes = {layer: i for i, layer in enumerate(layerStack.layers)}
+        if all(key[0] in indexes for entry in history.entries for key in entry.before):
+            entries = []
+            for entry in history.entries:
+                # Spilled entries are read back from the spill file
+                before, after = history.entryTiles(entry)
+                entries.append([(indexes[key[0]], key[1], key[2], before[key], after[key]) for key in before])
+            savedHistory = {"baseVersion": history.baseVersion, "index": history.index, "entries": entries}
+    # Without history the project opens at version 0, so strokes are saved as they are
+    # at the current version and live from version 0 on
+    liveAt = None if savedHistory else version
+    snapshot = {
+        "width": layerStack.width(),
+        "height": layerStack.height(),
+        "activeLayer": layerStack.activeIndex,
+        "layers": [{
+            "name": layer.name,
+            "opacity": layer.opacity,
+            "blendMode": layer.blendMode,
+            "visible": layer.visible,
+            "image": QImage(layer.image),
+            "chunks": chunks.get(layer, {}),
+            "vector": layer.vector.toBytes(liveAt) if layer.vector else None,
+        } for layer in layerStack.layers],
+        "chunkCompression": loader.compression if loader else None,
+        "history": savedHistory,
+        "strokes": strokeLog.toBytes(liveAt) if strokeLog and strokeLog.strokes else None,
+    }
+    return snapshot
+
+# Streams a project snapshot to disk
+class ProjectSaveTask(SaveTask):
+    def __init__(self, snapshot, path):
+        super().__init__(path)
+        self.snapshot = snapshot
+        self.compression = "zstd" if zstandard else "zlib"
+
+    def write(self, file):
+        snapshot = self.snapshot
+        width, height = snapshot["width"], snapshot["height"]
+        self.file = file
+        self.offset = file.write(MAGIC)
+
+        layers = []
+        tilesX = (width + TILE_SIZE - 1) // TILE_SIZE
+        tilesY = (height + TILE_SIZE - 1) // TILE_SIZE
+        for i, layer in enumerate(snapshot["layers"]):
+            tiles = {}
+            for y in range(tilesY):
+                for x in range(tilesX):
+                    if (x, y) in layer["chunks"]:
+                        # Never decoded since the project was opened, None for a blank tile
+                        chunk = layer["chunks"][(x, y)]
+                        if chunk is not None:
+                            tiles[f"{x},{y}"] = self.copyChunk(chunk, snapshot["chunkCompression"])
+                        continue
+                    view = imageView(layer["image"], tileRect(x, y, width, height))
+                    if view.any():
+                        tiles[f"{x},{y}"] = self.writeChunk(view.tobytes())
+            layers.append({key: layer[key] for key in ("name", "opacity", "blendMode", "visible")})
+            layers[-1]["tiles"] = tiles
+            if layer["vector"]:
+                layers[-1]["vector"] = self.writeChunk(layer["vector"])
+            self.signals.progress.emit(90 * (i + 1) // len(snapshot["layers"]))
+
+        manifest = {
+            "version": FORMAT_VERSION,
+            "width": width,
+            "height": height,
+            "tileSize": TILE_SIZE,
+            "compression": self.compression,
+            "activeLayer": snapshot["activeLayer"],
+            "layers": layers,
+        }
+        if snapshot["history"]:
+            manifest["history"] = {
+                "baseVersion": snapshot["history"]["baseVersion"],
+                "index": snapshot["history"]["index"],
+                "entries": [[{
+                    "layer": layer, "x": x, "y": y,
+                    "width": before.width(), "height": before.height(),
+                    "before": self.writeChunk(readPixels(before, before.rect())),
+                    "after": self.writeChunk(readPixels(after, after.rect())),
+                } for layer, x, y, before, after in entry] for entry in snapshot["history"]["entries"]],
+            }
+
+        if snapshot.get("strokes"):
+            manifest["strokes"] = self.writeChunk(snapshot["strokes"])
+
+        manifestData = json.dumps(manifest).encode("utf-8")
+        file.write(manifestData)
+        file.write(FOOTER.pack(self.offset, len(manifestData), MAGIC))
+
+    # Compresses and writes one chunk, returns its [offset, length] reference
+    def writeChunk(self, data):
+        return self.writeCompressed(compress(data, self.compression))
+
+    # Writes a chunk compressed with method, only recompressing it if that isn't this file's method
+    def copyChunk(self, data, method):
+        if method != self.compression:
+            data = compress(decompress(data, method), self.compression)
+        return self.writeCompressed(data)
+
+    def writeCompressed(self, data):
+        ref = [self.offset, len(data)]
+        self.offset += self.file.write(data)
+        return ref
+
+# Memory-maps a project file so tiles can be decoded one at a time
+class ProjectReader:
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.data[:len(MAGIC)] != MAGIC or len(self.data) < len(MAGIC) + FOOTER.size:
+                raise ValueError(f"{path} is not a PastEven project")
+            offset, length, magic = FOOTER.unpack(self.data[-FOOTER.size:])
+            if magic != MAGIC:
+                raise ValueError(f"{path} is truncated or corrupt")
+            self.manifest = json.loads(self.data[offset:offset + length].decode("utf-8"))
+        except BaseException:
+            self.file.close()
+            raise
+        if self.manifest["version"] > FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"{path} was saved by a newer version of PastEven")
+        self.compression = self.manifest["compression"]
+
+    def readChunk(self, ref):
+        offset, length = ref
+        return decompress(self.data[offset:offset + length], self.compression)
+
+    # The chunk as stored, still compressed
+    def rawChunk(self, ref):
+        offset, length = ref
+        return self.data[offset:offset + length]
+
+    def close(self):
+        if not self.data.closed:
+            self.data.close()
+        self.file.close()
+
+# Decodes project tiles into their layers the first time something needs them.
+# The layer images start out uninitialized, so every tile is pending: stored ones are
+# decoded and blank ones (ref None) cleared, and memory is only touched tile by tile.
+class ProjectTileLoader:
+    def __init__(self, reader, layerStack, layers):
+        self.reader = reader
+        self.compression = reader.compression
+        self.layerStack = layerStack
+        self.tileSize = reader.manifest["tileSize"]
+        self.pending = {}
+        keys = tileKeysIn(layerStack.rect(), self.tileSize)
+        for layer, info in zip(layers, reader.manifest["layers"]):
+            for x, y in keys:
+                ref = info["tiles"].get(f"{x},{y}")
+                self.pending.setdefault((x, y), []).append((layer, ref))
+                if ref:
+                    layerStack.usedTiles.add((x, y))
+
+    def hasPendingTiles(self):
+        return bool(self.pending)
+
+    # Decodes every pending tile overlapping rect
+    def load(self, rect):
+        rect = QRect(rect).intersected(self.layerStack.rect())
+        if rect.isEmpty() or not self.pending:
+            return
+        size = self.tileSize
+        width, height = self.layerStack.width(), self.layerStack.height()
+        for y in range(rect.top() // size, rect.bottom() // size + 1):
+            for x in range(rect.left() // size, rect.right() // size + 1):
+                tiles = self.pending.pop((x, y), None)
+                if not tiles:
+                    continue
+                area = tileRect(x, y, width, height, size)
+                for layer, ref in tiles:
+                    if isinstance(ref, bytes):
+                        writePixels(layer.image, area, decompress(ref, self.compression))
+                    elif ref:
+                        writePixels(layer.image, area, self.reader.readChunk(ref))
+                    else:
+                        clearPixels(layer.image, area)
+                self.layerStack.refreshCache(area)
+        if not self.pending:
+            self.close()
+
+    # The compressed chunks of tiles that weren't decoded yet as {layer: {(x, y): chunk}},
+    # None for blank tiles. Only copies bytes, nothing is decompressed. The loader keeps
+    # the copies and unmaps the file, so a save can replace the project it was opened from.
+    def pendingChunks(self):
+        if self.reader:
+            for tiles in self.pending.values():
+                tiles[:] = [(layer, self.reader.rawChunk(ref) if ref else None) for layer, ref in tiles]
+            self.reader.close()
+            self.reader = None
+        chunks = {}
+        for key, tiles in self.pending.items():
+            for layer, chunk in tiles:
+                chunks.setdefault(layer, {})[key] = chunk
+        return chunks
+
+    def close(self):
+        self.pending.clear()
+        if self.reader:
+            self.reader.close()
+            self.reader = None
+        if self.layerStack.tileLoader is self:
+            self.layerStack.tileLoader = None
+
+# Replaces the document with the project at path. Layer tiles stay on disk
+# until they are first shown or edited, history tiles are decoded right away.
+# Everything else is decoded before the document is touched, so a damaged file
+# raises one of READ_ERRORS and leaves the current document as it was.
+def openProject(path, layerStack, history, strokeLog=None):
+    from vectorlayer import VectorLayer
+    reader = ProjectReader(path)
+    try:
+        manifest = reader.manifest
+        width, height = manifest["width"], manifest["height"]
+
+        layers = []
+        for info in manifest["layers"]:
+            # Left unfilled, the tile loader writes every tile before it is used and the
+            # memory of tiles that are never shown or edited is never touched
+            layer = Layer(QImage(width, height, IMAGE_FORMAT), info["name"])
+            layer.opacity = info["opacity"]
+            layer.blendMode = info["blendMode"]
+            layer.visible = info["visible"]
+            if "vector" in info:
+                layer.vector = VectorLayer.fromBytes(reader.readChunk(info["vector"]))
+            layers.append(layer)
+        if not layers or not 0 <= manifest["activeLayer"] < len(layers):
+            raise ValueError(f"{path} has no active layer")
+
+        entries = []
+        for tiles in manifest.get("history", {}).get("entries", []):
+            entry = HistoryEntry()
+            for tile in tiles:
+                key = (layers[tile["layer"]], tile["x"], tile["y"])
+                entry.before[key] = imageFromPixels(reader.readChunk(tile["before"]), tile["width"], tile["height"])
+                entry.after[key] = imageFromPixels(reader.readChunk(tile["after"]), tile["width"], tile["height"])
+                entry.bytes += 2 * tile["width"] * tile["height"] * 4
+            entries.append(entry)
+        savedHistory = manifest.get("history", {})
+        # Strokes of vector layers and the stroke log hold absolute versions
+        baseVersion = savedHistory.get("baseVersion", 0)
+        index = min(savedHistory.get("index", 0), len(entries))
+
+        strokes = StrokeLog.fromBytes(reader.readChunk(manifest["strokes"])).strokes if "strokes" in manifest else []
+    except BaseException:
+        reader.close()
+        raise
+
+    layerStack.setLayers(layers, manifest["activeLayer"])
+    layerStack.tileLoader = ProjectTileLoader(reader, layerStack, layers)
+
+    history.clear()
+    for entry in entries:
+        history.entries.append(entry)
+        history.memoryUsed += entry.bytes
+    history.baseVersion = baseVersion
+    history.index = index
+
+    if strokeLog is not None:
+        strokeLog.reset(width, height)
+        strokeLog.strokes = strokes
@@ -0,0 +1,83 @@
+from PySide6.QtCore import QObject, QRunnable, Signal, QBuffer, QIODevice
+
+import os
+import stat
+import tempfile
+
+# Read once at import, the only way to read the umask is to set it, which isn't safe from worker threads
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+# QRunnable can't emit signals itself, so each task carries one of these
+class SaveSignals(QObject):
+    progress = Signal(int)
+    finished = Signal(str)
+    failed = Signal(str, str)
+
+# Renames a finished temp file over path. mkstemp creates files only the owner can read,
+# so the result gets the mode path had before, or the one a newly created file would get.
+def replaceFile(tempPath, path):
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~UMASK
+    os.chmod(tempPath, mode)
+    os.replace(tempPath, path)
+
+# Writes a file off the GUI thread. Subclasses implement write(file).
+# The file is written to a temp file next to the target and renamed over it,
+# so a crash mid-save never leaves a half-written file behind.
+class SaveTask(QRunnable):
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.signals = SaveSignals()
+
+    def run(self):
+        try:
+            self.signals.progress.emit(0)
+            self.writeAtomically()
+            self.signals.progress.emit(100)
+            self.signals.finished.emit(self.path)
+        except Exception as error:
+            self.signals.failed.emit(self.path, str(error))
+
+    def write(self, file):
+        raise NotImplementedError
+
+    def writeAtomically(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tempPath = tempfile.mkstemp(prefix=".pasteven-", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as file:
+                self.write(file)
+                file.flush()
+                os.fsync(file.fileno())
+            replaceFile(tempPath, self.path)
+        except BaseException:
+            if os.path.exists(tempPath):
+                os.remove(tempPath)
+            raise
+
+# Encodes an image snapshot in the format given by the file extension
+class ImageSaveTask(SaveTask):
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, image, path):
+        super().__init__(path)
+        self.image = image
+
+    def write(self, file):
+        data = self.encode()
+        self.signals.progress.emit(50)
+        for offset in range(0, len(data), self.CHUNK_SIZE):
+            file.write(data[offset:offset + self.CHUNK_SIZE])
+            self.signals.progress.emit(50 + 50 * min(offset + self.CHUNK_SIZE, len(data)) // max(len(data), 1))
+
+    def encode(self):
+        imageFormat = os.path.splitext(self.path)[1][1:].upper() or "PNG"
+        buffer = QBuffer()
+        buffer.open(QIODevice.WriteOnly)
+        if not self.image.save(buffer, imageFormat):
+            raise OSError(f"Could not encode image as {imageFormat}")
+        return buffer.data().data()
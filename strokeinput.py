@@ -0,0 +1,105 @@
+from PySide6.QtCore import QObject, QTimer, Qt
+from PySide6.QtGui import QGuiApplication, QPainterPath
+
+# (pressure, x tilt, y tilt) of a point, what a mouse reports
+DEFAULT_SAMPLE = (1.0, 0.0, 0.0)
+
+# Buffers raw pointer positions and hands them to the active stroke tool once per display frame
+class StrokeInput(QObject):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.points = []
+        # Pressure and tilt of each queued point, see DEFAULT_SAMPLE
+        self.samples = []
+        self.tool = None
+        # Last points already handed to the tool, needed to keep smoothed curves continuous
+        self.tail = []
+        self.smoothing = True
+        # Points closer than this to the previous one add nothing visible
+        self.minDistance = 0.5
+
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.setInterval(self.frameInterval())
+        self.timer.timeout.connect(self.flush)
+
+    # Milliseconds per frame of the primary screen, 60 Hz if unknown
+    def frameInterval(self):
+        screen = QGuiApplication.primaryScreen()
+        rate = screen.refreshRate() if screen else 0
+        return max(int(1000 / rate), 1) if rate > 0 else 16
+
+    # Starts a new stroke at point for tool
+    def begin(self, tool, point):
+        self.flush(final=True)
+        self.tool = tool
+        self.tail = [point]
+        self.points = []
+        self.samples = []
+
+    # Queues a point, drawing is deferred to the next frame
+    def push(self, point, sample=DEFAULT_SAMPLE):
+        last = self.points[-1] if self.points else (self.tail[-1] if self.tail else None)
+        if last is not None:
+            delta = point - last
+            if abs(delta.x()) < self.minDistance and abs(delta.y()) < self.minDistance:
+                return
+        self.points.append(point)
+        self.samples.append(sample)
+        if not self.timer.isActive():
+            self.timer.start()
+
+    # Draws everything queued so far, then ends the stroke
+    def end(self):
+        self.flush(final=True)
+        self.tool = None
+        self.tail = []
+
+    # Hands the queued points to the tool as one path. A smoothed curve's tangent at a point depends
+    # on the point after it, so until the stroke ends the newest point waits for the next frame.
+    # If a frame passes without new input the pointer is resting, and the waiting point is drawn
+    # with an end tangent so the line reaches the cursor. The stroke log records that frame as closed.
+    def flush(self, final=False):
+        if not self.points or not self.tool:
+            self.points = []
+            self.samples = []
+            self.timer.stop()
+            return
+        held = 1 if self.smoothing and not final else 0
+        resting = len(self.points) <= held
+        count = len(self.points) if resting else len(self.points) - held
+        points, self.points = self.points[:count], self.points[count:]
+        samples, self.samples = self.samples[:count], self.samples[count:]
+        self.drawFrame(points, samples, self.points[0] if self.points else None)
+        if resting:
+            self.tool.canvas.strokeLog.closeFrame()
+
+    # Draws points as one frame right away, nextPoint being the point that follows them (None at the
+    # end of the stroke). Replay uses it to repeat the recorded frames.
+    def drawFrame(self, points, samples=None, nextPoint=None):
+        points = list(points)
+        path = self.buildPath(self.tail, points, nextPoint)
+        self.tail = (self.tail + points)[-2:]
+        self.tool.drawPath(path, points, list(samples or [DEFAULT_SAMPLE] * len(points)))
+
+    # Builds the path from the last drawn point through points,
+    # as Catmull-Rom splines when smoothing is on and a polyline otherwise
+    def buildPath(self, tail, points, nextPoint=None):
+        path = QPainterPath(tail[-1])
+        if not self.smoothing:
+            for point in points:
+                path.lineTo(point)
+            return path
+
+        controls = tail[-2:] + points
+        if len(tail) < 2:
+            controls.insert(0, tail[-1])
+        # Frames join with the same tangent on both sides, only the stroke's end repeats its last point
+        controls.append(points[-1] if nextPoint is None else nextPoint)
+        # controls[i + 1] -> controls[i + 2] is one segment, with its neighbours as tangents
+        for i in range(len(controls) - 3):
+            p0, p1, p2, p3 = controls[i:i + 4]
+            c1 = p1 + (p2 - p0) / 6.0
+            c2 = p2 - (p3 - p1) / 6.0
+            path.cubicTo(c1, c2, p2)
+        return path
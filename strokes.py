@@ -0,0 +1,195 @@
+from PySide6.QtCore import QPointF
+from PySide6.QtGui import QColor
+
+from array import array
+import struct
+
+from strokeinput import DEFAULT_SAMPLE
+
+# Stroke log (.pevstrokes): LOG_HEADER, then per stroke STROKE_HEADER, its points and its frames.
+# Points are float32 (x, y, pressure, x tilt, y tilt) in canvas coordinates, frames are the point count
+# at the end of each frame the stroke was drawn in. Replaying the same frames through the same
+# path building reproduces the stroke pixel for pixel.
+# A frame drawn while the pointer rested ends with an end tangent instead of looking ahead to the
+# next frame, its count has CLOSED_FRAME set. PEVSTRK2 logs have no such frames and read the same.
+LOG_MAGIC = b"PEVSTRK3"
+LOG_MAGICS = (b"PEVSTRK2", LOG_MAGIC)
+CLOSED_FRAME = 0x80000000
+LOG_HEADER = struct.Struct("<8sIII")
+STROKE_HEADER = struct.Struct("<BBIffiiII")
+POINT_FIELDS = 5
+TOOL_IDS = {"pen": 0, "eraser": 1, "brush": 2}
+TOOL_NAMES = {toolId: name for name, toolId in TOOL_IDS.items()}
+
+# One recorded stroke: its settings plus array-backed points
+class Stroke:
+    def __init__(self, tool, color, size, layer, smoothing=True, hardness=1.0):
+        self.tool = tool
+        # ARGB as returned by QColor.rgba()
+        self.color = color
+        self.size = size
+        self.hardness = hardness
+        self.layer = layer
+        self.smoothing = smoothing
+        # History version the stroke produced, 0 until it is committed
+        self.version = 0
+        self.points = array('f')
+        self.frames = array('I')
+
+    def __len__(self):
+        return len(self.points) // POINT_FIELDS
+
+    def addPoint(self, point, sample=DEFAULT_SAMPLE):
+        self.points.extend((point.x(), point.y(), *sample))
+
+    def endFrame(self):
+        self.frames.append(len(self))
+
+    def closeFrame(self):
+        if self.frames:
+            self.frames[-1] |= CLOSED_FRAME
+
+    def point(self, i, scale=1.0):
+        return QPointF(self.points[POINT_FIELDS * i] * scale, self.points[POINT_FIELDS * i + 1] * scale)
+
+    # (pressure, x tilt, y tilt) of point i
+    def sample(self, i):
+        return tuple(self.points[POINT_FIELDS * i + 2:POINT_FIELDS * (i + 1)])
+
+    # The points and samples of each drawn frame and whether it was closed,
+    # the first frame is the single press point
+    def framePoints(self, scale=1.0):
+        start = 0
+        for frame in self.frames:
+            end = frame & ~CLOSED_FRAME
+            yield ([self.point(i, scale) for i in range(start, end)], [self.sample(i) for i in range(start, end)],
+                   bool(frame & CLOSED_FRAME))
+            start = end
+
+    def bytes(self):
+        return self.points.itemsize * len(self.points) + self.frames.itemsize * len(self.frames)
+
+# Every stroke made on a document, in order. Strokes that were undone are dropped
+# together with history's redo entries, whatever action replaces them (see LayerStack.dropRedo).
+class StrokeLog:
+    def __init__(self, width=0, height=0):
+        self.reset(width, height)
+
+    def reset(self, width, height):
+        self.width = width
+        self.height = height
+        self.strokes = []
+        self.current = None
+
+    def begin(self, tool, color, size, layer, smoothing, hardness=1.0):
+        self.current = Stroke(tool, color, size, layer, smoothing, hardness)
+
+    def addPoints(self, points, samples=None):
+        if self.current:
+            for point, sample in zip(points, samples or [DEFAULT_SAMPLE] * len(points)):
+                self.current.addPoint(point, sample)
+            self.current.endFrame()
+
+    # The last frame ended where the pointer rested, see CLOSED_FRAME
+    def closeFrame(self):
+        if self.current:
+            self.current.closeFrame()
+
+    def end(self, version):
+        stroke, self.current = self.current, None
+        if stroke and len(stroke):
+            stroke.version = version
+            self.strokes.append(stroke)
+
+    # The stroke's history action recorded nothing, so there is no version to log it at
+    def cancel(self):
+        self.current = None
+
+    # Drops strokes newer than version, they were undone and are being overwritten
+    def truncate(self, version):
+        while self.strokes and self.strokes[-1].version > version:
+            self.strokes.pop()
+
+    # Strokes that make up the document at a history version
+    def strokesAt(self, version):
+        return [stroke for stroke in self.strokes if stroke.version <= version]
+
+    def bytes(self):
+        return sum(stroke.bytes() for stroke in self.strokes)
+
+    # With liveAt, only the strokes up to that version are saved, all at version 0
+    def toBytes(self, liveAt=None):
+        strokes = self.strokes if liveAt is None else self.strokesAt(liveAt)
+        parts = [LOG_HEADER.pack(LOG_MAGIC, self.width, self.height, len(strokes))]
+        for stroke in strokes:
+            version = stroke.version if liveAt is None else 0
+            parts.append(STROKE_HEADER.pack(TOOL_IDS[stroke.tool], stroke.smoothing, stroke.color, stroke.size, stroke.hardness,
+                                            stroke.layer, version, len(stroke), len(stroke.frames)))
+            parts.append(stroke.points.tobytes())
+            parts.append(stroke.frames.tobytes())
+        return b"".join(parts)
+
+    @classmethod
+    def fromBytes(cls, data):
+        magic, width, height, count = LOG_HEADER.unpack_from(data)
+        if magic not in LOG_MAGICS:
+            raise ValueError("not a PastEven stroke log")
+        log = cls(width, height)
+        offset = LOG_HEADER.size
+        for _ in range(count):
+            toolId, smoothing, color, size, hardness, layer, version, pointCount, frameCount = STROKE_HEADER.unpack_from(data, offset)
+            offset += STROKE_HEADER.size
+            stroke = Stroke(TOOL_NAMES[toolId], color, size, layer, bool(smoothing), hardness)
+            stroke.version = version
+            pointBytes = pointCount * POINT_FIELDS * stroke.points.itemsize
+            frameBytes = frameCount * stroke.frames.itemsize
+            if offset + pointBytes + frameBytes > len(data):
+                raise ValueError("stroke log is truncated")
+            stroke.points.frombytes(data[offset:offset + pointBytes])
+            offset += pointBytes
+            stroke.frames.frombytes(data[offset:offset + frameBytes])
+            offset += frameBytes
+            log.strokes.append(stroke)
+        return log
+
+    def save(self, path):
+        with open(path, "wb") as file:
+            file.write(self.toBytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as file:
+            return cls.fromBytes(file.read())
+
+# Draws a recorded stroke on canvas through the same tool code live input uses, scaled by scale
+def replayStroke(canvas, stroke, scale=1.0):
+    tool = canvas.strokeTools[stroke.tool]
+    while stroke.layer >= len(canvas.layers.layers):
+        canvas.addLayer()
+    color, size, hardness, smoothing = canvas.color, canvas.ppSize, canvas.brushHardness, canvas.strokeInput.smoothing
+    active = canvas.layers.activeIndex
+    canvas.color = QColor.fromRgba(stroke.color)
+    canvas.ppSize = stroke.size * scale
+    canvas.brushHardness = stroke.hardness
+    canvas.strokeInput.smoothing = stroke.smoothing
+    canvas.layers.setActive(stroke.layer)
+    try:
+        frames = list(stroke.framePoints(scale))
+        points, samples, _ = frames[0]
+        tool.beginStroke(points[0], samples[0])
+        # Each frame was drawn knowing the first point of the next one unless it was closed, see StrokeInput.flush
+        for i, (points, samples, closed) in enumerate(frames[1:], 2):
+            nextPoint = frames[i][0][0] if i < len(frames) and not closed else None
+            canvas.strokeInput.drawFrame(points, samples, nextPoint)
+        tool.endStroke()
+    finally:
+        canvas.color, canvas.ppSize, canvas.brushHardness, canvas.strokeInput.smoothing = color, size, hardness, smoothing
+        canvas.layers.setActive(min(active, len(canvas.layers.layers) - 1))
+
+# Rebuilds the strokes of log (up to a history version) onto canvas, e.g. a fresh canvas
+# created at log.width * scale by log.height * scale for a higher resolution render
+def replayLog(canvas, log, scale=1.0, version=None):
+    strokes = log.strokes if version is None else log.strokesAt(version)
+    for stroke in strokes:
+        replayStroke(canvas, stroke, scale)
+    canvas.historyChanged.emit()
@@ -0,0 +1,6 @@
+# The modules live at the top of the repository and Qt must not need a display
+import os
+import sys
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
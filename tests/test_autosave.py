@@ -0,0 +1,78 @@
+import pytest
+
+pytest.importorskip("PySide6")
+
+from PySide6.QtCore import QRect
+from PySide6.QtGui import QImage, QColor
+
+import os
+import zlib
+
+from layers import IMAGE_FORMAT
+from autosave import (readJournal, findRecovery, writeJournalHeader, basePath, JournalTask,
+                      JOURNAL_NAME, JOURNAL_MAGIC, JOURNAL_HEADER, RECORD, COMMIT)
+
+TOKEN = "0123456789abcdef0123456789abcdef"
+HEADER = JOURNAL_HEADER.pack(JOURNAL_MAGIC, TOKEN.encode("ascii"), b"zlib")
+COMMIT_RECORD = RECORD.pack(COMMIT, 0, 0, 0, 0, 0, 0)
+
+def record(layer, rect, data, checksum=None):
+    return RECORD.pack(layer, rect.x(), rect.y(), rect.width(), rect.height(), len(data),
+                       zlib.crc32(data) if checksum is None else checksum) + data
+
+def writeJournal(tmp_path, *parts):
+    path = tmp_path / JOURNAL_NAME
+    path.write_bytes(HEADER + b"".join(parts))
+    return str(path)
+
+FIRST = (0, QRect(0, 0, 2, 2), zlib.compress(b"\x01" * 16))
+SECOND = (1, QRect(256, 0, 2, 2), zlib.compress(b"\x02" * 16))
+
+def testCommittedBatches(tmp_path):
+    path = writeJournal(tmp_path, record(*FIRST), COMMIT_RECORD, record(*SECOND), COMMIT_RECORD)
+    assert readJournal(path) == (TOKEN, "zlib", [FIRST, SECOND])
+
+def testUncommittedBatchIsIgnored(tmp_path):
+    path = writeJournal(tmp_path, record(*FIRST), COMMIT_RECORD, record(*SECOND))
+    assert readJournal(path)[2] == [FIRST]
+
+def testBadChecksumEndsTheJournal(tmp_path):
+    layer, rect, data = SECOND
+    path = writeJournal(tmp_path, record(*FIRST), COMMIT_RECORD, record(layer, rect, data, zlib.crc32(data) ^ 1),
+                        COMMIT_RECORD, record(*SECOND), COMMIT_RECORD)
+    assert readJournal(path)[2] == [FIRST]
+
+def testRecordCutShortIsIgnored(tmp_path):
+    path = writeJournal(tmp_path, record(*FIRST), COMMIT_RECORD, record(*SECOND)[:RECORD.size + 3])
+    assert readJournal(path)[2] == [FIRST]
+
+def testTruncatedHeader(tmp_path):
+    path = tmp_path / JOURNAL_NAME
+    path.write_bytes(HEADER[:-1])
+    with pytest.raises(ValueError):
+        readJournal(str(path))
+
+def testBadMagic(tmp_path):
+    path = tmp_path / JOURNAL_NAME
+    path.write_bytes(b"NOTAJRNL" + HEADER[8:])
+    with pytest.raises(ValueError):
+        readJournal(str(path))
+
+def testJournalTaskAppendsACommittedBatch(tmp_path):
+    from project import readPixels
+    path = str(tmp_path / JOURNAL_NAME)
+    writeJournalHeader(path, TOKEN, "zlib")
+    tile = QImage(4, 3, IMAGE_FORMAT)
+    tile.fill(QColor(10, 20, 30))
+    rect = QRect(256, 512, 4, 3)
+    JournalTask(path, [(2, rect, tile)], "zlib").run()
+    token, compression, records = readJournal(path)
+    assert (token, compression) == (TOKEN, "zlib")
+    assert [(layer, rect) for layer, rect, data in records] == [(2, rect)]
+    assert zlib.decompress(records[0][2]) == readPixels(tile, tile.rect())
+
+def testFindRecoveryNeedsTheBase(tmp_path):
+    writeJournal(tmp_path, record(*FIRST), COMMIT_RECORD)
+    assert findRecovery(str(tmp_path)) is None
+    open(basePath(str(tmp_path), TOKEN), "wb").close()
+    assert findRecovery(str(tmp_path)) == os.path.join(str(tmp_path), JOURNAL_NAME)
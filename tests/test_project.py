@@ -0,0 +1,112 @@
+import pytest
+
+pytest.importorskip("PySide6")
+
+from PySide6.QtCore import QPointF, QRect
+from PySide6.QtGui import QPainter, QColor
+
+from layers import LayerStack
+from history import TileHistory
+from strokes import StrokeLog
+from vectorlayer import VectorLayer, VectorStroke
+from project import ProjectSaveTask, snapshotProject, openProject
+
+# Spans several tiles, with a partial tile on the right and bottom edges
+WIDTH, HEIGHT = 600, 300
+
+def paint(stack, history, layer, rect, color):
+    history.beginAction(layer)
+    history.markDirty(rect)
+    painter = QPainter(layer.image)
+    painter.fillRect(rect, QColor(color))
+    painter.end()
+    history.commitAction()
+
+# Two layers, three history versions, a vector stroke added at version 1 and a logged stroke at version 2
+@pytest.fixture
+def document(tmp_path):
+    stack = LayerStack(WIDTH, HEIGHT)
+    history = TileHistory(stack, spillDirectory=str(tmp_path))
+    strokeLog = StrokeLog(WIDTH, HEIGHT)
+    background = stack.active()
+    top = stack.addLayer("Top")
+    top.opacity = 0.5
+    top.vector = VectorLayer()
+    top.vector.addStroke(VectorStroke([QPointF(10, 10), QPointF(100, 40)], 0xff00ff00, 4.0))
+    paint(stack, history, top, QRect(0, 0, 1, 1), "#000000")
+    top.vector.commit(history.version())
+    strokeLog.begin("pen", 0xffff0000, 4, 0, True)
+    strokeLog.addPoints([QPointF(5, 5)])
+    paint(stack, history, background, QRect(250, 200, 20, 30), "#ff0000")
+    strokeLog.end(history.version())
+    paint(stack, history, top, QRect(590, 290, 10, 10), "#0000ff")
+    return stack, history, strokeLog
+
+def save(path, stack, history=None, strokeLog=None, version=None):
+    ProjectSaveTask(snapshotProject(stack, history, strokeLog, version), str(path)).writeAtomically()
+
+def openDocument(path, tmp_path):
+    stack = LayerStack(1, 1)
+    history = TileHistory(stack, spillDirectory=str(tmp_path))
+    strokeLog = StrokeLog()
+    openProject(str(path), stack, history, strokeLog)
+    return stack, history, strokeLog
+
+def assertSameLayers(stack, other):
+    other.ensureLoaded(other.rect())
+    assert other.tileLoader is None
+    assert [(layer.name, layer.opacity, layer.visible) for layer in other.layers] == \
+           [(layer.name, layer.opacity, layer.visible) for layer in stack.layers]
+    for layer, otherLayer in zip(stack.layers, other.layers):
+        assert otherLayer.image == layer.image
+
+def testRoundTrip(document, tmp_path):
+    stack, history, strokeLog = document
+    path = tmp_path / "drawing.pev"
+    save(path, stack, history, strokeLog)
+    other, otherHistory, otherLog = openDocument(path, tmp_path)
+    assert other.activeIndex == stack.activeIndex
+    assertSameLayers(stack, other)
+    assert otherHistory.version() == history.version() == 3
+    assert [stroke.version for stroke in otherLog.strokes] == [2]
+    assert other.layers[1].vector.strokes[0].added == 1
+
+    otherHistory.undo()
+    assert other.layers[1].image.pixelColor(595, 295).alpha() == 0
+    assert other.layers[0].image.pixelColor(255, 205).rgba() == QColor("#ff0000").rgba()
+
+def testSaveWithoutHistoryStartsAtVersionZero(document, tmp_path):
+    stack, history, strokeLog = document
+    path = tmp_path / "drawing.pev"
+    save(path, stack, strokeLog=strokeLog, version=history.version())
+    other, otherHistory, otherLog = openDocument(path, tmp_path)
+    assertSameLayers(stack, other)
+    assert otherHistory.version() == 0 and not otherHistory.entries
+    assert other.layers[1].vector.strokes[0].isLive(0)
+    assert [stroke.version for stroke in otherLog.strokes] == [0]
+
+# Tiles never decoded are copied from the file being replaced, which must not stay mapped
+def testResaveOverLazilyOpenedProject(document, tmp_path):
+    stack, history, strokeLog = document
+    path = tmp_path / "drawing.pev"
+    save(path, stack, history, strokeLog)
+    other, otherHistory, otherLog = openDocument(path, tmp_path)
+    assert other.hasPendingTiles()
+    save(path, other, otherHistory, otherLog)
+    assertSameLayers(stack, other)
+    again, againHistory, againLog = openDocument(path, tmp_path)
+    assertSameLayers(stack, again)
+
+@pytest.mark.parametrize("keep", [0, 4, 100, -1])
+def testTruncatedProjectLeavesTheDocumentAlone(document, tmp_path, keep):
+    stack, history, strokeLog = document
+    path = tmp_path / "drawing.pev"
+    save(path, stack, history, strokeLog)
+    data = path.read_bytes()
+    path.write_bytes(data[:keep])
+    other = LayerStack(WIDTH, HEIGHT)
+    otherHistory = TileHistory(other, spillDirectory=str(tmp_path))
+    layers = list(other.layers)
+    with pytest.raises((ValueError, OSError)):
+        openProject(str(path), other, otherHistory)
+    assert other.layers == layers and other.tileLoader is None
@@ -0,0 +1,59 @@
+import pytest
+
+pytest.importorskip("PySide6")
+
+from PySide6.QtCore import QPointF
+
+import struct
+
+from strokes import StrokeLog, LOG_HEADER, CLOSED_FRAME
+
+def makeLog(closed=True):
+    log = StrokeLog(640, 480)
+    log.begin("brush", 0xff102030, 12.5, 1, True, 0.25)
+    log.addPoints([QPointF(1, 2)], [(0.5, 0.0, 0.0)])
+    log.addPoints([QPointF(3, 4), QPointF(5.5, 6.25)], [(0.75, 0.1, -0.2), (1.0, 0.0, 0.0)])
+    if closed:
+        log.closeFrame()
+    log.end(3)
+    log.begin("eraser", 0xff000000, 4, 0, False)
+    log.addPoints([QPointF(7, 8)])
+    log.end(5)
+    return log
+
+def strokeState(stroke):
+    return (stroke.tool, stroke.color, stroke.size, stroke.hardness, stroke.layer, stroke.smoothing,
+            stroke.version, list(stroke.points), list(stroke.frames))
+
+def testRoundTrip():
+    log = makeLog()
+    loaded = StrokeLog.fromBytes(log.toBytes())
+    assert (loaded.width, loaded.height) == (640, 480)
+    assert [strokeState(stroke) for stroke in loaded.strokes] == [strokeState(stroke) for stroke in log.strokes]
+
+def testClosedFrameSurvives():
+    stroke = StrokeLog.fromBytes(makeLog().toBytes()).strokes[0]
+    assert stroke.frames[-1] & CLOSED_FRAME
+    assert [closed for points, samples, closed in stroke.framePoints()] == [False, True]
+    assert [len(points) for points, samples, closed in stroke.framePoints()] == [1, 2]
+
+def testReadsVersion2Logs():
+    log = makeLog(closed=False)
+    data = log.toBytes()
+    loaded = StrokeLog.fromBytes(b"PEVSTRK2" + data[8:])
+    assert [strokeState(stroke) for stroke in loaded.strokes] == [strokeState(stroke) for stroke in log.strokes]
+
+def testLiveAtKeepsOnlyLiveStrokesAtVersionZero():
+    loaded = StrokeLog.fromBytes(makeLog().toBytes(liveAt=4))
+    assert [stroke.tool for stroke in loaded.strokes] == ["brush"]
+    assert loaded.strokes[0].version == 0
+
+def testBadMagic():
+    with pytest.raises(ValueError):
+        StrokeLog.fromBytes(b"NOTALOG!" + makeLog().toBytes()[8:])
+
+@pytest.mark.parametrize("cut", [LOG_HEADER.size - 1, LOG_HEADER.size + 4, -1, -30])
+def testTruncated(cut):
+    data = makeLog().toBytes()
+    with pytest.raises((ValueError, struct.error)):
+        StrokeLog.fromBytes(data[:cut])
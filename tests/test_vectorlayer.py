@@ -0,0 +1,58 @@
+import pytest
+
+pytest.importorskip("PySide6")
+
+from PySide6.QtCore import QPointF
+
+import struct
+
+from vectorlayer import VectorLayer, VectorStroke, VECTOR_HEADER
+
+# kept is live from version 1 on, erased from version 2 until 4
+def makeLayer():
+    layer = VectorLayer()
+    kept = VectorStroke([QPointF(0, 0), QPointF(10, 5), QPointF(20, 0)], 0xff00ff00, 3.0)
+    layer.addStroke(kept)
+    layer.commit(1)
+    erased = VectorStroke([QPointF(50, 50), QPointF(60, 70)], 0xffff0000, 2.0)
+    layer.addStroke(erased)
+    layer.commit(2)
+    layer.eraseStroke(erased)
+    layer.commit(4)
+    return layer, kept, erased
+
+def strokeState(stroke):
+    return (stroke.color, stroke.width, stroke.added, stroke.erased, list(stroke.points))
+
+def testRoundTrip():
+    layer, kept, erased = makeLayer()
+    loaded = VectorLayer.fromBytes(layer.toBytes())
+    assert [strokeState(stroke) for stroke in loaded.strokes] == [strokeState(kept), strokeState(erased)]
+    # The grid index is rebuilt too
+    assert strokeState(loaded.strokeAt(QPointF(10, 5), 4)) == strokeState(kept)
+
+def testPendingChangesAreLeftOut():
+    layer, kept, erased = makeLayer()
+    layer.addStroke(VectorStroke([QPointF(1, 1), QPointF(2, 2)], 0xff0000ff, 1.0))
+    layer.eraseStroke(kept)
+    loaded = VectorLayer.fromBytes(layer.toBytes())
+    assert len(loaded.strokes) == 2
+    assert loaded.strokes[0].erased is None
+
+def testLiveAtRebasesToVersionZero():
+    layer, kept, erased = makeLayer()
+    loaded = VectorLayer.fromBytes(layer.toBytes(liveAt=3))
+    assert [(stroke.added, stroke.erased) for stroke in loaded.strokes] == [(0, None), (0, None)]
+    loaded = VectorLayer.fromBytes(layer.toBytes(liveAt=4))
+    assert [strokeState(stroke)[4] for stroke in loaded.strokes] == [list(kept.points)]
+
+def testBadMagic():
+    data = makeLayer()[0].toBytes()
+    with pytest.raises(ValueError):
+        VectorLayer.fromBytes(b"NOTVECT!" + data[8:])
+
+@pytest.mark.parametrize("cut", [VECTOR_HEADER.size - 1, VECTOR_HEADER.size + 4, -1])
+def testTruncated(cut):
+    data = makeLayer()[0].toBytes()
+    with pytest.raises((ValueError, struct.error)):
+        VectorLayer.fromBytes(data[:cut])
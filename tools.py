@@ -1,12 +1,33 @@
-from PySide6.QtWidgets import QGraphicsRectItem
-from PySide6.QtCore import QRectF, QPointF, QCoreApplication
-from PySide6.QtGui import QPen, Qt, QPainter, QBrush
+from PySide6.QtWidgets import QGraphicsRectItem, QGraphicsPathItem
+from PySide6.QtCore import QRectF, QPointF, QSizeF, QEvent
+from PySide6.QtGui import QPen, Qt, QPainter, QPixmap, QTransform, QPainterPath
+
+import math
+
+from profiler import profiled
+from strokeinput import DEFAULT_SAMPLE
+from brush import DabCache, DAB_SPACING, placeDabs, dabRect, dabDiameter, drawDabs
 
 class Tool:
+    # Vector tools edit the strokes of vector layers, the others paint pixels and stay off them
+    vector = False
+
+    # Every tool's mouse handlers are timed as "<ToolName>.press" / ".move" / ".release"
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for method, phase in (("handleMousePress", "press"), ("handleMouseMove", "move"),
+                              ("handleMouseRelease", "release"), ("handleTabletEvent", "tablet")):
+            if method in cls.__dict__:
+                setattr(cls, method, profiled(f"{cls.__name__}.{phase}")(cls.__dict__[method]))
+
     def __init__(self, canvas):
         self.canvas = canvas
         self.scene = canvas.scene
 
+    @property
+    def profiler(self):
+        return self.canvas.profiler
+
     def handleMousePress(self, event):
         pass
 
@@ -16,155 +37,464 @@ class Tool:
     def handleMouseRelease(self, event):
         pass
 
-class PenTool(Tool):
+    # Called when another tool takes over, removes whatever the tool shows on the canvas
+    def deactivate(self):
+        pass
+
+    # Returns True if the tool used the tablet event, otherwise Qt delivers it again as a mouse event
+    def handleTabletEvent(self, event):
+        return False
+
+    # Returns the pixel rect a stroke segment of the current size can touch
+    def strokeRect(self, startPoint, endPoint):
+        margin = self.canvas.ppSize / 2 + 2
+        return QRectF(startPoint, endPoint).normalized().adjusted(-margin, -margin, margin, margin).toAlignedRect()
+
+# Shared logic for tools that paint a continuous stroke (pen, eraser)
+# One painter is kept open on the canvas image from press to release
+class StrokeTool(Tool):
     def __init__(self, canvas):
         super().__init__(canvas)
         self.lastPoint = None
-        self.drawing = False
+        self.stroking = False
+        self.painter = None
 
     def handleMousePress(self, event):
         if event.button() == Qt.LeftButton:
-            self.lastPoint = self.canvas.mapToScene(event.position().toPoint())
-            self.drawing = True
-            self.canvas.undoStack.append(self.canvas.pixmap.copy())
-            self.canvas.redoStack.clear()
-            self.drawSinglePoint(self.lastPoint)
+            self.beginStroke(self.canvas.mapToScene(event.position().toPoint()))
 
+    # Moves are only queued, strokeInput calls drawPath once per frame
     def handleMouseMove(self, event):
-        if self.drawing:
-            newPoint = self.canvas.mapToScene(event.position().toPoint())
-            self.drawLineTo(newPoint)
-            self.lastPoint = newPoint
+        if self.stroking:
+            self.canvas.strokeInput.push(self.canvas.mapToScene(event.position().toPoint()))
 
     def handleMouseRelease(self, event):
-        if event.button() == Qt.LeftButton:
-            self.drawing = False
+        if event.button() == Qt.LeftButton and self.stroking:
+            self.endStroke()
+
+    # Same as the mouse handlers, with the pen's pressure and tilt
+    def handleTabletEvent(self, event):
+        point = self.canvas.mapToScene(event.position().toPoint())
+        sample = (event.pressure(), event.xTilt(), event.yTilt())
+        if event.type() == QEvent.TabletPress and event.button() == Qt.LeftButton:
+            self.beginStroke(point, sample)
+        elif event.type() == QEvent.TabletMove and self.stroking:
+            self.canvas.strokeInput.push(point, sample)
+        elif event.type() == QEvent.TabletRelease and self.stroking:
+            self.endStroke()
+        return True
+
+    # Opens the stroke painter and draws the first dab, shared by live input and replay
+    def beginStroke(self, point, sample=DEFAULT_SAMPLE):
+        canvas = self.canvas
+        self.lastPoint = point
+        self.stroking = True
+        canvas.history.beginAction(canvas.layers.active())
+        canvas.strokeLog.begin(self.name, canvas.color.rgba(), canvas.ppSize, canvas.layers.activeIndex,
+                               canvas.strokeInput.smoothing, canvas.brushHardness)
+        self.painter = QPainter(canvas.image)
+        self.painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        self.setupPainter(self.painter)
+        canvas.strokeInput.begin(self, point)
+        self.drawSinglePoint(point, sample)
+        canvas.strokeLog.addPoints([point], [sample])
+
+    def endStroke(self):
+        self.canvas.strokeInput.end()
+        self.stroking = False
+        self.painter.end()
+        self.painter = None
+        with self.profiler.section("history.commit"):
+            committed = self.canvas.history.commitAction()
+        if committed:
+            self.canvas.strokeLog.end(self.canvas.history.version())
+        else:
+            self.canvas.strokeLog.cancel()
+
+    # Configures pen and composition mode of the stroke painter
+    def setupPainter(self, painter):
+        pass
 
     def drawLineTo(self, endPoint):
-        painter = QPainter(self.canvas.pixmap)
-        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-        pen = QPen(self.canvas.color, self.canvas.ppSize, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin)
-        painter.setPen(pen)
-        painter.drawLine(self.lastPoint, endPoint)
-        painter.end()
-        self.canvas.pixmapItem.setPixmap(self.canvas.pixmap)
-
-    def drawSinglePoint(self, point):
-        painter = QPainter(self.canvas.pixmap)
-        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-        painter.setPen(QPen(self.canvas.color, 1, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
-        painter.setBrush(QBrush(self.canvas.color))
-        painter.drawEllipse(point, self.canvas.ppSize / 2, self.canvas.ppSize / 2)
-        painter.end()
-        self.canvas.pixmapItem.setPixmap(self.canvas.pixmap)
-        
-class EraserTool(Tool):
+        rect = self.strokeRect(self.lastPoint, endPoint)
+        with self.profiler.section("history.snapshot"):
+            self.canvas.history.markDirty(rect)
+        with self.profiler.section("paint.stroke"):
+            self.painter.drawLine(self.lastPoint, endPoint)
+        self.canvas.updateRect(rect)
+        self.lastPoint = endPoint
+
+    # Draws one frame worth of coalesced input, points are the raw input the path was built from
+    def drawPath(self, path, points, samples=None):
+        rect = self.strokeRect(path.controlPointRect().topLeft(), path.controlPointRect().bottomRight())
+        with self.profiler.section("history.snapshot"):
+            self.canvas.history.markDirty(rect)
+        with self.profiler.section("paint.stroke"):
+            self.painter.drawPath(path)
+        self.canvas.updateRect(rect)
+        self.canvas.strokeLog.addPoints(points, samples)
+        self.lastPoint = points[-1]
+
+    def drawSinglePoint(self, point, sample=DEFAULT_SAMPLE):
+        rect = self.strokeRect(point, point)
+        self.canvas.history.markDirty(rect)
+        self.painter.drawPoint(point)
+        self.canvas.updateRect(rect)
+
+class PenTool(StrokeTool):
+    name = "pen"
+
+    def setupPainter(self, painter):
+        painter.setPen(QPen(self.canvas.color, self.canvas.ppSize, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
+
+class EraserTool(StrokeTool):
+    name = "eraser"
+
+    def setupPainter(self, painter):
+        painter.setCompositionMode(QPainter.CompositionMode_Clear)
+        painter.setPen(QPen(Qt.transparent, self.canvas.ppSize, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
+
+# Soft round brush that follows pressure and tilt. Strokes are drawn as dabs spaced along the
+# smoothed path, stamped from pre-rendered images, and each frame's dabs go into history and
+# onto the screen as one rect.
+class BrushTool(StrokeTool):
+    name = "brush"
+
     def __init__(self, canvas):
         super().__init__(canvas)
-        self.lastPoint = None
-        self.erasing = False
+        self.stamps = DabCache()
+        self.lastSample = DEFAULT_SAMPLE
+        # Distance along the path to the next dab, carried over between frames
+        self.carry = 0.0
+
+    def setupPainter(self, painter):
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+
+    def drawSinglePoint(self, point, sample=DEFAULT_SAMPLE):
+        self.lastSample = sample
+        self.carry = max(dabDiameter(self.canvas.ppSize, sample[0]) * DAB_SPACING, 0.5)
+        self.drawDabs([(point, sample)])
+
+    def drawLineTo(self, endPoint):
+        path = QPainterPath(self.lastPoint)
+        path.lineTo(endPoint)
+        self.drawPath(path, [endPoint], [self.lastSample])
+
+    def drawPath(self, path, points, samples=None):
+        samples = samples or [DEFAULT_SAMPLE] * len(points)
+        dabs, self.carry = placeDabs(path, self.lastPoint, self.lastSample, points, samples, self.canvas.ppSize, self.carry)
+        self.drawDabs(dabs)
+        self.canvas.strokeLog.addPoints(points, samples)
+        self.lastPoint = points[-1]
+        self.lastSample = samples[-1]
+
+    def drawDabs(self, dabs):
+        if not dabs:
+            return
+        canvas = self.canvas
+        rect = dabRect(dabs[0][0], dabDiameter(canvas.ppSize, dabs[0][1][0]))
+        for point, sample in dabs[1:]:
+            rect = rect.united(dabRect(point, dabDiameter(canvas.ppSize, sample[0])))
+        with self.profiler.section("history.snapshot"):
+            canvas.history.markDirty(rect)
+        with self.profiler.section("paint.dabs"):
+            drawDabs(self.painter, self.stamps, dabs, canvas.ppSize, canvas.brushHardness, canvas.color)
+        canvas.updateRect(rect)
 
+# Fills the connected area of similar color under the click with the current color
+class FillTool(Tool):
     def handleMousePress(self, event):
         if event.button() == Qt.LeftButton:
-            self.lastPoint = self.canvas.mapToScene(event.position().toPoint())
+            self.canvas.fillAt(self.canvas.mapToScene(event.position().toPoint()).toPoint())
+
+# Draws strokes into the active vector layer. Only a preview path follows the pointer,
+# the stroke is added to the layer and its tiles rasterized once, on release.
+class VectorPenTool(Tool):
+    vector = True
+
+    def __init__(self, canvas):
+        super().__init__(canvas)
+        self.points = []
+        self.previewPath = None
+        self.previewItem = None
+
+    def handleMousePress(self, event):
+        if event.button() == Qt.LeftButton and self.canvas.layers.active().vector:
+            point = self.canvas.mapToScene(event.position().toPoint())
+            self.points = [point]
+            self.previewPath = QPainterPath(point)
+            self.previewPath.lineTo(point)
+            self.previewItem = self.scene.addPath(self.previewPath, QPen(self.canvas.color, self.canvas.ppSize,
+                                                                         Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
+            self.previewItem.setZValue(1)
+
+    def handleMouseMove(self, event):
+        if self.previewItem:
+            point = self.canvas.mapToScene(event.position().toPoint())
+            delta = point - self.points[-1]
+            if abs(delta.x()) >= 0.5 or abs(delta.y()) >= 0.5:
+                self.points.append(point)
+                self.previewPath.lineTo(point)
+                self.previewItem.setPath(self.previewPath)
+
+    def handleMouseRelease(self, event):
+        if event.button() == Qt.LeftButton and self.previewItem:
+            self.scene.removeItem(self.previewItem)
+            self.previewItem = None
+            self.previewPath = None
+            points, self.points = self.points, []
+            self.canvas.addVectorStroke(points)
+
+# Erases whole strokes of the active vector layer. The stroke under the pointer is outlined,
+# pressing or dragging over strokes erases them, and one drag is one undo step.
+class StrokeEraserTool(Tool):
+    vector = True
+
+    def __init__(self, canvas):
+        super().__init__(canvas)
+        self.erasing = False
+        self.highlightItem = None
+
+    def handleMousePress(self, event):
+        if event.button() == Qt.LeftButton and self.canvas.layers.active().vector:
+            self.highlight(None)
             self.erasing = True
-            self.canvas.undoStack.append(self.canvas.pixmap.copy())
-            self.canvas.redoStack.clear()
-            self.eraseSinglePoint(self.lastPoint)
+            self.canvas.beginStrokeErase()
+            self.canvas.eraseStrokeAt(self.canvas.mapToScene(event.position().toPoint()))
 
     def handleMouseMove(self, event):
+        point = self.canvas.mapToScene(event.position().toPoint())
         if self.erasing:
-            newPoint = self.canvas.mapToScene(event.position().toPoint())
-            self.eraseLineTo(newPoint)
-            self.lastPoint = newPoint
+            self.canvas.eraseStrokeAt(point)
+        else:
+            self.highlight(self.canvas.vectorStrokeAt(point))
 
     def handleMouseRelease(self, event):
-        if event.button() == Qt.LeftButton:
+        if event.button() == Qt.LeftButton and self.erasing:
             self.erasing = False
+            self.canvas.endStrokeErase()
 
-    def eraseLineTo(self, endPoint):
-        painter = QPainter(self.canvas.pixmap)
-        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-        pen = QPen(Qt.transparent, self.canvas.ppSize, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin)
-        painter.setCompositionMode(QPainter.CompositionMode_Clear)
-        painter.setPen(pen)
-        painter.drawLine(self.lastPoint, endPoint)
-        painter.end()
-        self.canvas.pixmapItem.setPixmap(self.canvas.pixmap)
+    def deactivate(self):
+        self.highlight(None)
 
-    def eraseSinglePoint(self, point):
-        painter = QPainter(self.canvas.pixmap)
-        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-        painter.setCompositionMode(QPainter.CompositionMode_Clear)
-        painter.setPen(QPen(Qt.transparent, 1, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
-        painter.setBrush(QBrush(Qt.transparent))
-        painter.drawEllipse(point, self.canvas.ppSize / 2, self.canvas.ppSize / 2)
-        painter.end()
-        self.canvas.pixmapItem.setPixmap(self.canvas.pixmap)
+    # Outlines stroke (None hides the outline), reusing the one scene item
+    def highlight(self, stroke):
+        if stroke is None:
+            if self.highlightItem:
+                self.scene.removeItem(self.highlightItem)
+                self.highlightItem = None
+            return
+        if not self.highlightItem:
+            pen = QPen(Qt.blue, 1, Qt.DashLine)
+            pen.setCosmetic(True)
+            self.highlightItem = QGraphicsPathItem()
+            self.highlightItem.setPen(pen)
+            self.highlightItem.setZValue(1)
+            self.scene.addItem(self.highlightItem)
+        if len(stroke) == 1:
+            path = QPainterPath()
+            path.addEllipse(stroke.point(0), stroke.width / 2, stroke.width / 2)
+            self.highlightItem.setPath(path)
+        else:
+            self.highlightItem.setPath(stroke.path())
 
+# Rectangle selection. Dragging or resizing a selection lifts its pixels into a floating
+# pixmap item: moving, scaling (edges) and rotating (Shift + drag) only change that item's
+# transform, and the pixels are painted back into the layer once, when the selection is committed.
 class RectangleSelectTool(Tool):
     def __init__(self, canvas):
         super().__init__(canvas)
         self.selectRect = None
         self.selectedArea = None
-        self.selectedPixmap = None
         self.isMoving = False
         self.isResizing = False
+        self.isRotating = False
         self.resizeEdge = None
         self.moveOffset = QPointF()
         self.isSelecting = False
         self.startPoint = None
         self.edge_threshold = 10
+        # Floating selection: the lifted pixels, the layer they came from and their rotation
+        self.floatingItem = None
+        self.floatLayer = None
+        self.angle = 0.0
+        self.rotateOffset = 0.0
+        # Set on a press inside a selection that isn't floating yet, the pixels are lifted on the first drag
+        self.pressPoint = None
 
     def startSelect(self, startPoint):
         self.startPoint = startPoint
         self.selectRect = QGraphicsRectItem(QRectF(startPoint, startPoint))
-        self.selectRect.setPen(QPen(Qt.black, 1, Qt.DashLine))
+        self.selectRect.setPen(self.outlinePen())
         self.scene.addItem(self.selectRect)
 
+    # Cosmetic, so it stays one pixel wide when the floating selection is scaled
+    def outlinePen(self):
+        pen = QPen(Qt.black, 1, Qt.DashLine)
+        pen.setCosmetic(True)
+        return pen
+
     def updateSelect(self, endPoint):
         if self.selectRect:
             rect = QRectF(self.startPoint, endPoint)
             self.selectRect.setRect(rect.normalized())
 
-    def finalizeSelect(self, pixmap, endPoint):
+    def finalizeSelect(self, image, endPoint):
         if self.selectRect:
             rect = QRectF(self.startPoint, endPoint).normalized()
-            rect = rect.intersected(pixmap.rect())
-            self.selectedArea = rect
-            self.selectedPixmap = pixmap.copy(rect.toRect())
-            self.scene.removeItem(self.selectRect)
-            self.selectRect = None
+            self.selectedArea = rect.intersected(QRectF(image.rect()))
             self.updateSelectedAreaVisual()
 
     def clearSelection(self):
+        self.commitFloating()
         if self.selectRect:
             self.scene.removeItem(self.selectRect)
         self.selectRect = None
         self.selectedArea = None
-        self.selectedPixmap = None
         self.isMoving = False
         self.isResizing = False
+        self.isRotating = False
         self.resizeEdge = None
+
+    # Cuts the selected pixels out of the active layer into a floating item. The history action
+    # started here stays open until the selection is committed, so the whole move is one undo step.
+    def liftSelection(self):
+        layers = self.canvas.layers
+        rect = self.selectedArea.toAlignedRect().intersected(layers.rect())
+        if rect.isEmpty():
+            return False
+        layer = layers.active()
+        history = self.canvas.history
+        history.beginAction(layer)
+        history.markDirty(rect)
+        pixmap = QPixmap.fromImage(layer.image.copy(rect))
+        painter = QPainter(layer.image)
+        painter.setCompositionMode(QPainter.CompositionMode_Clear)
+        painter.eraseRect(rect)
+        painter.end()
+        self.canvas.updateRect(rect)
+        self.selectedArea = QRectF(rect)
+        self.showFloating(pixmap, layer)
+        return True
+
+    # Drops image in as floating pixels at topLeft over the active layer, like a lifted selection
+    # they only get painted into the layer when the selection is committed
+    def pasteImage(self, image, topLeft):
+        self.clearSelection()
+        layer = self.canvas.layers.active()
+        self.canvas.history.beginAction(layer)
+        self.selectedArea = QRectF(QPointF(topLeft), QSizeF(image.size()))
+        self.updateSelectedAreaVisual()
+        self.showFloating(QPixmap.fromImage(image), layer)
+
+    # Shows pixmap as the floating selection over selectedArea, the outline moves onto it
+    def showFloating(self, pixmap, layer):
+        self.floatLayer = layer
+        self.angle = 0.0
+        self.floatingItem = self.scene.addPixmap(pixmap)
+        self.floatingItem.setTransformationMode(Qt.SmoothTransformation)
+        self.floatingItem.setZValue(1)
+        self.floatingItem.setPos(self.selectedArea.topLeft())
+        # The outline follows the floating pixels through the item's transform
+        self.selectRect.setParentItem(self.floatingItem)
+        self.selectRect.setRect(QRectF(pixmap.rect()))
+
+    # Scale and rotation of the floating pixels, the position is the item's pos
+    def floatingTransform(self):
+        pixmap = self.floatingItem.pixmap()
+        width, height = self.selectedArea.width(), self.selectedArea.height()
+        transform = QTransform()
+        transform.translate(width / 2, height / 2)
+        transform.rotate(self.angle)
+        transform.translate(-width / 2, -height / 2)
+        transform.scale(width / pixmap.width(), height / pixmap.height())
+        return transform
+
+    def updateFloatingItem(self):
+        self.floatingItem.setPos(self.selectedArea.topLeft())
+        self.floatingItem.setTransform(self.floatingTransform())
+
+    # Paints the floating pixels into their layer with the current transform and ends the action
+    def commitFloating(self):
+        if not self.floatingItem:
+            return
+        layers = self.canvas.layers
+        history = self.canvas.history
+        item = self.floatingItem
+        bounds = item.sceneBoundingRect().toAlignedRect().intersected(layers.rect())
+        if not bounds.isEmpty():
+            history.markDirty(bounds)
+            layers.markUsed(bounds)
+            painter = QPainter(self.floatLayer.image)
+            painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+            painter.setTransform(item.sceneTransform())
+            painter.drawPixmap(0, 0, item.pixmap())
+            painter.end()
+            self.canvas.updateRect(bounds)
+        history.commitAction()
+        self.removeFloatingItem()
+        # What's left is a plain selection around the pixels where they landed
+        if not bounds.isEmpty():
+            self.selectedArea = QRectF(bounds)
+            self.updateSelectedAreaVisual()
+        else:
+            self.selectedArea = None
+        self.floatLayer = None
+        self.canvas.historyChanged.emit()
+
+    # Drops the floating pixels, which leaves the lifted area cleared
+    def discardFloating(self):
+        if not self.floatingItem:
+            return
+        self.canvas.history.commitAction()
+        self.removeFloatingItem()
+        self.selectedArea = None
+        self.floatLayer = None
+
+    # Removes the floating item, its outline goes with it
+    def removeFloatingItem(self):
+        self.scene.removeItem(self.floatingItem)
+        self.floatingItem = None
+        self.selectRect = None
+        self.angle = 0.0
+
+    # Maps a scene point into the unrotated frame of the selection
+    def localPoint(self, pos):
+        if not self.angle:
+            return pos
+        center = self.selectedArea.center()
+        transform = QTransform()
+        transform.translate(center.x(), center.y())
+        transform.rotate(-self.angle)
+        transform.translate(-center.x(), -center.y())
+        return transform.map(pos)
+
+    def angleTo(self, pos):
+        delta = pos - self.selectedArea.center()
+        return math.degrees(math.atan2(delta.y(), delta.x()))
     
     def handleMousePress(self, event):
         startPoint = self.canvas.mapToScene(event.position().toPoint())
         if event.button() == Qt.LeftButton:
-            if self.selectedArea and not self.selectedArea.contains(startPoint):
+            if self.selectedArea and not self.hitArea().contains(self.localPoint(startPoint)):
                 self.clearSelection()
             
             if not self.selectedArea:
                 self.isSelecting = True
                 self.startSelect(startPoint)
             else:
-                self.checkResizeStart(startPoint)
+                self.checkResizeStart(startPoint, event.modifiers())
             
     def handleMouseMove(self, event):
         newPoint = self.canvas.mapToScene(event.position().toPoint())
+        if self.pressPoint is not None and newPoint != self.pressPoint and not self.liftOnDrag():
+            return
         if self.isSelecting:
             self.updateSelect(newPoint)
+        elif self.isRotating:
+            self.rotateSelectedArea(newPoint)
         elif self.isResizing:
-            self.resizeSelectedArea(newPoint)
+            self.resizeSelectedArea(self.localPoint(newPoint))
         elif self.isMoving:
             self.moveSelectedArea(newPoint)
         else:
@@ -174,10 +504,14 @@ class RectangleSelectTool(Tool):
         endPoint = self.canvas.mapToScene(event.position().toPoint())
         if event.button() == Qt.LeftButton:
             if self.isSelecting:
-                self.finalizeSelect(self.canvas.pixmap, endPoint)
+                self.finalizeSelect(self.canvas.image, endPoint)
             self.isSelecting = False
             self.finishInteraction()
 
+    # The selection plus the margin where its edges can be grabbed
+    def hitArea(self):
+        return self.selectedArea.adjusted(-self.edge_threshold, -self.edge_threshold,
+                                          self.edge_threshold, self.edge_threshold)
 
     def resizeSelectedArea(self, newPos):
         if not self.selectedArea or not self.resizeEdge:
@@ -196,7 +530,15 @@ class RectangleSelectTool(Tool):
             rect.setBottom(max(newPos.y(), rect.top() + 10))
         
         self.selectedArea = rect
-        self.updateSelectedAreaVisual()
+        if self.floatingItem:
+            self.updateFloatingItem()
+        else:
+            self.updateSelectedAreaVisual()
+
+    def rotateSelectedArea(self, newPos):
+        if self.floatingItem:
+            self.angle = self.angleTo(newPos) - self.rotateOffset
+            self.updateFloatingItem()
 
     def isNearEdge(self, pos, rect):
         left_edge = abs(pos.x() - rect.left()) <= self.edge_threshold
@@ -205,33 +547,47 @@ class RectangleSelectTool(Tool):
         bottom_edge = abs(pos.y() - rect.bottom()) <= self.edge_threshold
         return left_edge, right_edge, top_edge, bottom_edge
     
-    def checkResizeStart(self, pos):
+    def checkResizeStart(self, pos, modifiers=Qt.NoModifier):
         if not self.selectedArea:
             return
         
         rect = self.selectedArea
-        expanded_rect = rect.adjusted(-self.edge_threshold, -self.edge_threshold, 
-                                      self.edge_threshold, self.edge_threshold)
+        local = self.localPoint(pos)
         
-        if expanded_rect.contains(pos):
-            edges = self.isNearEdge(pos, rect)
-            if any(edges):
+        if self.hitArea().contains(local):
+            # A click alone leaves the pixels where they are, see liftOnDrag
+            if not self.floatingItem:
+                self.pressPoint = pos
+            edges = self.isNearEdge(local, rect)
+            if modifiers & Qt.ShiftModifier:
+                self.isRotating = True
+                self.rotateOffset = self.angleTo(pos) - self.angle
+                self.canvas.setCursor(Qt.ClosedHandCursor)
+            elif any(edges):
                 self.isResizing = True
                 self.resizeEdge = edges
                 self.updateCursor(self.resizeEdge)
             else:
                 self.isMoving = True
-                self.moveOffset = pos - rect.topLeft()
+                self.moveOffset = pos - self.selectedArea.topLeft()
                 self.canvas.setCursor(Qt.SizeAllCursor)
         
+    # Any drag turns the selection into floating pixels first. Lifting can snap the area
+    # to whole pixels, so the offsets taken at the press are measured again.
+    def liftOnDrag(self):
+        pos, self.pressPoint = self.pressPoint, None
+        if not self.selectedArea or not self.liftSelection():
+            self.finishInteraction()
+            return False
+        self.moveOffset = pos - self.selectedArea.topLeft()
+        self.rotateOffset = self.angleTo(pos) - self.angle
+        return True
+
     def handleHover(self, pos):
         if self.selectedArea:
-            rect = self.selectedArea
-            expanded_rect = rect.adjusted(-self.edge_threshold, -self.edge_threshold, 
-                                          self.edge_threshold, self.edge_threshold)
-            
-            if expanded_rect.contains(pos):
-                edges = self.isNearEdge(pos, rect)
+            local = self.localPoint(pos)
+            if self.hitArea().contains(local):
+                edges = self.isNearEdge(local, self.selectedArea)
                 if any(edges):
                     self.updateCursor(edges)
                 else:
@@ -256,13 +612,14 @@ class RectangleSelectTool(Tool):
         elif top or bottom:
             self.canvas.setCursor(Qt.SizeVerCursor)
 
+    # Moves the outline to the selected area, reusing the one scene item
     def updateSelectedAreaVisual(self):
         if self.selectedArea:
-            if self.selectRect:
-                self.scene.removeItem(self.selectRect)
-            self.selectRect = QGraphicsRectItem(self.selectedArea)
-            self.selectRect.setPen(QPen(Qt.black, 1, Qt.DashLine))
-            self.scene.addItem(self.selectRect)
+            if not self.selectRect:
+                self.selectRect = QGraphicsRectItem()
+                self.selectRect.setPen(self.outlinePen())
+                self.scene.addItem(self.selectRect)
+            self.selectRect.setRect(self.selectedArea)
 
     def moveSelectedArea(self, newPos):
         if self.selectedArea and self.selectRect:
@@ -272,28 +629,40 @@ class RectangleSelectTool(Tool):
                 self.canvas.setCursor(Qt.SizeAllCursor)
             newTopLeft = newPos - self.moveOffset
             self.selectedArea.moveTopLeft(newTopLeft)
-            self.selectRect.setRect(self.selectedArea)
+            if self.floatingItem:
+                self.floatingItem.setPos(newTopLeft)
+            else:
+                self.selectRect.setRect(self.selectedArea)
 
-    def deleteSelectedArea(self, pixmap):
+    def deleteSelectedArea(self, image):
         if self.selectedArea:
-            painter = QPainter(pixmap)
+            painter = QPainter(image)
             painter.setCompositionMode(QPainter.CompositionMode_Clear)
             painter.eraseRect(self.selectedArea.toRect())
             painter.end()
             self.scene.removeItem(self.selectRect)
             self.selectRect = None
             self.selectedArea = None
-            self.selectedPixmap = None
             return True
         return False
 
     def finishInteraction(self):
+        self.pressPoint = None
         self.isMoving = False
         self.isResizing = False
+        self.isRotating = False
         self.resizeEdge = None
         self.canvas.setCursor(Qt.ArrowCursor)
 
+    # Puts the selection on the clipboard, its pixels are only read out once they're pasted
     def copySelectedArea(self):
-        if self.selectedPixmap:
-            clipboard = QCoreApplication.instance().clipboard()
-            clipboard.setPixmap(self.selectedPixmap)
\ No newline at end of file
+        from clipboard import copyToClipboard
+        if self.floatingItem:
+            pixmap = self.floatingItem.pixmap()
+            copyToClipboard(pixmap, pixmap.rect(), self.selectedArea.topLeft().toPoint())
+        elif self.selectedArea:
+            layers = self.canvas.layers
+            rect = self.selectedArea.toRect().intersected(layers.rect())
+            if not rect.isEmpty():
+                layers.ensureLoaded(rect)
+                copyToClipboard(self.canvas.image, rect, rect.topLeft())
@@ -0,0 +1,303 @@
+from PySide6.QtCore import QPointF, QRectF, QRect, Qt
+from PySide6.QtGui import QPainter, QPainterPath, QPen, QColor
+
+from array import array
+import math
+import struct
+
+from layers import TILE_SIZE, tileKeysIn
+
+# Side of a spatial index cell in canvas pixels
+GRID_CELL = 64
+# Strokes are indexed in runs of this many points, so a hit only measures the segments near it
+RUN_POINTS = 16
+# Pixels past a stroke's edge that still count as touching it
+HIT_TOLERANCE = 3
+# Version of a change whose history action hasn't been committed yet
+PENDING = 0
+
+# Vector layer data (.pev chunk): VECTOR_HEADER, then per stroke STROKE_HEADER and its
+# float32 (x, y) points. A stroke that was never erased is stored with erased = -1.
+VECTOR_MAGIC = b"PEVVECT1"
+VECTOR_HEADER = struct.Struct("<8sI")
+STROKE_HEADER = struct.Struct("<Ifiii")
+
+# Catmull-Rom segments through points as (control 1, control 2, end),
+# the same curves the raster tools draw with smoothing on
+def catmullRom(points):
+    controls = [points[0]] + points + [points[-1]]
+    for i in range(len(controls) - 3):
+        p0, p1, p2, p3 = controls[i:i + 4]
+        yield p1 + (p2 - p0) / 6.0, p2 - (p3 - p1) / 6.0, p2
+
+def distanceToSegment(px, py, ax, ay, bx, by):
+    dx, dy = bx - ax, by - ay
+    length = dx * dx + dy * dy
+    t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / length)) if length else 0.0
+    return math.hypot(px - ax - t * dx, py - ay - t * dy)
+
+# One stroke of a vector layer. It is live between the history version that added it
+# and the one that erased it, so undo and redo only have to restore the layer's pixels.
+class VectorStroke:
+    def __init__(self, points, color, width):
+        self.points = array('f')
+        for point in points:
+            self.points.extend((point.x(), point.y()))
+        # ARGB as returned by QColor.rgba()
+        self.color = color
+        self.width = width
+        self.added = PENDING
+        self.erased = None
+        # Drawing order within the layer, higher is on top
+        self.order = 0
+        self.cachedPath = None
+
+    def __len__(self):
+        return len(self.points) // 2
+
+    def point(self, i):
+        return QPointF(self.points[2 * i], self.points[2 * i + 1])
+
+    def isLive(self, version):
+        return self.added <= version and (self.erased is None or self.erased > version)
+
+    # Point ranges [start, end) the stroke is indexed by, neighbouring runs share a point
+    def runs(self):
+        count = len(self)
+        for start in range(0, max(count - 1, 1), RUN_POINTS - 1):
+            yield start, min(start + RUN_POINTS, count)
+
+    # Canvas area points start to end can touch, padded by the pen and the hit tolerance
+    def bounds(self, start=0, end=None):
+        end = len(self) if end is None else end
+        xs = self.points[2 * start:2 * end:2]
+        ys = self.points[2 * start + 1:2 * end:2]
+        margin = self.width / 2 + HIT_TOLERANCE
+        return QRectF(min(xs) - margin, min(ys) - margin,
+                      max(xs) - min(xs) + 2 * margin, max(ys) - min(ys) + 2 * margin)
+
+    # Distance from point to the polyline through points start to end
+    def distanceTo(self, point, start, end):
+        px, py = point.x(), point.y()
+        p = self.points
+        if end - start < 2:
+            return math.hypot(px - p[2 * start], py - p[2 * start + 1])
+        return min(distanceToSegment(px, py, p[2 * i], p[2 * i + 1], p[2 * i + 2], p[2 * i + 3])
+                   for i in range(start, end - 1))
+
+    def path(self):
+        if self.cachedPath is None:
+            points = [self.point(i) for i in range(len(self))]
+            self.cachedPath = QPainterPath(points[0])
+            for c1, c2, end in catmullRom(points):
+                self.cachedPath.cubicTo(c1, c2, end)
+        return self.cachedPath
+
+    def draw(self, painter):
+        painter.setPen(QPen(QColor.fromRgba(self.color), self.width, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
+        painter.setBrush(Qt.NoBrush)
+        if len(self) == 1:
+            painter.drawPoint(self.point(0))
+        else:
+            painter.drawPath(self.path())
+
+    def svgElement(self):
+        points = [self.point(i) for i in range(len(self))]
+        data = [f"M{points[0].x():.2f} {points[0].y():.2f}"]
+        if len(points) == 1:
+            data.append(f"L{points[0].x():.2f} {points[0].y():.2f}")
+        for c1, c2, end in catmullRom(points):
+            data.append(f"C{c1.x():.2f} {c1.y():.2f} {c2.x():.2f} {c2.y():.2f} {end.x():.2f} {end.y():.2f}")
+        color = QColor.fromRgba(self.color)
+        return (f'<path d="{" ".join(data)}" fill="none" stroke="{color.name()}" stroke-opacity="{color.alphaF():.3f}" '
+                f'stroke-width="{self.width:g}" stroke-linecap="round" stroke-linejoin="round"/>')
+
+# Uniform grid over the canvas mapping each cell to the entries whose rect overlaps it.
+# Strokes are short and local, so a grid answers point and tile queries as well as a tree would.
+class GridIndex:
+    def __init__(self, cellSize=GRID_CELL):
+        self.cellSize = cellSize
+        self.cells = {}
+
+    def cellsIn(self, rect):
+        size = self.cellSize
+        return [(x, y)
+                for y in range(math.floor(rect.top() / size), math.floor(rect.bottom() / size) + 1)
+                for x in range(math.floor(rect.left() / size), math.floor(rect.right() / size) + 1)]
+
+    def insert(self, entry, rect):
+        for cell in self.cellsIn(rect):
+            self.cells.setdefault(cell, set()).add(entry)
+
+    def remove(self, entry, rect):
+        for cell in self.cellsIn(rect):
+            entries = self.cells.get(cell)
+            if entries:
+                entries.discard(entry)
+                if not entries:
+                    del self.cells[cell]
+
+    # Entries in the cells under rect, they may still miss rect itself
+    def query(self, rect):
+        found = set()
+        for cell in self.cellsIn(rect):
+            entries = self.cells.get(cell)
+            if entries:
+                found.update(entries)
+        return found
+
+    def clear(self):
+        self.cells.clear()
+
+# Strokes kept as paths on top of a layer's image. The image is a cache of the live strokes,
+# when strokes change only the tiles under them are drawn again, from the strokes reaching into each tile.
+# Changes made while a history action is open are pending until the action is committed.
+class VectorLayer:
+    def __init__(self):
+        self.strokes = []
+        self.index = GridIndex()
+        self.pending = []
+        self.nextOrder = 0
+
+    def insert(self, stroke):
+        stroke.order = self.nextOrder
+        self.nextOrder += 1
+        self.strokes.append(stroke)
+        for start, end in stroke.runs():
+            self.index.insert((stroke, start, end), stroke.bounds(start, end))
+
+    def unindex(self, stroke):
+        for start, end in stroke.runs():
+            self.index.remove((stroke, start, end), stroke.bounds(start, end))
+
+    # Adds stroke as part of the open history action, returns the area to redraw
+    def addStroke(self, stroke):
+        self.insert(stroke)
+        self.pending.append((stroke, "add"))
+        return stroke.bounds()
+
+    # Erases stroke as part of the open history action, returns the area to redraw
+    def eraseStroke(self, stroke):
+        stroke.erased = PENDING
+        self.pending.append((stroke, "erase"))
+        return stroke.bounds()
+
+    # The history action holding the pending changes became version
+    def commit(self, version):
+        for stroke, change in self.pending:
+            if change == "add":
+                stroke.added = version
+            else:
+                stroke.erased = version
+        self.pending = []
+
+    # The history action was dropped, so are its changes
+    def rollback(self):
+        for stroke, change in reversed(self.pending):
+            if change == "add":
+                self.unindex(stroke)
+                self.strokes.remove(stroke)
+            else:
+                stroke.erased = None
+        self.pending = []
+
+    # Forgets changes made after version, history dropped them as redo
+    def truncate(self, version):
+        dropped = [stroke for stroke in self.strokes if stroke.added > version]
+        for stroke in dropped:
+            self.unindex(stroke)
+        if dropped:
+            self.strokes = [stroke for stroke in self.strokes if stroke.added <= version]
+        for stroke in self.strokes:
+            if stroke.erased is not None and stroke.erased > version:
+                stroke.erased = None
+
+    def clear(self):
+        self.strokes = []
+        self.index.clear()
+        self.pending = []
+
+    # Live strokes reaching into rect, bottom first
+    def strokesIn(self, rect, version):
+        strokes = {stroke for stroke, start, end in self.index.query(rect)
+                   if stroke.isLive(version) and stroke.bounds(start, end).intersects(rect)}
+        return sorted(strokes, key=lambda stroke: stroke.order)
+
+    # Topmost live stroke whose edge is within HIT_TOLERANCE of point
+    def strokeAt(self, point, version):
+        hit = None
+        for stroke, start, end in self.index.query(QRectF(point, point)):
+            if hit is not None and stroke.order <= hit.order:
+                continue
+            if stroke.isLive(version) and stroke.distanceTo(point, start, end) <= stroke.width / 2 + HIT_TOLERANCE:
+                hit = stroke
+        return hit
+
+    # Redraws the tiles of image under rect from the live strokes at version.
+    # Returns the tile aligned rect that was repainted.
+    def rasterize(self, image, rect, version):
+        rect = QRect(rect).intersected(image.rect())
+        repainted = QRect()
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        for x, y in tileKeysIn(rect):
+            tile = QRect(x * TILE_SIZE, y * TILE_SIZE, TILE_SIZE, TILE_SIZE).intersected(image.rect())
+            painter.setClipRect(tile)
+            painter.setCompositionMode(QPainter.CompositionMode_Source)
+            painter.fillRect(tile, Qt.GlobalColor.transparent)
+            painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
+            for stroke in self.strokesIn(QRectF(tile), version):
+                stroke.draw(painter)
+            repainted = repainted.united(tile)
+        painter.end()
+        return repainted
+
+    # Committed strokes only, a pending erase is saved as not erased.
+    # With liveAt, only the strokes live at that version are saved, as live from version 0 on.
+    def toBytes(self, liveAt=None):
+        pending = {stroke for stroke, change in self.pending if change == "add"}
+        strokes = [stroke for stroke in self.strokes if stroke not in pending]
+        if liveAt is not None:
+            strokes = [stroke for stroke in strokes if stroke.isLive(liveAt) or stroke.erased == PENDING]
+        parts = [VECTOR_HEADER.pack(VECTOR_MAGIC, len(strokes))]
+        for stroke in strokes:
+            added = stroke.added if liveAt is None else 0
+            erased = -1 if stroke.erased in (None, PENDING) or liveAt is not None else stroke.erased
+            parts.append(STROKE_HEADER.pack(stroke.color, stroke.width, added, erased, len(stroke)))
+            parts.append(stroke.points.tobytes())
+        return b"".join(parts)
+
+    @classmethod
+    def fromBytes(cls, data):
+        magic, count = VECTOR_HEADER.unpack_from(data)
+        if magic != VECTOR_MAGIC:
+            raise ValueError("not a PastEven vector layer")
+        layer = cls()
+        offset = VECTOR_HEADER.size
+        for _ in range(count):
+            color, width, added, erased, pointCount = STROKE_HEADER.unpack_from(data, offset)
+            offset += STROKE_HEADER.size
+            stroke = VectorStroke([], color, width)
+            pointBytes = pointCount * 2 * stroke.points.itemsize
+            if offset + pointBytes > len(data):
+                raise ValueError("vector layer is truncated")
+            stroke.points.frombytes(data[offset:offset + pointBytes])
+            offset += pointBytes
+            stroke.added = added
+            stroke.erased = None if erased < 0 else erased
+            layer.insert(stroke)
+        return layer
+
+    def svgElements(self, version):
+        return [stroke.svgElement() for stroke in self.strokes if stroke.isLive(version)]
+
+# Writes the live strokes of vector layers, given bottom first as (VectorLayer, opacity), as an SVG file
+def writeSvg(path, width, height, layers, version):
+    lines = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}">']
+    for layer, opacity in layers:
+        lines.append(f'<g opacity="{opacity:.3f}">')
+        lines.extend(layer.svgElements(version))
+        lines.append('</g>')
+    lines.append('</svg>')
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("\n".join(lines) + "\n")